@@ -0,0 +1,180 @@
+"""
+ Measures client throughput, latency and parse cost against a local
+ stand-in for geoapi.fwix.com, so no api key or network is needed.
+
+ Scenarios: serial calls, calls from a pool of threads, the bulk api and
+ the async api, plus parse and memory cost per place and content object.
+ Results are written as json; pass a previous result with --compare to
+ print the relative change. Run from this directory:
+
+   python bench_client.py [--requests N] [--places N] [--latency SECONDS]
+                          [--output FILE] [--compare FILE]
+"""
+
+import json, optparse, platform, sys, time
+from multiprocessing.pool import ThreadPool
+
+sys.path.append('..')
+sys.path.append('../test')
+from fwix_geo_api.fwix_geo_api import *
+from fwix_geo_api.async_api import AsyncFwixApi
+from fwix_geo_api.stats import StatsRegistry
+from fwix_geo_api.throttle import AdaptiveConcurrency
+from fake_server import FakeFwixServer, make_place, make_content
+from bench_models import deep_bytes
+
+kLATITUDE = 37.7874
+kLONGITUDE = -122.3992
+kPARSE_OBJECTS = 5000
+
+
+def percentiles(samples):
+    """ Returns p50/p90/p99 and max of a list of latencies, in milliseconds"""
+    if not samples:
+        return {}
+    samples = sorted(samples)
+    def at(q):
+        return 1000.0 * samples[min(len(samples) - 1, int(q * len(samples)))]
+    return {'p50_ms': at(0.5), 'p90_ms': at(0.9), 'p99_ms': at(0.99), 'max_ms': at(1.0)}
+
+
+def coordinates(count):
+    # distinct coordinates, so coalescing and caches never short-circuit a call
+    return [(kLATITUDE + index * 1e-5, kLONGITUDE) for index in xrange(count)]
+
+
+def new_api(server, threads):
+    registry = StatsRegistry()
+    latencies = []
+    registry.add_hook(lambda call: latencies.append(call.total))
+    fx_api = FwixApi('bench', max_connections = threads, stats = registry,
+                     adaptive_concurrency = AdaptiveConcurrency(initial = threads, maximum = threads))
+    fx_api.kBASE_URL = server.base_url
+    return fx_api, latencies
+
+
+def run_scenario(name, server, requests, threads):
+    fx_api, latencies = new_api(server, threads)
+    points = coordinates(requests)
+    start = time.time()
+    if name == 'serial':
+        for latitude, longitude in points:
+            fx_api.get_places_by_lat_lng(latitude, longitude)
+    elif name == 'threaded':
+        pool = ThreadPool(threads)
+        pool.map(lambda point: fx_api.get_places_by_lat_lng(*point), points)
+        pool.close()
+    elif name == 'bulk':
+        for _, places in fx_api.get_places_bulk(points, max_workers = threads):
+            if isinstance(places, FwixApiError):
+                raise places
+    elif name == 'async':
+        fx_api.close()
+        fx_api, latencies = AsyncFwixApi('bench', max_concurrency = threads), []
+        fx_api._api.kBASE_URL = server.base_url
+        futures = []
+        for latitude, longitude in points:
+            future = fx_api.get_places_by_lat_lng(latitude, longitude)
+            future.add_done_callback(lambda future, sent = time.time(): latencies.append(time.time() - sent))
+            futures.append(future)
+        for future in futures:
+            future.result()
+    elapsed = time.time() - start
+    fx_api.close()
+    result = {'requests': requests,
+              'threads': threads,
+              'seconds': elapsed,
+              'requests_per_second': requests / elapsed}
+    result.update(percentiles(latencies))
+    return result
+
+
+def time_per_object(function, count, repeat = 5):
+    """ Returns the best of repeat runs of function(), in microseconds per object"""
+    best = None
+    for i in xrange(repeat):
+        start = time.time()
+        function()
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return 1e6 * best / count
+
+
+def run_parse(count):
+    """ Returns decode and parse time and memory per object, over count objects"""
+    fx_api = FwixApi('bench')
+    places_body = json.dumps({'places': [make_place(index) for index in xrange(count)]})
+    content_body = json.dumps({'news': [make_content(index) for index in xrange(count)]})
+    raw_places = json.loads(places_body)
+    raw_content = json.loads(content_body)
+    return {
+        'place': {
+            'decode_us': time_per_object(lambda: json.loads(places_body), count),
+            'parse_us': time_per_object(lambda: fx_api._parse_places(raw_places), count),
+            'bytes': deep_bytes(fx_api._parse_places(json.loads(places_body))) / float(count)},
+        'content': {
+            'decode_us': time_per_object(lambda: json.loads(content_body), count),
+            'parse_us': time_per_object(lambda: fx_api._parse_content_list(raw_content), count),
+            'bytes': deep_bytes(fx_api._parse_content_list(json.loads(content_body))) / float(count)}}
+
+
+def compare(results, baseline):
+    """ Prints each metric's change relative to a previous run"""
+    for name, result in sorted(results['scenarios'].items()):
+        previous = baseline['scenarios'].get(name)
+        if previous:
+            print '%-9s throughput %+6.1f%%  p50 %+6.1f%%' % (
+                name,
+                100.0 * (result['requests_per_second'] / previous['requests_per_second'] - 1),
+                100.0 * (result['p50_ms'] / previous['p50_ms'] - 1))
+    for kind in ('place', 'content'):
+        previous = baseline['objects'][kind]
+        result = results['objects'][kind]
+        print '%-9s parse %+6.1f%%  bytes %+6.1f%%' % (
+            kind,
+            100.0 * (result['parse_us'] / previous['parse_us'] - 1),
+            100.0 * (result['bytes'] / previous['bytes'] - 1))
+
+
+def main():
+    parser = optparse.OptionParser(usage = __doc__)
+    parser.add_option('--requests', type = 'int', default = 500)
+    parser.add_option('--threads', type = 'int', default = 8)
+    parser.add_option('--places', type = 'int', default = 20, help = 'places per response')
+    parser.add_option('--content', type = 'int', default = 20, help = 'content items per response')
+    parser.add_option('--latency', type = 'float', default = 0.0, help = 'server latency, in seconds')
+    parser.add_option('--parse-objects', type = 'int', default = kPARSE_OBJECTS,
+                      help = 'objects decoded and parsed for the per-object costs')
+    parser.add_option('--scenarios', default = 'serial,threaded,bulk,async')
+    parser.add_option('--output', help = 'write the json results here instead of stdout')
+    parser.add_option('--compare', help = 'a previous json result to compare with')
+    options, _ = parser.parse_args()
+
+    server = FakeFwixServer(places = options.places, content = options.content).start()
+    server.latency = options.latency
+    try:
+        results = {'python': platform.python_version(),
+                   'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                   'config': dict(options.__dict__),
+                   'scenarios': {},
+                   'objects': run_parse(options.parse_objects)}
+        for name in options.scenarios.split(','):
+            results['scenarios'][name] = run_scenario(name, server, options.requests, options.threads)
+            del server.requests[:]
+    finally:
+        server.stop()
+
+    output = json.dumps(results, indent = 2, sort_keys = True)
+    if options.output:
+        with open(options.output, 'w') as f:
+            f.write(output)
+    else:
+        print output
+    if options.compare:
+        with open(options.compare) as f:
+            compare(results, json.load(f))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,108 @@
+"""
+ Measures the memory used per model object.
+
+ Compares the current FwixDict models with the previous implementation,
+ which stored every field both as a dictionary item and in the instance
+ __dict__. Run from this directory: python bench_models.py [count]
+"""
+
+import sys
+sys.path.append('..')
+from fwix_geo_api.fwix_geo_api import *
+
+kCOUNT = 100000
+
+
+class LegacyFwixDict(dict):
+
+    def __setattr__(self, attr, value):
+        self[attr] = value
+        super(LegacyFwixDict, self).__setattr__(attr, value)
+
+
+class LegacyLocation(LegacyFwixDict):
+
+    def __init__(self, country, province = None, city = None, locality = None,
+                 postal_code = None, address = None):
+        self.country = country
+        self.province = province
+        self.city = city
+        self.locality = locality
+        self.postal_code = postal_code
+        self.address = address
+
+
+class LegacyPlace(LegacyFwixDict):
+
+    def __init__(self, uuid, name, latitude, longitude, phone_number, location,
+                 link, categories, facebook_id = None, twitter_id = None):
+        self.uuid = uuid
+        self.name = name
+        self.latitude = latitude
+        self.longitude = longitude
+        self.phone_number = phone_number
+        self.location = location
+        self.link = link
+        self.categories = categories
+        self.facebook_id = facebook_id
+        self.twitter_id = twitter_id
+
+
+def container_bytes(obj):
+    """ Size of the object and its attribute dictionary, not counting shared values"""
+    size = sys.getsizeof(obj)
+    if hasattr(obj, '__dict__'):
+        size += sys.getsizeof(obj.__dict__)
+    return size
+
+
+def deep_bytes(objects):
+    """ Total size of everything reachable from objects, counting shared values once"""
+    seen = set()
+    total = 0
+    pending = list(objects)
+    while pending:
+        obj = pending.pop()
+        if id(obj) in seen:
+            continue
+        seen.add(id(obj))
+        total += sys.getsizeof(obj)
+        if isinstance(obj, dict):
+            pending.extend(obj.keys())
+            pending.extend(obj.values())
+        elif isinstance(obj, (list, tuple)):
+            pending.extend(obj)
+        if hasattr(obj, '__dict__'):
+            pending.append(obj.__dict__)
+    return total
+
+
+def make_places(place_class, location_class, count):
+    places = []
+    for index in xrange(count):
+        # decoded json hands out a fresh string for every repeated value
+        location = location_class(u''.join(u'US'), u''.join(u'CA'), u''.join(u'San Francisco'),
+                                  postal_code = u''.join(u'94103'))
+        places.append(place_class(u'uuid-%d' % index, u'Place %d' % index, 37.78, -122.39,
+                                  u'555-0100', location, u'http://fwix.com', []))
+    return places
+
+
+def measure(place_class, location_class, count):
+    places = make_places(place_class, location_class, count)
+    place = places[0]
+    return {'place_container_bytes': container_bytes(place),
+            'location_container_bytes': container_bytes(place['location']),
+            'deep_bytes_per_place': deep_bytes(places) / float(count)}
+
+
+if __name__ == '__main__':
+    count = len(sys.argv) > 1 and int(sys.argv[1]) or kCOUNT
+    results = [('current', measure(Place, Location, count)),
+               ('legacy', measure(LegacyPlace, LegacyLocation, count))]
+    for name, result in results:
+        print '%-8s place: %4d bytes  location: %4d bytes  total per place: %7.1f bytes' % (
+            name,
+            result['place_container_bytes'],
+            result['location_container_bytes'],
+            result['deep_bytes_per_place'])
@@ -0,0 +1,127 @@
+"""
+ Measures decode and model construction throughput, in objects per second,
+ for places and for every Content subclass.
+
+ Decoding is timed with each installed json library; model construction is
+ timed both through the models' constructors and through the from_json
+ builders the client parses with. Run from this directory:
+
+   python bench_parse.py [--objects N] [--output FILE]
+"""
+
+import json, optparse, platform, sys, time
+
+sys.path.append('..')
+sys.path.append('../test')
+from fwix_geo_api.fwix_geo_api import *
+from fwix_geo_api import fwix_geo_api
+from fake_server import make_place, make_content
+
+kOBJECTS = 20000
+
+# sample values for the fields each subclass adds to Content
+kEXTRA_VALUES = {'thumbnail': 'http://fwix.com/thumb.jpg',
+                 'rating': 4,
+                 'local_start_time': '2011-01-01 19:00:00',
+                 'local_end_time': '2011-01-01 22:00:00',
+                 'location': '1 Market St',
+                 'price': 500000,
+                 'number_of_beds': 2,
+                 'number_of_baths': 1,
+                 'square_feet': 900,
+                 'property_type': 'condo'}
+
+
+def objects_per_second(function, count, repeat = 5):
+    """ Returns count divided by the best of repeat runs of function()"""
+    best = None
+    for i in xrange(repeat):
+        start = time.time()
+        function()
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return count / best
+
+
+def sample(kind, count):
+    """ Returns count raw json objects of kind, 'place' or a content type"""
+    if kind == 'place':
+        return [make_place(index) for index in xrange(count)]
+    objects = []
+    for index in xrange(count):
+        raw = make_content(index)
+        for key in kCONTENT_TYPE_TO_OBJECT[kind].extra_attributes():
+            raw[key] = kEXTRA_VALUES[key]
+        objects.append(raw)
+    return objects
+
+
+def construct_place(raw):
+    # the keyword-argument path the client used before from_json
+    location = Location(**dict((str(key), raw[key]) for key in FwixApi.LOCATION_KEYS if key in raw))
+    categories = [Category(category['category_id'], category['name'], category.get('parent_id'))
+                  for category in raw['categories']]
+    return Place(raw['uuid'], raw['name'], raw['lat'], raw['lng'], raw['phone_number'],
+                 location, raw['link'], categories)
+
+
+def construct_content(raw, content_type):
+    cls = kCONTENT_TYPE_TO_OBJECT[content_type]
+    fields = {'type': content_type, 'latitude': raw.get('lat'), 'longitude': raw.get('lng')}
+    for key in ('uuid', 'link', 'published_at', 'source', 'title', 'body', 'image', 'author'):
+        fields[key] = raw.get(key)
+    for key in cls.extra_attributes():
+        fields[key] = raw.get(key)
+    return cls(**fields)
+
+
+def run(count):
+    backends = []
+    for name in kJSON_BACKENDS:
+        try:
+            fwix_geo_api._import_json_backend(name)
+        except ImportError:
+            continue
+        backends.append(name)
+    results = {}
+    for kind in ['place'] + sorted(kCONTENT_TYPE_TO_OBJECT):
+        raw = sample(kind, count)
+        body = json.dumps({'objects': raw})
+        if kind == 'place':
+            constructed = lambda: [construct_place(item) for item in raw]
+            built = lambda: [Place.from_json(item) for item in raw]
+        else:
+            cls = kCONTENT_TYPE_TO_OBJECT[kind]
+            constructed = lambda: [construct_content(item, kind) for item in raw]
+            built = lambda: [cls.from_json(item, kind) for item in raw]
+        result = {'constructor_per_second': objects_per_second(constructed, count),
+                  'from_json_per_second': objects_per_second(built, count),
+                  'decode_per_second': {}}
+        for name in backends:
+            loads = fwix_geo_api._import_json_backend(name)[0]
+            result['decode_per_second'][name] = objects_per_second(lambda: loads(body), count)
+        results[kind] = result
+    return results
+
+
+def main():
+    parser = optparse.OptionParser(usage = __doc__)
+    parser.add_option('--objects', type = 'int', default = kOBJECTS)
+    parser.add_option('--output', help = 'write the json results here instead of stdout')
+    options, _ = parser.parse_args()
+
+    results = {'python': platform.python_version(),
+               'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+               'json_backend': get_json_backend(),
+               'objects': run(options.objects)}
+    output = json.dumps(results, indent = 2, sort_keys = True)
+    if options.output:
+        with open(options.output, 'w') as f:
+            f.write(output)
+    else:
+        print output
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,453 @@
+"""
+ Non-blocking client for the Fwix geo api.
+
+ AsyncFwixApi mirrors the public FwixApi methods, but each call returns a
+ FwixFuture immediately instead of blocking. Requests are multiplexed over
+ non-blocking sockets by a single asyncore loop running in a background
+ thread, and at most max_concurrency requests are on the wire at once. Host
+ names are resolved on helper threads, so a slow DNS lookup never stalls the
+ loop, and a request that outlives its timeout fails its future.
+ Request building and model construction are shared with FwixApi, so the
+ results are the same Place, Location, Category and Content objects.
+"""
+
+import asyncore, collections, os, socket, sys, threading, time, urlparse
+
+from .fwix_geo_api import FwixApi, FwixApiError, _start_thread
+
+
+def _split_url(url):
+    """ Returns (host, port, netloc, path) for an http url"""
+    scheme, netloc, path, query, _ = urlparse.urlsplit(url)
+    if scheme != 'http':
+        raise NotImplementedError, 'Only http urls are supported asynchronously'
+    if query:
+        path += '?' + query
+    host, _, port = netloc.partition(':')
+    return host, int(port or 80), netloc, path or '/'
+
+
+class FwixFuture(object):
+    """ The eventual result of an asynchronous api call"""
+
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._done = False
+        self._result = None
+        self._exception = None
+        self._callbacks = []
+
+    def done(self):
+        return self._done
+
+    def result(self, timeout = None):
+        """ Blocks until the call completes, then returns its result or raises its error"""
+        self._wait(timeout)
+        if self._exception is not None:
+            raise self._exception
+        return self._result
+
+    def exception(self, timeout = None):
+        """ Blocks until the call completes, then returns its error (or None)"""
+        self._wait(timeout)
+        return self._exception
+
+    def add_done_callback(self, callback):
+        """ Calls callback(future) once the future completes"""
+        with self._condition:
+            if not self._done:
+                self._callbacks.append(callback)
+                return
+        callback(self)
+
+    def then(self, transform):
+        """ Returns a new future holding transform(result) of this one"""
+        chained = FwixFuture()
+        def on_done(future):
+            if future._exception is not None:
+                chained.set_exception(future._exception)
+                return
+            try:
+                chained.set_result(transform(future._result))
+            except Exception, e:
+                chained.set_exception(e)
+        self.add_done_callback(on_done)
+        return chained
+
+    def set_result(self, result):
+        self._finish(result, None)
+
+    def set_exception(self, exception):
+        self._finish(None, exception)
+
+    def _wait(self, timeout):
+        with self._condition:
+            if not self._done:
+                self._condition.wait(timeout)
+            if not self._done:
+                raise FwixApiError('Timed out waiting for a response')
+
+    def _finish(self, result, exception):
+        with self._condition:
+            if self._done:
+                return
+            self._result = result
+            self._exception = exception
+            self._done = True
+            callbacks, self._callbacks = self._callbacks, []
+            self._condition.notify_all()
+        for callback in callbacks:
+            callback(self)
+
+
+class _HTTPRequest(asyncore.dispatcher):
+    """ A single non-blocking HTTP/1.0 exchange"""
+
+    def __init__(self, transport, address, method, netloc, path, body, headers, future, deadline):
+        asyncore.dispatcher.__init__(self, map = transport._map)
+        self._transport = transport
+        self._future = future
+        self.deadline = deadline
+        lines = ['%s %s HTTP/1.0' % (method, path), 'Host: %s' % netloc]
+        headers = dict(headers or {})
+        if body is not None:
+            headers['Content-Length'] = str(len(body))
+        for name, value in headers.items():
+            lines.append('%s: %s' % (name, value))
+        self._outgoing = '\r\n'.join(lines) + '\r\n\r\n' + (body or '')
+        self._incoming = []
+        family, sockaddr = address
+        self.create_socket(family, socket.SOCK_STREAM)
+        try:
+            self.connect(sockaddr)
+        except socket.error:
+            self.close()
+            raise
+
+    def handle_connect(self):
+        pass
+
+    def writable(self):
+        return bool(self._outgoing)
+
+    def handle_write(self):
+        sent = self.send(self._outgoing)
+        self._outgoing = self._outgoing[sent:]
+
+    def handle_read(self):
+        data = self.recv(65536)
+        if data:
+            self._incoming.append(data)
+
+    def handle_close(self):
+        try:
+            self._finish(self._parse(''.join(self._incoming)), None)
+        except Exception, e:
+            self._finish(None, e)
+
+    def handle_error(self):
+        self._finish(None, sys.exc_info()[1])
+
+    def _finish(self, response, error):
+        self.close()
+        if self._future.done():
+            return
+        if error is None:
+            self._future.set_result(response)
+        else:
+            self._future.set_exception(error)
+        self._transport._request_done()
+
+    def _parse(self, data):
+        """ Returns (status, headers, body) for a raw HTTP response"""
+        head, _, body = data.partition('\r\n\r\n')
+        lines = head.split('\r\n')
+        try:
+            status = int(lines[0].split(' ', 2)[1])
+        except (IndexError, ValueError):
+            raise FwixApiError('Bad Response : %r' % lines[0])
+        headers = {}
+        for line in lines[1:]:
+            name, _, value = line.partition(':')
+            headers[name.strip().lower()] = value.strip()
+        return status, headers, body
+
+
+class _Waker(asyncore.file_dispatcher):
+    """ Wakes the asyncore loop when requests are submitted from other threads"""
+
+    def __init__(self, transport):
+        self._transport = transport
+        self._read_fd, self._write_fd = os.pipe()
+        asyncore.file_dispatcher.__init__(self, self._read_fd, map = transport._map)
+        os.close(self._read_fd)
+
+    def writable(self):
+        return False
+
+    def wake(self):
+        os.write(self._write_fd, 'x')
+
+    def handle_read(self):
+        self.recv(4096)
+        self._transport._start_pending()
+
+    def close(self):
+        asyncore.file_dispatcher.close(self)
+        os.close(self._write_fd)
+
+
+class AsyncTransport(object):
+    """ Runs HTTP requests on non-blocking sockets in a single background thread,
+        with at most max_concurrency requests in flight. timeout is the
+        seconds a request may take, queueing included, before its future
+        fails; None to wait for ever."""
+
+    kDEFAULT_MAX_CONCURRENCY = 10
+    kDEFAULT_TIMEOUT = 60
+    # seconds a resolved host address is reused
+    kDNS_TTL = 60
+
+    def __init__(self, max_concurrency = kDEFAULT_MAX_CONCURRENCY, timeout = kDEFAULT_TIMEOUT):
+        self.max_concurrency = max_concurrency
+        self.timeout = timeout
+        self._map = {}
+        self._lock = threading.Lock()
+        self._pending = collections.deque()
+        self._addresses = {}
+        self._resolving = {}
+        self._active = 0
+        self._running = True
+        self._waker = _Waker(self)
+        self._thread = threading.Thread(target = self._run, name = 'fwix-async-transport')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def request(self, method, url, body = None, headers = None, timeout = None):
+        """ Returns a future for (status, headers, body); timeout overrides
+            the transport's"""
+        future = FwixFuture()
+        if timeout is None:
+            timeout = self.timeout
+        deadline = None
+        if timeout is not None:
+            deadline = time.time() + timeout
+        try:
+            host, port, netloc, path = _split_url(url)
+        except Exception, e:
+            future.set_exception(e)
+            return future
+        request = (method, netloc, path, body, headers, future, deadline)
+        key = (host, port)
+        with self._lock:
+            address, expires = self._addresses.get(key, (None, 0))
+            if address is not None and expires > time.time():
+                self._pending.append((address,) + request)
+                resolve = False
+            elif key in self._resolving:
+                self._resolving[key].append(request)
+                return future
+            else:
+                self._resolving[key] = [request]
+                resolve = True
+        if resolve:
+            _start_thread(self._resolve, key)
+        else:
+            self._waker.wake()
+        return future
+
+    def close(self):
+        """ Stops the loop thread once the in-flight requests finish"""
+        self._running = False
+        self._waker.wake()
+        self._thread.join()
+
+    def _resolve(self, key):
+        """ Looks a host up off the loop thread, then queues the requests
+            waiting on it"""
+        try:
+            family, _, _, _, sockaddr = socket.getaddrinfo(key[0], key[1], socket.AF_INET,
+                                                                  socket.SOCK_STREAM)[0]
+            address, error = (family, sockaddr), None
+        except socket.error, e:
+            address, error = None, e
+        with self._lock:
+            waiting = self._resolving.pop(key)
+            if address is not None:
+                self._addresses[key] = (address, time.time() + self.kDNS_TTL)
+                self._pending.extend((address,) + request for request in waiting)
+        if error is not None:
+            for request in waiting:
+                request[5].set_exception(error)
+        self._waker.wake()
+
+    def _run(self):
+        while self._running or self._active or self._resolving:
+            asyncore.loop(timeout = self._poll_timeout(), map = self._map, count = 1)
+            self._expire()
+        self._waker.close()
+        for pending in self._pending:
+            pending[6].set_exception(FwixApiError('Transport closed'))
+
+    def _poll_timeout(self):
+        """ Returns how long the loop may wait before the next deadline"""
+        deadlines = [dispatcher.deadline for dispatcher in self._map.values()
+                     if getattr(dispatcher, 'deadline', None) is not None]
+        if not deadlines:
+            return 1
+        return max(0, min(1, min(deadlines) - time.time()))
+
+    def _expire(self):
+        """ Fails the requests, sent or queued, whose deadline has passed"""
+        now = time.time()
+        for dispatcher in self._map.values():
+            deadline = getattr(dispatcher, 'deadline', None)
+            if deadline is not None and deadline <= now:
+                dispatcher._finish(None, FwixApiError('Timed out waiting for a response'))
+        with self._lock:
+            expired = [pending for pending in self._pending if pending[7] is not None and pending[7] <= now]
+            if expired:
+                self._pending = collections.deque(pending for pending in self._pending
+                                                  if pending[7] is None or pending[7] > now)
+        for pending in expired:
+            pending[6].set_exception(FwixApiError('Timed out waiting for a connection'))
+
+    def _start_pending(self):
+        while True:
+            with self._lock:
+                if not self._pending or self._active >= self.max_concurrency:
+                    return
+                pending = self._pending.popleft()
+                self._active += 1
+            try:
+                _HTTPRequest(self, *pending)
+            except Exception, e:
+                pending[6].set_exception(e)
+                self._request_done()
+
+    def _request_done(self):
+        with self._lock:
+            self._active -= 1
+        self._start_pending()
+
+
+class AsyncFwixApi(object):
+    """ Asynchronous counterpart of FwixApi. Every public method takes the same
+        arguments as on FwixApi and returns a FwixFuture; call result() on it,
+        or chain further work with then() / add_done_callback().
+
+        Callbacks run on the transport thread and should not block.
+
+        As with FwixApi, identical GETs issued while one is in flight share
+        its response unless coalesce is False. A call that has not answered
+        within timeout seconds fails with FwixApiError.
+    """
+
+    def __init__(self,
+                 api_key,
+                 user_id = None,
+                 max_concurrency = AsyncTransport.kDEFAULT_MAX_CONCURRENCY,
+                 transport = None,
+                 coalesce = True,
+                 timeout = AsyncTransport.kDEFAULT_TIMEOUT):
+        self._api = FwixApi(api_key, user_id)
+        if transport is None:
+            transport = AsyncTransport(max_concurrency, timeout)
+        self._transport = transport
+        self._coalesce = coalesce
+        self._in_flight_lock = threading.Lock()
+        self._in_flight = {}
+
+    def close(self):
+        self._transport.close()
+        self._api.close()
+
+    def get_categories(self):
+        url = self._api.kBASE_URL + '/categories.json'
+        return self._fetch_url(url).then(self._api._parse_categories)
+
+    def get_location(self, latitude, longitude):
+        url = self._api.kBASE_URL + '/location.json'
+        params = {self._api.kLAT_KEY : latitude, self._api.kLNG_KEY: longitude}
+        return self._fetch_url(url, params).then(self._api._parse_location)
+
+    def get_place(self, uuid):
+        url = self._api.kBASE_URL + '/places/%s.json' % uuid
+        return self._fetch_url(url).then(lambda raw_place: self._api._parse_place(raw_place['place']))
+
+    def generic_get_places(self, params):
+        url = self._api.kBASE_URL + self._api.kPLACES_PATH
+        return self._fetch_url(url, params).then(self._api._parse_places)
+
+    def get_places_by_lat_lng(self, latitude, longitude, page = None, radius = None, categories = None):
+        params = {self._api.kLAT_KEY: latitude, self._api.kLNG_KEY: longitude}
+        params.update(self._api._place_filters(page, radius, categories))
+        return self.generic_get_places(params)
+
+    def get_places_by_postal_code(self, postal_code, page = None, radius = None, categories = None):
+        params = {self._api.kPOSTAL_CODE_KEY: postal_code}
+        params.update(self._api._place_filters(page, radius, categories))
+        return self.generic_get_places(params)
+
+    def get_places_by_location(self, location, page = None, radius = None, categories = None):
+        params = location.get_query_map()
+        params.update(self._api._place_filters(page, radius, categories))
+        return self.generic_get_places(params)
+
+    def update_place_given_place(self, place):
+        url = self._api.kBASE_URL + '/places/%s.json' % place[self._api.kUUID_KEY]
+        return self._fetch_url(url, self._api._place_update_params(place), self._api.kPOST_REQUEST)
+
+    def update_place(self, uuid, *args, **kwargs):
+        params = self._api._update_params(*args, **kwargs)
+        url = self._api.kBASE_URL + '/places/%s.json' % uuid
+        return self._fetch_url(url, params, self._api.kPOST_REQUEST)
+
+    def delete_place(self, uuid):
+        url = self._api.kBASE_URL + '/places/%s.json' % uuid
+        return self._fetch_url(url, request_type = self._api.kDELETE_REQUEST).then(self._api._parse_delete)
+
+    def generic_get_content(self, params, content_types, page, range, sort_by, search_query):
+        url = self._api.kBASE_URL + self._api.kCONTENT_PATH
+        params = self._api._content_params(params, content_types, page, range, sort_by, search_query)
+        return self._fetch_url(url, params).then(self._api._parse_content_list)
+
+    def get_content_by_lat_lng(self, latitude, longitude, content_types,
+                               page = None, range = None, sort_by = None, search_query = None):
+        params = {self._api.kLAT_KEY: latitude, self._api.kLNG_KEY: longitude}
+        return self.generic_get_content(params, content_types, page, range, sort_by, search_query)
+
+    def get_content_by_postal_code(self, postal_code, content_types,
+                                   page = None, range = None, sort_by = None, search_query = None):
+        params = {self._api.kPOSTAL_CODE_KEY: postal_code}
+        return self.generic_get_content(params, content_types, page, range, sort_by, search_query)
+
+    def get_content_by_location(self, location, content_types,
+                                page = None, range = None, sort_by = None, search_query = None):
+        params = location.url_friendly()
+        return self.generic_get_content(params, content_types, page, range, sort_by, search_query)
+
+    def get_content_by_place(self, place_uuid, content_types,
+                             page = None, range = None, sort_by = None, search_query = None):
+        params = {'place_id': place_uuid}
+        return self.generic_get_content(params, content_types, page, range, sort_by, search_query)
+
+    def _fetch_url(self, base_url, query_map = None, request_type = FwixApi.kGET_REQUEST):
+        """ Returns a future for the decoded json response"""
+        url, post_args, headers = self._api._build_request(base_url, query_map, request_type)
+        def decode(response):
+            status, headers, body = response
+            return self._api._check_response(status, self._api._decode_body(status, body))
+        if not self._coalesce or request_type != FwixApi.kGET_REQUEST:
+            return self._transport.request(request_type, url, post_args, headers).then(decode)
+        with self._in_flight_lock:
+            future = self._in_flight.get(url)
+            if future is not None:
+                return future
+            future = self._in_flight[url] = self._transport.request(request_type, url).then(decode)
+        def forget(done):
+            with self._in_flight_lock:
+                if self._in_flight.get(url) is done:
+                    del self._in_flight[url]
+        future.add_done_callback(forget)
+        return future
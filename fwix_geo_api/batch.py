@@ -0,0 +1,181 @@
+"""
+ Batched place writes for FwixApi.
+
+ A PlaceWriteBatcher queues place updates and deletes instead of sending
+ them one at a time. Updates to the same uuid are merged field by field
+ (the last write wins), a delete drops the updates queued before it, an
+ update of a place queued for deletion raises FwixApiError, and flush()
+ sends what is left in parallel, reporting per uuid. Coordinates
+ are queued under the lat/lng keys update_place sends, whichever spelling
+ the update came with, so that merged updates never carry both.
+"""
+
+import collections, threading
+
+from .fwix_geo_api import FwixApi, FwixApiError
+
+
+class WriteResult(object):
+    """ The outcome of the write sent for one uuid.
+
+        action - 'update' or 'delete'
+        mutations - the number of queued mutations the write replaced
+        ok - whether it succeeded
+        result - the api response on success
+        error - the FwixApiError on failure
+    """
+
+    __slots__ = ('uuid', 'action', 'mutations', 'ok', 'result', 'error')
+
+    def __init__(self, uuid, action, mutations, ok, result = None, error = None):
+        self.uuid = uuid
+        self.action = action
+        self.mutations = mutations
+        self.ok = ok
+        self.result = result
+        self.error = error
+
+    def __repr__(self):
+        return 'WriteResult(%r, %r, ok=%r)' % (self.uuid, self.action, self.ok)
+
+
+class _PendingWrite(object):
+
+    __slots__ = ('action', 'params', 'mutations')
+
+    def __init__(self, action, params):
+        self.action = action
+        self.params = params
+        self.mutations = 1
+
+
+class PlaceWriteBatcher(object):
+    """ Queues place mutations and flushes them with bounded concurrency.
+
+        fx_api - the FwixApi to write through
+        max_workers - writes in flight at once during a flush
+        auto_flush - send whenever this many uuids are pending, None to only
+                     send when flushed or on leaving a with block
+    """
+
+    kUPDATE = 'update'
+    kDELETE = 'delete'
+    kCOORDINATE_KEYS = {FwixApi.kLATITUDE_KEY: FwixApi.kLAT_KEY,
+                        FwixApi.kLONGITUDE_KEY: FwixApi.kLNG_KEY}
+
+    def __init__(self,
+                 fx_api,
+                 max_workers = FwixApi.kDEFAULT_BULK_WORKERS,
+                 auto_flush = None):
+        self.fx_api = fx_api
+        self.max_workers = max_workers
+        self.auto_flush = auto_flush
+        self._lock = threading.Lock()
+        self._pending = collections.OrderedDict()
+        self._results = collections.OrderedDict()
+        self._stats = {'queued': 0, 'merged': 0, 'superseded': 0, 'sent': 0, 'failed': 0}
+
+    def __len__(self):
+        return len(self._pending)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self._send()
+
+    def update_place(self,
+                     uuid,
+                     latitude = None,
+                     longitude = None,
+                     name = None,
+                     city = None,
+                     address = None,
+                     country = None,
+                     province = None,
+                     postal_code = None,
+                     phone_number = None,
+                     category = None):
+        """ Queues an update of the given fields, like FwixApi.update_place.
+            Raises FwixApiError if the place is queued for deletion."""
+        params = self.fx_api._update_params(latitude, longitude, name, city, address, country,
+                                            province, postal_code, phone_number, category)
+        self._queue(uuid, self.kUPDATE, params)
+
+    def update_place_given_place(self, place):
+        """ Queues an update from a place object, like FwixApi.update_place_given_place.
+            Raises FwixApiError if the place is queued for deletion."""
+        self._queue(place[FwixApi.kUUID_KEY], self.kUPDATE, self.fx_api._place_update_params(place))
+
+    def delete_place(self, uuid):
+        """ Queues a delete, which supersedes any update queued for the place"""
+        self._queue(uuid, self.kDELETE, None)
+
+    def flush(self):
+        """ Sends every pending write and returns {uuid: WriteResult}, in the
+            order the uuids were first queued, for the writes sent since the
+            last flush (including those sent automatically)"""
+        self._send()
+        with self._lock:
+            results, self._results = self._results, collections.OrderedDict()
+        return results
+
+    def stats(self):
+        """ Returns queued, merged, superseded, sent and failed counters"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats['pending'] = len(self._pending)
+        return stats
+
+    def _queue(self, uuid, action, params):
+        if params:
+            params = dict((self.kCOORDINATE_KEYS.get(key, key), value)
+                          for key, value in params.items())
+        with self._lock:
+            write = self._pending.get(uuid)
+            if write is not None and write.action == self.kDELETE and action == self.kUPDATE:
+                raise FwixApiError('Place %s is queued for deletion, its update was not queued' % uuid)
+            self._stats['queued'] += 1
+            if write is None:
+                self._pending[uuid] = _PendingWrite(action, params)
+            elif action == self.kDELETE:
+                write.action, write.params = action, None
+                write.mutations += 1
+                self._stats['superseded'] += 1
+            else:
+                write.params.update(params)
+                write.mutations += 1
+                self._stats['merged'] += 1
+            full = self.auto_flush is not None and len(self._pending) >= self.auto_flush
+        if full:
+            self._send()
+
+    def _send(self):
+        with self._lock:
+            pending, self._pending = self._pending, collections.OrderedDict()
+        if not pending:
+            return
+        order = list(pending)
+        def call(uuid):
+            write = pending[uuid]
+            if write.action == self.kDELETE:
+                return self.fx_api.delete_place(uuid)
+            return self.fx_api._post_place_update(uuid, write.params)
+        results = {}
+        for uuid, result in self.fx_api._bulk(call, order, self.max_workers, False):
+            write = pending[uuid]
+            if isinstance(result, FwixApiError):
+                results[uuid] = WriteResult(uuid, write.action, write.mutations, False, error = result)
+            elif write.action == self.kDELETE and not result:
+                error = FwixApiError('Delete of %s was not acknowledged' % uuid)
+                results[uuid] = WriteResult(uuid, write.action, write.mutations, False, error = error)
+            else:
+                results[uuid] = WriteResult(uuid, write.action, write.mutations, True, result)
+        with self._lock:
+            for uuid in order:
+                result = results[uuid]
+                self._results[uuid] = result
+                self._stats['sent'] += 1
+                if not result.ok:
+                    self._stats['failed'] += 1
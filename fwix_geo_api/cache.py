@@ -0,0 +1,514 @@
+"""
+ Response caches for FwixApi.
+
+ A ResponseCache maps a normalized request (url path plus sorted query,
+ without the api key) to the decoded json response. Only GET responses are
+ cached; a successful POST or DELETE to a url invalidates the entries for
+ that url.
+
+ A SQLiteCache keeps the same entries in a SQLite database on disk, so that
+ every worker process on a machine shares one warm cache.
+
+ A LocationCache answers get_location from geohash cells, so nearby points
+ share one reverse-geocode request.
+
+ A ValidatorCache keeps ETag / Last-Modified validators with parsed objects,
+ so that rarely changing resources can be revalidated with conditional GETs.
+"""
+
+import collections, os, sqlite3, threading, time, urllib, urlparse, zlib
+try:
+    import json
+except ImportError:
+    import simplejson as json
+
+from .geo import geohash_encode, geohash_neighbors
+
+
+def _encode(value):
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+    return str(value)
+
+
+class ResponseCache(object):
+    """ A thread-safe, size-bounded LRU cache with per-endpoint TTLs.
+
+        max_entries - the number of responses kept before the least recently
+                      used one is evicted
+        ttls - a dictionary of url path prefix to time-to-live in seconds; the
+               longest matching prefix wins. A ttl of 0 disables caching for
+               that endpoint.
+        default_ttl - time-to-live for paths not matched by ttls
+        max_stale - seconds an expired response is kept past its ttl, for
+                    get_stale to fall back on when the api is failing
+    """
+
+    kDEFAULT_MAX_ENTRIES = 1024
+    kDEFAULT_TTL = 300
+    kDEFAULT_TTLS = {'/categories.json': 24 * 60 * 60,
+                     '/location.json': 24 * 60 * 60,
+                     '/places/': 60 * 60,
+                     '/places.json': 5 * 60,
+                     '/content.json': 60}
+    kIGNORED_PARAMS = ('api_key',)
+
+    def __init__(self,
+                 max_entries = kDEFAULT_MAX_ENTRIES,
+                 ttls = None,
+                 default_ttl = kDEFAULT_TTL,
+                 max_stale = 0):
+        self.max_entries = max_entries
+        self.ttls = dict(self.kDEFAULT_TTLS)
+        if ttls:
+            self.ttls.update(ttls)
+        self.default_ttl = default_ttl
+        self.max_stale = max_stale
+        self._lock = threading.Lock()
+        self._entries = collections.OrderedDict()
+        self._paths = {}
+        self._stats = {'hits': 0,
+                       'stale_hits': 0,
+                       'misses': 0,
+                       'evictions': 0,
+                       'expirations': 0,
+                       'invalidations': 0}
+
+    def key(self, url, query_map = None):
+        """ Returns the cache key for a request"""
+        scheme, netloc, path, _, _ = urlparse.urlsplit(url)
+        params = sorted((str(key), _encode(value))
+                        for key, value in (query_map or {}).items()
+                        if key not in self.kIGNORED_PARAMS)
+        return '%s://%s%s' % (scheme.lower(), netloc.lower(), path), urllib.urlencode(params)
+
+    def ttl(self, key):
+        """ Returns the time-to-live for the endpoint of key"""
+        path = urlparse.urlsplit(key[0])[2]
+        best = None
+        for prefix in self.ttls:
+            if path.startswith(prefix) and (best is None or len(prefix) > len(best)):
+                best = prefix
+        if best is None:
+            return self.default_ttl
+        return self.ttls[best]
+
+    def get(self, key):
+        """ Returns the cached response for key, or None"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._stats['misses'] += 1
+                return None
+            value, expires = entry
+            now = time.time()
+            if expires < now:
+                if expires + self.max_stale < now:
+                    self._remove(key)
+                    self._stats['expirations'] += 1
+                self._stats['misses'] += 1
+                return None
+            del self._entries[key]
+            self._entries[key] = entry
+            self._stats['hits'] += 1
+            return value
+
+    def get_stale(self, key):
+        """ Returns the response for key even if it has expired, as long as it
+            is within max_stale of its ttl, or None"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[1] + self.max_stale < time.time():
+                return None
+            self._stats['stale_hits'] += 1
+            return entry[0]
+
+    def set(self, key, value):
+        """ Stores a response under key, evicting the least recently used entries"""
+        ttl = self.ttl(key)
+        if ttl <= 0:
+            return
+        with self._lock:
+            if key in self._entries:
+                del self._entries[key]
+            self._entries[key] = (value, time.time() + ttl)
+            self._paths.setdefault(key[0], set()).add(key)
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+                self._stats['evictions'] += 1
+
+    def invalidate(self, url):
+        """ Drops every cached response for url, whatever its query"""
+        path = self.key(url)[0]
+        with self._lock:
+            for key in list(self._paths.get(path, ())):
+                self._remove(key)
+                self._stats['invalidations'] += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._paths.clear()
+
+    def stats(self):
+        """ Returns hit, stale hit, miss, eviction, expiration and invalidation counters"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats['size'] = len(self._entries)
+        return stats
+
+    def _remove(self, key):
+        del self._entries[key]
+        keys = self._paths[key[0]]
+        keys.discard(key)
+        if not keys:
+            del self._paths[key[0]]
+
+
+class SQLiteCache(ResponseCache):
+    """ A response cache stored in a SQLite database in WAL mode, safe for
+        concurrent readers and writers across threads and processes.
+
+        path - the database file, created if missing
+        max_entries / max_bytes - once exceeded, the least recently used
+                                  entries are evicted
+        compress - zlib compress the stored json
+        ttls / default_ttl / max_stale - as for ResponseCache
+
+        Hit and miss counters are kept per process.
+    """
+
+    kDEFAULT_MAX_ENTRIES = 100000
+    kDEFAULT_MAX_BYTES = 256 * 1024 * 1024
+    kEVICTION_INTERVAL = 100
+    kTOUCH_INTERVAL = 60
+    kBUSY_TIMEOUT = 30
+
+    def __init__(self,
+                 path,
+                 max_entries = kDEFAULT_MAX_ENTRIES,
+                 max_bytes = kDEFAULT_MAX_BYTES,
+                 compress = True,
+                 ttls = None,
+                 default_ttl = ResponseCache.kDEFAULT_TTL,
+                 max_stale = 0):
+        super(SQLiteCache, self).__init__(max_entries, ttls, default_ttl, max_stale)
+        self.path = path
+        self.max_bytes = max_bytes
+        self.compress = compress
+        self._local = threading.local()
+        self._writes = 0
+        connection = self._connection()
+        with connection:
+            connection.execute('CREATE TABLE IF NOT EXISTS responses ('
+                               'url TEXT NOT NULL, query TEXT NOT NULL, body BLOB NOT NULL, '
+                               'size INTEGER NOT NULL, expires REAL NOT NULL, accessed REAL NOT NULL, '
+                               'PRIMARY KEY (url, query))')
+            connection.execute('CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)')
+
+    def get(self, key):
+        now = time.time()
+        connection = self._connection()
+        row = connection.execute('SELECT body, expires, accessed FROM responses WHERE url = ? AND query = ?',
+                                 key).fetchone()
+        if row is None:
+            self._count('misses')
+            return None
+        body, expires, accessed = row
+        if expires < now:
+            if expires + self.max_stale < now:
+                with connection:
+                    connection.execute('DELETE FROM responses WHERE url = ? AND query = ? AND expires < ?',
+                                       key + (now - self.max_stale,))
+                self._count('expirations')
+            self._count('misses')
+            return None
+        # recency only needs to be approximate, so spare most reads a write
+        if now - accessed > self.kTOUCH_INTERVAL:
+            with connection:
+                connection.execute('UPDATE responses SET accessed = ? WHERE url = ? AND query = ?',
+                                   (now,) + key)
+        self._count('hits')
+        return self._decode(body)
+
+    def get_stale(self, key):
+        row = self._connection().execute('SELECT body FROM responses WHERE url = ? AND query = ? AND expires >= ?',
+                                         key + (time.time() - self.max_stale,)).fetchone()
+        if row is None:
+            return None
+        self._count('stale_hits')
+        return self._decode(row[0])
+
+    def set(self, key, value):
+        ttl = self.ttl(key)
+        if ttl <= 0:
+            return
+        now = time.time()
+        body = self._encode(value)
+        connection = self._connection()
+        with connection:
+            connection.execute('INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?)',
+                               key + (body, len(body), now + ttl, now))
+        with self._lock:
+            self._writes += 1
+            evict = self._writes % self.kEVICTION_INTERVAL == 0
+        if evict:
+            self.evict()
+
+    def invalidate(self, url):
+        connection = self._connection()
+        with connection:
+            deleted = connection.execute('DELETE FROM responses WHERE url = ?', (self.key(url)[0],)).rowcount
+        self._count('invalidations', deleted)
+
+    def clear(self):
+        connection = self._connection()
+        with connection:
+            connection.execute('DELETE FROM responses')
+
+    def evict(self):
+        """ Drops entries expired for longer than max_stale, then least recently
+            used ones until the cache is within max_entries and max_bytes"""
+        connection = self._connection()
+        with connection:
+            connection.execute('DELETE FROM responses WHERE expires < ?', (time.time() - self.max_stale,))
+            count, size = connection.execute('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses').fetchone()
+            if count <= self.max_entries and size <= self.max_bytes:
+                return
+            evicted = 0
+            rows = connection.execute('SELECT url, query, size FROM responses ORDER BY accessed').fetchall()
+            for url, query, row_size in rows:
+                if count <= self.max_entries and size <= self.max_bytes:
+                    break
+                connection.execute('DELETE FROM responses WHERE url = ? AND query = ?', (url, query))
+                count -= 1
+                size -= row_size
+                evicted += 1
+        self._count('evictions', evicted)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        stats['size'], stats['bytes'] = self._connection().execute(
+            'SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses').fetchone()
+        return stats
+
+    def _connection(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None or self._local.pid != os.getpid():
+            connection = sqlite3.connect(self.path, timeout = self.kBUSY_TIMEOUT)
+            connection.text_factory = str
+            connection.execute('PRAGMA journal_mode = WAL')
+            connection.execute('PRAGMA synchronous = NORMAL')
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+        return connection
+
+    def _encode(self, value):
+        body = json.dumps(value, separators = (',', ':'))
+        if self.compress:
+            body = zlib.compress(body)
+        return sqlite3.Binary(body)
+
+    def _decode(self, body):
+        body = str(body)
+        # json never starts with 'x', a zlib stream always does
+        if body.startswith('x'):
+            body = zlib.decompress(body)
+        return json.loads(body)
+
+    def _count(self, name, amount = 1):
+        with self._lock:
+            self._stats[name] += amount
+
+
+class LocationEntry(object):
+    """ A cached reverse-geocode result for one geohash cell.
+
+        confidence is 1.0 for a location fetched for a point inside the cell,
+        and the fraction of agreeing neighbors for one inferred from them.
+    """
+
+    __slots__ = ('location', 'expires', 'confidence')
+
+    def __init__(self, location, expires, confidence):
+        self.location = location
+        self.expires = expires
+        self.confidence = confidence
+
+
+class LocationCache(object):
+    """ A reverse-geocode cache for get_location, keyed on geohash cells.
+
+        precision - geohash length; 7 gives cells of roughly 150m x 150m
+        ttl - seconds a cell's location is trusted
+        neighbor_agreement - on a miss, the number of neighboring cells that
+                             must hold the same location (with none
+                             disagreeing) for it to be used for this cell
+        max_entries - cells kept before the least recently used is evicted
+    """
+
+    kDEFAULT_PRECISION = 7
+    kDEFAULT_TTL = 24 * 60 * 60
+    kDEFAULT_NEIGHBOR_AGREEMENT = 3
+    kDEFAULT_MAX_ENTRIES = 100000
+
+    def __init__(self,
+                 precision = kDEFAULT_PRECISION,
+                 ttl = kDEFAULT_TTL,
+                 neighbor_agreement = kDEFAULT_NEIGHBOR_AGREEMENT,
+                 max_entries = kDEFAULT_MAX_ENTRIES):
+        self.precision = precision
+        self.ttl = ttl
+        self.neighbor_agreement = neighbor_agreement
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._cells = collections.OrderedDict()
+        self._stats = {'hits': 0,
+                       'neighbor_hits': 0,
+                       'misses': 0,
+                       'evictions': 0}
+
+    def get(self, latitude, longitude):
+        """ Returns the cached location json for the point, or None"""
+        cell = geohash_encode(latitude, longitude, self.precision)
+        now = time.time()
+        with self._lock:
+            entry = self._lookup(cell, now)
+            if entry is not None:
+                self._stats['hits'] += 1
+                return entry.location
+            location, agreeing = None, 0
+            for neighbor in geohash_neighbors(cell):
+                entry = self._lookup(neighbor, now)
+                if entry is None or entry.confidence < 1.0:
+                    continue
+                if location is not None and entry.location != location:
+                    agreeing = 0
+                    break
+                location = entry.location
+                agreeing += 1
+            if agreeing and agreeing >= self.neighbor_agreement:
+                self._stats['neighbor_hits'] += 1
+                self._store(cell, location, now, agreeing / 8.0)
+                return location
+            self._stats['misses'] += 1
+            return None
+
+    def get_entry(self, latitude, longitude):
+        """ Returns the LocationEntry for the point's cell, or None"""
+        cell = geohash_encode(latitude, longitude, self.precision)
+        with self._lock:
+            return self._lookup(cell, time.time())
+
+    def set(self, latitude, longitude, location):
+        """ Stores the location json fetched for a point"""
+        cell = geohash_encode(latitude, longitude, self.precision)
+        with self._lock:
+            self._store(cell, location, time.time(), 1.0)
+
+    def clear(self):
+        with self._lock:
+            self._cells.clear()
+
+    def stats(self):
+        """ Returns hit, neighbor hit, miss and eviction counters"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats['size'] = len(self._cells)
+        return stats
+
+    def _lookup(self, cell, now):
+        entry = self._cells.get(cell)
+        if entry is None:
+            return None
+        if entry.expires < now:
+            del self._cells[cell]
+            return None
+        del self._cells[cell]
+        self._cells[cell] = entry
+        return entry
+
+    def _store(self, cell, location, now, confidence):
+        self._cells.pop(cell, None)
+        self._cells[cell] = LocationEntry(location, now + self.ttl, confidence)
+        while len(self._cells) > self.max_entries:
+            self._cells.popitem(last = False)
+            self._stats['evictions'] += 1
+
+
+class ValidatorEntry(object):
+    """ The ETag and Last-Modified validators of a response, with the objects
+        that were parsed from it and the decoded response itself"""
+
+    __slots__ = ('etag', 'last_modified', 'value', 'response')
+
+    def __init__(self, etag, last_modified, value, response = None):
+        self.etag = etag
+        self.last_modified = last_modified
+        self.value = value
+        self.response = response
+
+    def request_headers(self):
+        """ Returns the headers that make a GET conditional on this response"""
+        headers = {}
+        if self.etag:
+            headers['If-None-Match'] = self.etag
+        if self.last_modified:
+            headers['If-Modified-Since'] = self.last_modified
+        return headers
+
+
+class ValidatorCache(object):
+    """ Remembers response validators and parsed objects per request, so that
+        a conditional GET answered with 304 Not Modified can return the
+        objects without transferring or parsing the body again. Entries never
+        expire, since the server decides whether they are still valid.
+
+        max_entries - requests kept before the least recently used is evicted
+    """
+
+    kDEFAULT_MAX_ENTRIES = 1024
+
+    def __init__(self, max_entries = kDEFAULT_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = collections.OrderedDict()
+        self._stats = {'not_modified': 0,
+                       'modified': 0,
+                       'evictions': 0}
+
+    def get(self, key):
+        """ Returns the ValidatorEntry for key, or None"""
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                self._entries[key] = entry
+            return entry
+
+    def set(self, key, etag, last_modified, value, response = None):
+        """ Stores the parsed value of a response, and the response so that a
+            304 can refill a response cache; ignored without validators"""
+        if not etag and not last_modified:
+            return
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = ValidatorEntry(etag, last_modified, value, response)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last = False)
+                self._stats['evictions'] += 1
+
+    def record(self, not_modified):
+        """ Counts a revalidation answered with 304 (not_modified) or a new body"""
+        with self._lock:
+            self._stats[not_modified and 'not_modified' or 'modified'] += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['size'] = len(self._entries)
+        return stats
@@ -0,0 +1,548 @@
+"""
+ Bulk enrichment of coordinate files with FwixApi.
+
+ Streams a CSV or newline-delimited json file of coordinates and writes every
+ row back out, in input order, with the location (and optionally the nearby
+ places) of its point. Coordinates are rounded to --precision decimal places
+ and each distinct rounded point is looked up once. Lookups are sharded over
+ a pool of processes, each running its own client with --workers threads.
+
+ Output is written as rows complete and a checkpoint next to the output
+ records how far the run got, so a crashed or interrupted run continues
+ where it stopped when started again with --resume. Run as:
+
+   python -m fwix_geo_api.cli --api-key KEY [options] INPUT OUTPUT
+"""
+
+import collections, csv, multiprocessing, optparse, os, signal, sys, time
+
+from .fwix_geo_api import FwixApi, FwixApiError, _json_load, _json_dump, _atomic_write
+
+kFORMATS = ('csv', 'ndjson')
+kDEFAULT_PRECISION = 4
+kDEFAULT_WORKERS = 8
+kDEFAULT_CHUNK_SIZE = 64
+kDEFAULT_MAX_KEYS = 1000000
+kDEFAULT_MAX_WAITING = 10000
+kDEFAULT_CHUNK_DELAY = 1.0
+kCHECKPOINT_INTERVAL = 30.0
+kPROGRESS_INTERVAL = 5.0
+kPOLL_INTERVAL = 0.5
+kLOCATION_COLUMNS = tuple('fwix_' + key for key in FwixApi.LOCATION_KEYS)
+kPLACE_COLUMNS = ('fwix_place_count', 'fwix_place_uuids', 'fwix_place_names')
+kERROR_COLUMN = 'fwix_error'
+
+
+def quantize(latitude, longitude, precision = kDEFAULT_PRECISION):
+    """ Returns the point rounded to precision decimal places, the key
+        identical lookups are merged under"""
+    return (round(float(latitude), precision), round(float(longitude), precision))
+
+
+class _Lines(object):
+    """ Iterates over the lines of a file, keeping the offset of the end of
+        the last line returned (file iteration reads ahead, so tell() can't)"""
+
+    def __init__(self, fp, offset = 0):
+        self._fp = fp
+        self.offset = offset
+
+    def __iter__(self):
+        return self
+
+    def next(self):
+        line = self._fp.readline()
+        if not line:
+            raise StopIteration
+        self.offset += len(line)
+        return line
+
+
+class RowReader(object):
+    """ Yields (row, point, end offset) for every row of a CSV or ndjson
+        file; point is None when the row has no usable coordinates.
+
+        offset - where to resume reading, past any CSV header
+    """
+
+    def __init__(self, fp, format, lat_field = 'lat', lng_field = 'lng', offset = 0):
+        self.format = format
+        self.lat_field = lat_field
+        self.lng_field = lng_field
+        self.fieldnames = None
+        if format == 'csv':
+            header = fp.readline()
+            self.fieldnames = csv.reader([header]).next() if header else []
+            offset = max(offset, len(header))
+        fp.seek(offset)
+        self._lines = _Lines(fp, offset)
+
+    @property
+    def offset(self):
+        return self._lines.offset
+
+    def __iter__(self):
+        if self.format == 'csv':
+            rows = csv.DictReader(self._lines, self.fieldnames)
+        else:
+            rows = (_json_load(line) for line in self._lines if line.strip())
+        for row in rows:
+            try:
+                point = (float(row[self.lat_field]), float(row[self.lng_field]))
+            except (KeyError, TypeError, ValueError):
+                point = None
+            yield row, point, self._lines.offset
+
+
+class RowWriter(object):
+    """ Writes enriched rows: CSV rows gain the fwix_ columns, ndjson objects
+        a 'fwix' member holding the location, places and error"""
+
+    def __init__(self, fp, format, fieldnames = None, places = False, header = True):
+        self.fp = fp
+        self.format = format
+        self.places = places
+        if format == 'csv':
+            columns = list(fieldnames) + list(kLOCATION_COLUMNS)
+            if places:
+                columns += kPLACE_COLUMNS
+            columns.append(kERROR_COLUMN)
+            self._writer = csv.DictWriter(fp, columns, extrasaction = 'ignore')
+            if header:
+                self._writer.writerow(dict(zip(columns, columns)))
+
+    def write(self, row, result):
+        location, places, error = result
+        if self.format == 'ndjson':
+            enriched = {'location': location, 'error': error}
+            if self.places:
+                enriched['places'] = places
+            row['fwix'] = enriched
+            self.fp.write(_json_dump(row) + '\n')
+            return
+        for key, column in zip(FwixApi.LOCATION_KEYS, kLOCATION_COLUMNS):
+            row[column] = _utf8(location and location.get(key))
+        if self.places:
+            places = places or []
+            row['fwix_place_count'] = len(places)
+            row['fwix_place_uuids'] = ';'.join(_utf8(place['uuid']) for place in places)
+            row['fwix_place_names'] = ';'.join(_utf8(place['name']) for place in places)
+        row[kERROR_COLUMN] = _utf8(error)
+        self._writer.writerow(row)
+
+
+def _utf8(value):
+    if value is None:
+        return ''
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+    return str(value)
+
+
+# the client of a pool process, set up once by _init_worker
+_worker = None
+
+
+def _init_worker(api_key, base_url, workers, places, radius, page_size):
+    global _worker
+    fx_api = FwixApi(api_key, max_connections = workers)
+    if base_url:
+        fx_api.kBASE_URL = base_url
+    _worker = (fx_api, workers, places, radius, page_size)
+
+
+def _init_pool_worker(*args):
+    # Ctrl-C is the parent's to handle: it checkpoints and terminates the pool
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    _init_worker(*args)
+
+
+def _close_worker():
+    global _worker
+    if _worker is not None:
+        _worker[0].close()
+        _worker = None
+
+
+def _resolve_keys(keys):
+    """ Returns [(key, (location, places, error))] for a chunk of rounded
+        points, looked up concurrently by this process's client"""
+    fx_api, workers, places, radius, page_size = _worker
+    page = None
+    if page_size:
+        page = {'page': 1, 'page_size': page_size}
+    def call(key):
+        latitude, longitude = key
+        location = fx_api.get_location(latitude, longitude)
+        nearby = None
+        if places:
+            nearby = fx_api.get_places_by_lat_lng(latitude, longitude, page, radius)
+        return location, nearby
+    results = []
+    for key, result in fx_api._bulk(call, keys, workers, False):
+        if isinstance(result, FwixApiError):
+            results.append((key, (None, None, str(result))))
+        else:
+            results.append((key, (result[0], result[1], None)))
+    return results
+
+
+class _InlineResult(object):
+
+    def __init__(self, value):
+        self._value = value
+
+    def ready(self):
+        return True
+
+    def get(self, timeout = None):
+        return self._value
+
+
+class _InlinePool(object):
+    """ Stands in for a process pool when processes is 0, running each chunk
+        in this process as it is submitted"""
+
+    def __init__(self, initializer, initargs):
+        initializer(*initargs)
+
+    def apply_async(self, function, args):
+        return _InlineResult(function(*args))
+
+    def close(self):
+        pass
+
+    def terminate(self):
+        _close_worker()
+
+    def join(self):
+        pass
+
+
+class _Lookup(object):
+    """ The result of one rounded point, shared by every row waiting on it"""
+
+    __slots__ = ('result', 'pending')
+
+    def __init__(self):
+        self.result = None
+        # set until the chunk holding the point is submitted
+        self.pending = True
+
+
+class Enricher(object):
+    """ Runs one enrichment of input_path into output_path.
+
+        processes - pool processes doing lookups, 0 to look up in this process
+        workers - concurrent requests per process
+        precision - decimal places points are rounded to before lookup
+        places - also look up the places near each point
+        chunk_size - rounded points sent to a process at a time
+        max_keys - rounded points whose results are remembered for later rows
+        max_waiting - rows buffered behind an unfinished lookup before the
+                      reader stops to wait for it
+        chunk_delay - seconds a partial chunk is held back while the first
+                      unwritten row waits on it
+        checkpoint_path - defaults to output_path + '.checkpoint'
+        progress - called with the stats() dict every progress_interval seconds
+    """
+
+    def __init__(self,
+                 api_key,
+                 input_path,
+                 output_path,
+                 format = None,
+                 lat_field = 'lat',
+                 lng_field = 'lng',
+                 processes = None,
+                 workers = kDEFAULT_WORKERS,
+                 precision = kDEFAULT_PRECISION,
+                 places = False,
+                 radius = None,
+                 page_size = None,
+                 chunk_size = kDEFAULT_CHUNK_SIZE,
+                 max_keys = kDEFAULT_MAX_KEYS,
+                 max_waiting = kDEFAULT_MAX_WAITING,
+                 chunk_delay = kDEFAULT_CHUNK_DELAY,
+                 base_url = None,
+                 checkpoint_path = None,
+                 checkpoint_interval = kCHECKPOINT_INTERVAL,
+                 progress = None,
+                 progress_interval = kPROGRESS_INTERVAL):
+        if format is None:
+            format = 'csv' if input_path.lower().endswith('.csv') else 'ndjson'
+        if format not in kFORMATS:
+            raise ValueError('Unknown format %r' % format)
+        if processes is None:
+            processes = multiprocessing.cpu_count()
+        self.api_key = api_key
+        self.input_path = input_path
+        self.output_path = output_path
+        self.format = format
+        self.lat_field = lat_field
+        self.lng_field = lng_field
+        self.processes = processes
+        self.workers = workers
+        self.precision = precision
+        self.places = places
+        self.radius = radius
+        self.page_size = page_size
+        self.chunk_size = chunk_size
+        self.max_keys = max_keys
+        self.max_waiting = max_waiting
+        self.chunk_delay = chunk_delay
+        self.base_url = base_url
+        self.checkpoint_path = checkpoint_path or output_path + '.checkpoint'
+        self.checkpoint_interval = checkpoint_interval
+        self.progress = progress
+        self.progress_interval = progress_interval
+        self._stats = {'rows': 0, 'lookups': 0, 'deduplicated': 0, 'invalid': 0, 'errors': 0}
+        self._started = time.time()
+        self._size = self._offset = self._start_offset = 0
+        self._written = 0
+        self._limit = None
+
+    def run(self, resume = False, limit = None):
+        """ Enriches the input, continuing from the checkpoint when resume is
+            set. With limit, stops after that many rows and leaves the
+            checkpoint, so the run can be sampled and resumed later. Returns
+            stats()"""
+        checkpoint = None
+        if resume and os.path.exists(self.checkpoint_path):
+            with open(self.checkpoint_path) as checkpoint_file:
+                checkpoint = _json_load(checkpoint_file.read())
+            if checkpoint['input'] != os.path.abspath(self.input_path):
+                raise ValueError('%s is a checkpoint for %s' % (self.checkpoint_path, checkpoint['input']))
+            self._stats.update(checkpoint['stats'])
+        input_file = open(self.input_path, 'rb')
+        if checkpoint is None:
+            output_file = open(self.output_path, 'wb')
+        else:
+            output_file = open(self.output_path, 'r+b')
+            output_file.truncate(checkpoint['output_offset'])
+            output_file.seek(0, os.SEEK_END)
+        if self.processes:
+            pool = multiprocessing.Pool(self.processes, _init_pool_worker, self._worker_args())
+        else:
+            pool = _InlinePool(_init_worker, self._worker_args())
+        self._size = os.path.getsize(self.input_path)
+        self._started = time.time()
+        self._offset = self._start_offset = checkpoint and checkpoint['input_offset'] or 0
+        self._written = 0
+        self._limit = limit
+        try:
+            reader = RowReader(input_file, self.format, self.lat_field, self.lng_field,
+                               checkpoint and checkpoint['input_offset'] or 0)
+            writer = RowWriter(output_file, self.format, reader.fieldnames, self.places,
+                               header = checkpoint is None)
+            self._start_offset = self._offset = reader.offset
+            complete = self._enrich(reader, writer, pool)
+            pool.close()
+        finally:
+            pool.terminate()
+            pool.join()
+            input_file.close()
+            output_file.flush()
+            if self._stats['rows'] or checkpoint is not None:
+                self._checkpoint(output_file.tell())
+            output_file.close()
+        # an empty input never wrote a checkpoint
+        if complete and os.path.exists(self.checkpoint_path):
+            os.remove(self.checkpoint_path)
+        return self.stats()
+
+    def stats(self):
+        """ Returns rows written, lookups made, rows answered by an earlier
+            lookup, rows without coordinates and rows whose lookup failed, plus
+            rows_per_second, the fraction of the input done and the eta in
+            seconds"""
+        stats = dict(self._stats)
+        elapsed = time.time() - self._started
+        done = self._offset - self._start_offset
+        stats['rows_per_second'] = self._written / elapsed if elapsed else 0.0
+        stats['fraction'] = float(self._offset) / self._size if self._size else 1.0
+        stats['eta'] = None
+        if done > 0:
+            stats['eta'] = elapsed * (self._size - self._offset) / done
+        return stats
+
+    def _worker_args(self):
+        return (self.api_key, self.base_url, self.workers, self.places, self.radius, self.page_size)
+
+    def _enrich(self, reader, writer, pool):
+        """ Returns whether the whole input was written"""
+        lookups = collections.OrderedDict()
+        waiting = collections.deque()
+        submitted = collections.deque()
+        chunk = {}
+        chunk_started = None
+        last_checkpoint = last_progress = time.time()
+        for row, point, offset in reader:
+            now = time.time()
+            lookup = None
+            if point is not None:
+                key = quantize(point[0], point[1], self.precision)
+                lookup = lookups.get(key)
+                if lookup is None:
+                    lookup = lookups[key] = chunk[key] = _Lookup()
+                    self._stats['lookups'] += 1
+                    if chunk_started is None:
+                        chunk_started = now
+                    # rows already waiting keep their lookup after it is forgotten here
+                    if len(lookups) > self.max_keys:
+                        lookups.popitem(last = False)
+                else:
+                    self._stats['deduplicated'] += 1
+            waiting.append((row, lookup, offset))
+            head = waiting[0][1]
+            # duplicated points fill chunks slowly, so a chunk the output is
+            # blocked on goes out early
+            if chunk and (len(chunk) >= self.chunk_size or
+                          (head is not None and head.pending and
+                           (len(waiting) >= self.max_waiting or now - chunk_started >= self.chunk_delay))):
+                self._submit(pool, submitted, chunk)
+                chunk, chunk_started = {}, None
+                if len(submitted) > 2 * max(1, self.processes):
+                    self._collect(submitted.popleft())
+            while submitted and (submitted[0][0].ready() or
+                                 (len(waiting) >= self.max_waiting and not self._head_ready(waiting))):
+                self._collect(submitted.popleft())
+            if not self._write_ready(waiting, writer):
+                return False
+            if now - last_checkpoint >= self.checkpoint_interval:
+                writer.fp.flush()
+                self._checkpoint(writer.fp.tell())
+                last_checkpoint = now
+            if self.progress and now - last_progress >= self.progress_interval:
+                self.progress(self.stats())
+                last_progress = now
+        if chunk:
+            self._submit(pool, submitted, chunk)
+        while submitted:
+            self._collect(submitted.popleft())
+            if not self._write_ready(waiting, writer):
+                return False
+        if self.progress:
+            self.progress(self.stats())
+        return True
+
+    def _submit(self, pool, submitted, chunk):
+        for lookup in chunk.itervalues():
+            lookup.pending = False
+        submitted.append((pool.apply_async(_resolve_keys, (list(chunk),)), chunk))
+
+    def _head_ready(self, waiting):
+        lookup = waiting[0][1]
+        return lookup is None or lookup.result is not None
+
+    def _collect(self, submission):
+        result, chunk = submission
+        # an untimed get() cannot be interrupted by Ctrl-C
+        while True:
+            try:
+                values = result.get(kPOLL_INTERVAL)
+                break
+            except multiprocessing.TimeoutError:
+                pass
+        for key, value in values:
+            chunk[key].result = value
+
+    def _write_ready(self, waiting, writer):
+        """ Writes the rows at the head of waiting whose lookups are done;
+            returns False once limit rows have been written"""
+        while waiting:
+            row, lookup, offset = waiting[0]
+            if lookup is None:
+                result = (None, None, 'missing or invalid coordinates')
+                self._stats['invalid'] += 1
+            elif lookup.result is None:
+                return True
+            else:
+                result = lookup.result
+                if result[2] is not None:
+                    self._stats['errors'] += 1
+            waiting.popleft()
+            writer.write(row, result)
+            self._offset = offset
+            self._stats['rows'] += 1
+            self._written += 1
+            if self._limit is not None and self._written >= self._limit:
+                return False
+        return True
+
+    def _checkpoint(self, output_offset):
+        checkpoint = {'input': os.path.abspath(self.input_path),
+                      'input_offset': self._offset,
+                      'output_offset': output_offset,
+                      'stats': self._stats}
+        _atomic_write(self.checkpoint_path, _json_dump(checkpoint))
+
+
+def _format_seconds(seconds):
+    if seconds is None:
+        return '?'
+    seconds = int(seconds)
+    return '%d:%02d:%02d' % (seconds // 3600, seconds // 60 % 60, seconds % 60)
+
+
+def print_progress(stats):
+    sys.stderr.write('%d rows  %.0f rows/s  %d lookups  %d errors  %.1f%%  eta %s\n' % (
+        stats['rows'], stats['rows_per_second'], stats['lookups'], stats['errors'],
+        100.0 * stats['fraction'], _format_seconds(stats['eta'])))
+
+
+def main(argv = None):
+    parser = optparse.OptionParser(usage = __doc__)
+    parser.add_option('--api-key', help = 'the Fwix api key to use')
+    parser.add_option('--format', choices = kFORMATS,
+                      help = 'csv or ndjson; by default taken from the input extension')
+    parser.add_option('--lat-field', default = 'lat')
+    parser.add_option('--lng-field', default = 'lng')
+    parser.add_option('--precision', type = 'int', default = kDEFAULT_PRECISION,
+                      help = 'decimal places points are rounded to before lookup')
+    parser.add_option('--places', action = 'store_true', help = 'also look up nearby places')
+    parser.add_option('--radius', type = 'int', help = 'radius of the places lookup, in miles')
+    parser.add_option('--page-size', type = 'int', help = 'places returned per point')
+    parser.add_option('--processes', type = 'int', help = 'lookup processes, 0 for none (default: cpus)')
+    parser.add_option('--workers', type = 'int', default = kDEFAULT_WORKERS,
+                      help = 'concurrent requests per process')
+    parser.add_option('--chunk-size', type = 'int', default = kDEFAULT_CHUNK_SIZE)
+    parser.add_option('--max-keys', type = 'int', default = kDEFAULT_MAX_KEYS,
+                      help = 'rounded points remembered for deduplication')
+    parser.add_option('--max-waiting', type = 'int', default = kDEFAULT_MAX_WAITING,
+                      help = 'rows buffered behind an unfinished lookup')
+    parser.add_option('--base-url', help = 'api root, instead of %s' % FwixApi.kBASE_URL)
+    parser.add_option('--checkpoint', help = 'checkpoint file (default: OUTPUT.checkpoint)')
+    parser.add_option('--resume', action = 'store_true', help = 'continue from the checkpoint')
+    parser.add_option('--limit', type = 'int', help = 'stop after this many rows')
+    parser.add_option('--quiet', action = 'store_true', help = 'do not report progress')
+    options, args = parser.parse_args(argv)
+    if len(args) != 2 or not options.api_key:
+        parser.error('an api key, an input and an output file are required')
+
+    enricher = Enricher(options.api_key, args[0], args[1],
+                        format = options.format,
+                        lat_field = options.lat_field,
+                        lng_field = options.lng_field,
+                        processes = options.processes,
+                        workers = options.workers,
+                        precision = options.precision,
+                        places = options.places,
+                        radius = options.radius,
+                        page_size = options.page_size,
+                        chunk_size = options.chunk_size,
+                        max_keys = options.max_keys,
+                        max_waiting = options.max_waiting,
+                        base_url = options.base_url,
+                        checkpoint_path = options.checkpoint,
+                        progress = None if options.quiet else print_progress)
+    try:
+        enricher.run(options.resume, options.limit)
+    except KeyboardInterrupt:
+        sys.stderr.write('interrupted; continue with --resume\n')
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,182 @@
+"""
+ Columnar result sets backed by NumPy.
+
+ PlaceFrame and ContentFrame hold the coordinates, ids and category or
+ publication columns of a list of Place / Content objects as NumPy arrays,
+ so distance computations, filters and sorts run vectorized. The original
+ model objects are kept alongside the columns and are handed back as-is
+ when indexing or converting, without being copied or rebuilt.
+
+ NumPy is optional for the rest of the package; it is only needed here.
+"""
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from .geo import kEARTH_RADIUS_MILES
+
+
+def haversine_miles(latitudes, longitudes, latitude, longitude):
+    """ Returns the great-circle distances, in miles, from (latitude, longitude)
+        to each of the points in the latitudes and longitudes arrays"""
+    lat1 = numpy.radians(latitudes)
+    lng1 = numpy.radians(longitudes)
+    lat2 = numpy.radians(latitude)
+    lng2 = numpy.radians(longitude)
+    a = (numpy.sin((lat2 - lat1) / 2) ** 2 +
+         numpy.cos(lat1) * numpy.cos(lat2) * numpy.sin((lng2 - lng1) / 2) ** 2)
+    return 2 * kEARTH_RADIUS_MILES * numpy.arcsin(numpy.sqrt(numpy.minimum(a, 1.0)))
+
+
+class _Frame(object):
+    """ Columns shared by every frame: the model objects, uuids and coordinates"""
+
+    # array attributes that do not hold one value per row, which _take
+    # leaves for subclasses to rebuild
+    kPACKED_COLUMNS = ()
+
+    def __init__(self, objects):
+        if numpy is None:
+            raise ImportError('NumPy is required for %s' % self.__class__.__name__)
+        objects = list(objects)
+        self.objects = numpy.empty(len(objects), dtype = object)
+        self.objects[:] = objects
+        self.uuids = numpy.empty(len(objects), dtype = object)
+        self.uuids[:] = [obj['uuid'] for obj in objects]
+        self.latitudes = numpy.array([_float(obj['latitude']) for obj in objects], dtype = numpy.float64)
+        self.longitudes = numpy.array([_float(obj['longitude']) for obj in objects], dtype = numpy.float64)
+
+    def __len__(self):
+        return len(self.objects)
+
+    def __iter__(self):
+        return iter(self.objects)
+
+    def __getitem__(self, index):
+        """ Returns the model object at index, or a new frame for a slice, mask or index array"""
+        if isinstance(index, (int, long, numpy.integer)):
+            return self.objects[index]
+        return self._take(index)
+
+    def to_list(self):
+        """ Returns the model objects in frame order"""
+        return self.objects.tolist()
+
+    def distances(self, latitude, longitude):
+        """ Returns an array of distances in miles from the given point"""
+        return haversine_miles(self.latitudes, self.longitudes, latitude, longitude)
+
+    def within_radius(self, latitude, longitude, radius):
+        """ Returns a frame of the rows within radius miles of the given point"""
+        return self._take(self.distances(latitude, longitude) <= radius)
+
+    def within_bbox(self, south, west, north, east):
+        """ Returns a frame of the rows inside the bounding box. A box whose
+            west edge is greater than its east edge crosses the antimeridian."""
+        in_latitude = (self.latitudes >= south) & (self.latitudes <= north)
+        if west <= east:
+            in_longitude = (self.longitudes >= west) & (self.longitudes <= east)
+        else:
+            in_longitude = (self.longitudes >= west) | (self.longitudes <= east)
+        return self._take(in_latitude & in_longitude)
+
+    def sort_by_distance(self, latitude, longitude):
+        """ Returns a frame ordered nearest first; rows without coordinates go last"""
+        return self._take(numpy.argsort(self.distances(latitude, longitude), kind = 'mergesort'))
+
+    def _take(self, index):
+        frame = object.__new__(self.__class__)
+        for name, column in self.__dict__.items():
+            if isinstance(column, numpy.ndarray) and name not in self.kPACKED_COLUMNS:
+                column = column[index]
+            setattr(frame, name, column)
+        return frame
+
+
+class PlaceFrame(_Frame):
+    """ A columnar set of Place objects.
+
+        The categories of every place are packed into category_codes, each
+        an index in category_ids; the codes of the place in row i are
+        category_codes[category_offsets[i]:category_offsets[i + 1]].
+    """
+
+    kPACKED_COLUMNS = ('category_codes', 'category_offsets')
+
+    def __init__(self, places):
+        super(PlaceFrame, self).__init__(places)
+        codes = {}
+        category_codes = []
+        category_offsets = [0]
+        for place in self.objects:
+            for category in place['categories'] or ():
+                category_codes.append(codes.setdefault(category['category_id'], len(codes)))
+            category_offsets.append(len(category_codes))
+        self.category_codes = numpy.array(category_codes, dtype = numpy.int32)
+        self.category_offsets = numpy.array(category_offsets, dtype = numpy.int64)
+        self.category_ids = sorted(codes, key = codes.get)
+
+    def with_category(self, category_ids):
+        """ Returns a frame of the places with any of category_ids among their categories"""
+        codes = [self.category_ids.index(category_id)
+                 for category_id in category_ids if category_id in self.category_ids]
+        # matches counted up to each offset give the matches per place
+        matches = numpy.concatenate(([0], numpy.cumsum(numpy.in1d(self.category_codes, codes))))
+        return self._take(matches[self.category_offsets[1:]] > matches[self.category_offsets[:-1]])
+
+    def _take(self, index):
+        frame = super(PlaceFrame, self)._take(index)
+        rows = numpy.arange(len(self))[index]
+        starts = self.category_offsets[rows]
+        lengths = self.category_offsets[rows + 1] - starts
+        frame.category_offsets = numpy.concatenate(([0], numpy.cumsum(lengths))).astype(numpy.int64)
+        # the position of each kept code, row by row
+        positions = numpy.repeat(starts - frame.category_offsets[:-1], lengths) + numpy.arange(lengths.sum())
+        frame.category_codes = self.category_codes[positions]
+        return frame
+
+
+class ContentFrame(_Frame):
+    """ A columnar set of Content objects; published_at is a datetime64 column
+        (NaT where the date is missing or unparseable)"""
+
+    def __init__(self, content):
+        super(ContentFrame, self).__init__(content)
+        self.types = numpy.array([item['type'] for item in self.objects], dtype = object)
+        self.published_at = numpy.array([_datetime(item['published_at']) for item in self.objects],
+                                        dtype = 'datetime64[s]')
+
+    def of_type(self, content_type):
+        return self._take(self.types == content_type)
+
+    def published_between(self, start, end):
+        """ Returns a frame of the content published in [start, end)"""
+        start = numpy.datetime64(start, 's')
+        end = numpy.datetime64(end, 's')
+        return self._take((self.published_at >= start) & (self.published_at < end))
+
+    def sort_by_published(self, newest_first = True):
+        """ Returns a frame ordered by published_at; undated content goes last"""
+        order = numpy.argsort(self.published_at, kind = 'mergesort')
+        missing = numpy.isnat(self.published_at[order])
+        dated = order[~missing]
+        if newest_first:
+            dated = dated[::-1]
+        return self._take(numpy.concatenate((dated, order[missing])))
+
+
+def _float(value):
+    if value is None or value == '':
+        return numpy.nan
+    return float(value)
+
+
+def _datetime(value):
+    if not value:
+        return None
+    try:
+        return numpy.datetime64(str(value).replace(' ', 'T'), 's')
+    except ValueError:
+        return None
@@ -24,17 +24,70 @@
 """
 
 
-import urllib, httplib
-try:
-    import json
-    _json_load = lambda l: json.loads(l)
-except ImportError:
-    try:
-        import simplejson
-        _json_load = lambda l: simplejson.loads(l)
-    except ImportError:
-        from django.utils import simplejson # GAE
-        _json_load = lambda l: simplejson.loads(l)
+import urllib, urlparse, collections, itertools, Queue, os, time, calendar, heapq, socket, httplib, threading
+from multiprocessing.pool import ThreadPool
+from .transport import ConnectionPool, SingleFlight, Cancellation
+from .throttle import TokenBucket, AdaptiveConcurrency, RetryPolicy, kRETRYABLE_STATUSES
+from .stats import CallStats, endpoint_name
+from .resilience import EndpointTimeouts, HedgePolicy, CircuitBreaker
+from .jsonstream import iter_object_arrays
+from .geo import haversine_miles
+
+# json libraries in order of preference, fastest first
+kJSON_BACKENDS = ('ujson', 'simplejson', 'json', 'django')
+
+_json_backend = None
+_json_loads = None
+_json_dumps = None
+
+
+def _import_json_backend(name):
+    if name == 'django':
+        from django.utils import simplejson as module # GAE
+    else:
+        module = __import__(name)
+    if name == 'ujson':
+        # ujson rounds the last digit of some floats unless asked not to;
+        # versions that are always precise no longer take the option
+        try:
+            module.loads('0.1', precise_float = True)
+        except TypeError:
+            return module.loads, module.dumps
+        return lambda l: module.loads(l, precise_float = True), module.dumps
+    return module.loads, module.dumps
+
+
+def set_json_backend(name = None):
+    """ Selects the json library used to decode responses, one of
+        kJSON_BACKENDS, or the fastest one installed when name is None.
+        Returns the name of the library selected"""
+    global _json_backend, _json_loads, _json_dumps
+    for candidate in (name,) if name else kJSON_BACKENDS:
+        try:
+            loads, dumps = _import_json_backend(candidate)
+        except ImportError:
+            if name:
+                raise
+            continue
+        _json_backend, _json_loads, _json_dumps = candidate, loads, dumps
+        return candidate
+    raise ImportError('No json library found')
+
+
+def get_json_backend():
+    """ Returns the name of the json library in use"""
+    return _json_backend
+
+
+def _json_load(l):
+    return _json_loads(l)
+
+
+def _json_dump(o):
+    return _json_dumps(o)
+
+
+set_json_backend()
 
 # these can be passed as arguments for getting content by type
 kCONTENT_TYPE_NEWS = 'news'
@@ -46,12 +99,38 @@ kCONTENT_TYPE_EVENTS = 'events'
 kCONTENT_TYPE_REAL_ESTATE = 'real_estate'
 kCONTENT_TYPE_ALL = 'all'
 
+_interned = {}
+
+def _intern(value):
+    """ Returns a shared copy of a frequently repeated string (city, category name, ...)"""
+    if isinstance(value, basestring):
+        return _interned.setdefault(value, value)
+    return value
+
+
 class FwixDict(dict):
-    """ Allows treatment of Content, Locations, Categories, and Place objects as dictionaries"""    
+    """ Allows treatment of Content, Locations, Categories, and Place objects as dictionaries
+
+        Attributes are stored only as dictionary items; subclasses declare
+        empty __slots__ so instances carry no separate attribute dictionary.
+    """    
+
+    __slots__ = ()
+
+    def __getattr__(self, attr):
+        try:
+            return self[attr]
+        except KeyError:
+            raise AttributeError(attr)
 
     def __setattr__(self, attr, value):
         self[attr] = value
-        super(FwixDict,self).__setattr__(attr,value)
+
+    def __delattr__(self, attr):
+        try:
+            del self[attr]
+        except KeyError:
+            raise AttributeError(attr)
 
     def url_friendly(self):
         url_friendly = {}
@@ -62,10 +141,117 @@ class FwixDict(dict):
         return url_friendly
 
 
+# returned in place of the response to a conditional GET answered with 304
+kNOT_MODIFIED = object()
+
+
+class _ValidatedResponse(dict):
+    """ A decoded response carrying its (etag, last_modified) validators"""
+
+    __slots__ = ('validators',)
+
+
+def _published_sort_key(content):
+    """ Sorts content newest first, content without a readable date last"""
+    published_at = content.get('published_at')
+    if published_at:
+        # sliced rather than strptime'd: strptime is slow and not thread-safe on first use
+        try:
+            return -calendar.timegm((int(published_at[0:4]), int(published_at[5:7]), int(published_at[8:10]),
+                                     int(published_at[11:13]), int(published_at[14:16]),
+                                     int(published_at[17:19]), 0, 0, 0))
+        except (TypeError, ValueError):
+            pass
+    return float('inf')
+
+
+def _distance_sort_key(latitude, longitude, content):
+    """ Sorts content nearest first, content without coordinates last"""
+    if content.get('latitude') is None or content.get('longitude') is None:
+        return float('inf')
+    return haversine_miles(latitude, longitude, content['latitude'], content['longitude'])
+
+
 class FwixApiError(Exception):
     
-    def __init__(self, message):
+    def __init__(self, message, status = None, retry_after = None):
         super(FwixApiError,self).__init__(message)
+        self.status = status
+        self.retry_after = retry_after
+
+
+class CircuitOpenError(FwixApiError):
+    """ Raised instead of sending a request to an endpoint whose circuit
+        breaker is open"""
+
+
+def _start_thread(target, *args):
+    thread = threading.Thread(target = target, args = args)
+    thread.daemon = True
+    thread.start()
+    return thread
+
+
+class _HedgeWorker(object):
+    """ A daemon thread that calls each scheduled function once its delay has
+        passed, unless it was cancelled first. Functions are called one at a
+        time, so a slow one holds back the rest."""
+
+    kSTOP = object()
+
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._scheduled = []
+        self._sequence = itertools.count()
+        self._thread = None
+
+    def schedule(self, delay, function):
+        """ Returns a handle for cancel"""
+        entry = [time.time() + delay, next(self._sequence), function]
+        with self._condition:
+            heapq.heappush(self._scheduled, entry)
+            if self._thread is None:
+                self._thread = _start_thread(self._run)
+            self._condition.notify()
+        return entry
+
+    def cancel(self, entry):
+        with self._condition:
+            entry[2] = None
+
+    def stop(self):
+        """ Ends the thread once it is idle; scheduling starts a new one"""
+        with self._condition:
+            if self._thread is not None:
+                heapq.heappush(self._scheduled, [0, next(self._sequence), self.kSTOP])
+                self._thread = None
+                self._condition.notify()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._scheduled or self._scheduled[0][0] > time.time():
+                    timeout = None
+                    if self._scheduled:
+                        timeout = self._scheduled[0][0] - time.time()
+                    self._condition.wait(timeout)
+                _, _, function = heapq.heappop(self._scheduled)
+            if function is self.kSTOP:
+                return
+            if function is not None:
+                function()
+
+
+def _atomic_write(path, data):
+    """ Writes data to path through a temporary file renamed over it, so
+        readers never see a partly written file, even after a crash"""
+    temp_path = '%s.%d.%d.tmp' % (path, os.getpid(), threading.current_thread().ident)
+    with open(temp_path, 'w') as temp_file:
+        temp_file.write(data)
+        temp_file.flush()
+        # the data must be on disk before the rename makes it the file
+        os.fsync(temp_file.fileno())
+    os.rename(temp_path, path)
 
 
 class FwixApi(object):
@@ -88,6 +274,38 @@ class FwixApi(object):
        included in the SDK, but do not need to be used - a standard dictionary 
        that contains the indicated keys will suffice.
 
+       Requests are made over persistent connections held in a ConnectionPool;
+       max_connections sets how many idle connections are kept per host, or
+       an existing pool can be shared between clients by passing pool.
+
+       The *_bulk methods fan a batch of inputs out over a pool of worker
+       threads, yielding (input, result) pairs; a failed item yields a
+       FwixApiError as its result rather than stopping the batch.
+
+       Passing cache (eg. a ResponseCache) enables caching of GET responses;
+       successful updates and deletes invalidate the cached place. Passing
+       location_cache (a LocationCache) answers get_location for points whose
+       geohash cell has already been resolved.
+
+       Passing spatial_index (a SpatialIndex) adds every parsed place to a
+       local index; get_places_by_lat_lng queries that fall inside a region
+       already fetched in full are then answered from the index, returning
+       the indexed place objects themselves.
+
+       Identical GET requests made concurrently from several threads are sent
+       once and their response shared (each caller still gets its own model
+       objects); pass coalesce = False to disable this.
+
+       The iter_* methods page through results lazily, fetching the next page
+       in the background while the current one is consumed.
+
+       Tail latency is bounded with timeouts (per-endpoint socket timeouts),
+       hedge (a HedgePolicy; a GET still unanswered after its endpoint's
+       observed p95 is sent again and the first answer wins) and
+       circuit_breaker (a CircuitBreaker; requests to an endpoint whose
+       error rate spikes fail fast with CircuitOpenError, or are answered
+       with stale cached data when the cache was given a max_stale).
+
     """
 
     debugging = False
@@ -125,62 +343,205 @@ class FwixApi(object):
     kAUTHOR_KEY = 'author'
     kCATEGORY = 'category'
     kLOCATION = 'location'
+    kDEFAULT_BULK_WORKERS = 8
+    # threads shared by every fanned out content request of a client
+    kFAN_OUT_WORKERS = 16
+    kDEFAULT_PAGE_SIZE = 20
+    kDEFAULT_RADIUS = 10
 
-    def __init__(self, api_key, user_id = None):
+    def __init__(self,
+                 api_key,
+                 user_id = None,
+                 max_connections = ConnectionPool.kDEFAULT_MAX_SIZE,
+                 pool = None,
+                 cache = None,
+                 location_cache = None,
+                 spatial_index = None,
+                 coalesce = True,
+                 rate_limit = None,
+                 rate_burst = None,
+                 adaptive_concurrency = None,
+                 retry = None,
+                 stats = None,
+                 validator_cache = None,
+                 timeouts = None,
+                 hedge = None,
+                 circuit_breaker = None):
+        """ rate_limit - requests per second allowed for api_key, shared by every
+                         client in the process using that key; None for no limit
+            adaptive_concurrency - True, or an AdaptiveConcurrency, to bound the
+                                   requests in flight by the server's health;
+                                   None for no bound
+            retry - True, or a RetryPolicy, to retry GETs that fail with a
+                    network error, 429 or 5xx; None to never retry
+            stats - a StatsRegistry to record a CallStats for every call in,
+                    None to disable instrumentation
+            validator_cache - a ValidatorCache to revalidate categories and
+                              places with conditional GETs; on 304 the
+                              previously returned objects are returned again
+            timeouts - an EndpointTimeouts, or a dictionary of url path prefix
+                       to socket timeout in seconds
+            hedge - True, or a HedgePolicy, to hedge slow GETs
+            circuit_breaker - True, or a CircuitBreaker, to fail fast while an
+                              endpoint is failing
+        """
         self._api_key = api_key
         self._user_id = user_id
+        if pool is None:
+            pool = ConnectionPool(max_size = max_connections)
+        self._pool = pool
+        self._cache = cache
+        self._location_cache = location_cache
+        self._spatial_index = spatial_index
+        self._in_flight = None
+        if coalesce:
+            self._in_flight = SingleFlight()
+        self._rate_limiter = None
+        if rate_limit is not None:
+            self._rate_limiter = TokenBucket.for_key(api_key, rate_limit, rate_burst)
+        if adaptive_concurrency is True:
+            adaptive_concurrency = AdaptiveConcurrency()
+        self._concurrency = adaptive_concurrency or None
+        if retry is True:
+            retry = RetryPolicy()
+        self._retry = retry or None
+        self._retries = 0
+        self._stats = stats
+        self._validator_cache = validator_cache
+        if isinstance(timeouts, dict):
+            timeouts = EndpointTimeouts(timeouts)
+        self._timeouts = timeouts
+        if hedge is True:
+            hedge = HedgePolicy()
+        self._hedge = hedge or None
+        if circuit_breaker is True:
+            circuit_breaker = CircuitBreaker()
+        self._breaker = circuit_breaker or None
+        self._hedge_worker = None
+        if self._hedge is not None:
+            self._hedge_worker = _HedgeWorker()
+        self._fan_out_pool = None
+        self._fan_out_lock = threading.Lock()
+        self._calls = threading.local()
 
     def debug(self, message):
         if self.debugging:
             print message
 
+    def pool_stats(self):
+        """ Returns connection pool counters (created, reused, stale, reconnects, ...)"""
+        return self._pool.stats()
+
+    def cache_stats(self):
+        """ Returns response cache counters, or None when caching is disabled"""
+        if self._cache is None:
+            return None
+        return self._cache.stats()
+
+    def location_cache_stats(self):
+        """ Returns location cache counters, or None when it is disabled"""
+        if self._location_cache is None:
+            return None
+        return self._location_cache.stats()
+
+    def coalesce_stats(self):
+        """ Returns the number of GETs sent and of GETs that shared one in flight"""
+        if self._in_flight is None:
+            return None
+        return self._in_flight.stats()
+
+    def throttle_stats(self):
+        """ Returns the rate limiter wait, concurrency limit and retry counters"""
+        stats = {'retries': self._retries}
+        if self._rate_limiter is not None:
+            stats['rate_limit_wait'] = self._rate_limiter.waited
+        if self._concurrency is not None:
+            stats.update(self._concurrency.stats())
+        return stats
+
+    def validator_cache_stats(self):
+        """ Returns conditional GET counters, or None when revalidation is disabled"""
+        if self._validator_cache is None:
+            return None
+        return self._validator_cache.stats()
+
+    def call_stats(self):
+        """ Returns per-endpoint latency summaries, or None without a StatsRegistry"""
+        if self._stats is None:
+            return None
+        return self._stats.snapshot()
+
+    def spatial_index_stats(self):
+        """ Returns spatial index counters, or None when it is disabled"""
+        if self._spatial_index is None:
+            return None
+        return self._spatial_index.stats()
+
+    def hedge_stats(self):
+        """ Returns hedging counters and delays, or None when hedging is disabled"""
+        if self._hedge is None:
+            return None
+        return self._hedge.stats()
+
+    def circuit_breaker_stats(self):
+        """ Returns circuit breaker counters and open circuits, or None when it is disabled"""
+        if self._breaker is None:
+            return None
+        return self._breaker.stats()
+
+    def close(self):
+        """ Closes any idle connections held by the client and stops its
+            worker threads; they are started again when next needed"""
+        self._pool.close()
+        if self._hedge_worker is not None:
+            self._hedge_worker.stop()
+        with self._fan_out_lock:
+            fan_out_pool, self._fan_out_pool = self._fan_out_pool, None
+        if fan_out_pool is not None:
+            fan_out_pool.close()
+
     def get_categories(self):
         """ Returns a list of category objects"""
         url = self.kBASE_URL + '/categories.json'
-        raw_categories = self._fetch_url(url)
-        categories = []
-
-        ## recursively discovers all categories
-        def parse_categories(category):
-            if self.kCATEGORY_ID_KEY in category:
-                current_category = Category(category[self.kCATEGORY_ID_KEY],
-                                            category[self.kNAME_KEY],
-                                            category.get(self.kCATEGORY_PARENT_ID_KEY,None))
-                categories.append(current_category)
-            if self.kCATEGORIES_KEY in category:
-                for sub_category in category[self.kCATEGORIES_KEY]:
-                    parse_categories(sub_category)
-
-        parse_categories(raw_categories)
-        return categories 
+        return self._fetch_url(url, parse = self._parse_categories, revalidate = True)
+
+    def get_category_tree(self, snapshot_path = None, max_age = None):
+        """ Returns a CategoryTree of all categories. When snapshot_path is given
+            the tree is loaded from that file if it is younger than max_age
+            seconds (or of any age when max_age is None), and otherwise fetched
+            and written there."""
+        if snapshot_path and os.path.exists(snapshot_path):
+            if max_age is None or time.time() - os.path.getmtime(snapshot_path) < max_age:
+                return CategoryTree.load(snapshot_path)
+        tree = CategoryTree(self.get_categories())
+        if snapshot_path:
+            tree.save(snapshot_path)
+        return tree
 
     def get_location(self, latitude, longitude):
         """ Returns a Location object for the given latitude and longitude """
+        if self._location_cache is not None:
+            raw_location = self._location_cache.get(latitude, longitude)
+            if raw_location is not None:
+                return self._parse_location(raw_location)
         url = self.kBASE_URL + '/location.json'
         params = {self.kLAT_KEY : latitude, self.kLNG_KEY: longitude}
         raw_location = self._fetch_url(url, params)
-        #python 2.6.(< 5) bug handling
-        parsed_location = {}
-        for unicode_key in raw_location:
-            parsed_location[str(unicode_key)] = raw_location[unicode_key]
-        location = Location(**parsed_location)
-        return location
+        if self._location_cache is not None:
+            self._location_cache.set(latitude, longitude, raw_location)
+        return self._parse_location(raw_location)
 
     def get_place(self, uuid):
         """ Returns a place object given a UUID"""
         url = self.kBASE_URL + '/places/%s.json' % uuid
-        raw_place = self._fetch_url(url)
-        return self._parse_place(raw_place['place'])
+        return self._fetch_url(url, parse = lambda raw_place: self._parse_place(raw_place['place']),
+                               revalidate = True)
 
     def generic_get_places(self,params):
         """ Returns a list of places from the given api parameters"""
         url = self.kBASE_URL + self.kPLACES_PATH
-        raw_places = self._fetch_url(url,params)
-        places = []
-        for raw_place in raw_places['places']:
-            places.append(self._parse_place(raw_place))
-        return places
-                          
+        return self._fetch_url(url, params, parse = self._parse_places)
+
     def get_places_by_lat_lng(self,
                               latitude,
                               longitude,
@@ -188,9 +549,22 @@ class FwixApi(object):
                               radius = None,
                               categories = None):
         """ Returns a list of places near the given lat and lng"""
+        index = self._spatial_index
+        if index is not None and not page:
+            if index.is_covered(latitude, longitude, radius or self.kDEFAULT_RADIUS, categories):
+                index.record_query(True)
+                # an unpaged query gets the api's first page
+                places = index.query(latitude, longitude, radius or self.kDEFAULT_RADIUS, categories)
+                return places[:self.kDEFAULT_PAGE_SIZE]
+            index.record_query(False)
         params = {self.kLAT_KEY: latitude, self.kLNG_KEY: longitude}
         params.update(self._place_filters(page,radius,categories))         
-        return self.generic_get_places(params)
+        places = self.generic_get_places(params)
+        # a first page that is not full holds every place in the circle
+        if index is not None and (not page or int(page['page']) == 1):
+            if len(places) < int(page and page['page_size'] or self.kDEFAULT_PAGE_SIZE):
+                index.mark_covered(latitude, longitude, radius or self.kDEFAULT_RADIUS, categories)
+        return places
 
     def get_places_by_postal_code(self, 
                                   postal_code,
@@ -215,19 +589,8 @@ class FwixApi(object):
     def update_place_given_place(self, place):
         """Given a place object, updates information about that place, and returns a boolean of 
         whether the request succeeded or not """
-        params = {}
-        for key in (self.kPHONE_NUMBER_KEY,
-                 self.kNAME_KEY,
-                 self.kLATITUDE_KEY,
-                 self.kLONGITUDE_KEY):
-            params[key] = place[key]
-        for key in self.LOCATION_KEYS:
-            params[key] = place[self.kLOCATION][key]
-        
-        url = self.kBASE_URL + '/places/%s.json' % place[self.kUUID_KEY]
-        response = self._fetch_url(url, params, self.kPOST_REQUEST)
-        return response
-        
+        return self._post_place_update(place[self.kUUID_KEY], self._place_update_params(place))
+
     def update_place(self, 
                      uuid, 
                      latitude = None, 
@@ -241,55 +604,138 @@ class FwixApi(object):
                      phone_number = None, 
                      category = None):
         """ Updates information about a place, returns a boolean of whether the request succeeded or not"""
-        params = {}
-        if latitude:
-            params[self.kLAT_KEY] = latitude 
-        if longitude:
-            params[self.kLNG_KEY] = longitude  
-        if name:
-            params[self.kNAME_KEY] = name
-        if city:
-            params[self.kCITY_KEY] = city 
-        if address:
-            params[self.kADDRESS_KEY] = address
-        if country:
-            params[self.kCOUNTRY_KEY] = country
-        if province:
-            params[self.kPROVINCE_KEY] = province
-        if postal_code:
-            params[self.kPOSTAL_CODE_KEY] = postal_code
-        if phone_number:
-            params[self.kPHONE_NUMBER_KEY] = phone_number
-        if category:
-            params[self.kCATEGORY] = category
-          
+        params = self._update_params(latitude, longitude, name, city, address, country,
+                                     province, postal_code, phone_number, category)
+        return self._post_place_update(uuid, params)
+
+    def _post_place_update(self, uuid, params):
+        """ Posts already built update parameters for a place"""
         url = self.kBASE_URL + '/places/%s.json' % uuid
-        response = self._fetch_url(url, params, self.kPOST_REQUEST)
-        return response    
+        result = self._fetch_url(url, params, self.kPOST_REQUEST)
+        if self._spatial_index is not None:
+            self._spatial_index.invalidate(uuid, params.get(self.kLAT_KEY, params.get(self.kLATITUDE_KEY)),
+                                           params.get(self.kLNG_KEY, params.get(self.kLONGITUDE_KEY)))
+        return result
 
     def delete_place(self, uuid):
         """ Deletes a place, returs a boolean of whether or not the request was succesful"""
-        url = '/places/%s.json' % uuid
-        response = self._fetch_url(url, request_type = self.kDELETE_REQUEST)
-        if response['success'] is 1:
-            return True
-        else:
-            return False
-
-    def generic_get_content(self, params, content_types, page, range, sort_by, search_query):
+        url = self.kBASE_URL + '/places/%s.json' % uuid
+        deleted = self._fetch_url(url, request_type = self.kDELETE_REQUEST, parse = self._parse_delete)
+        if deleted and self._spatial_index is not None:
+            self._spatial_index.remove(uuid)
+        return deleted
+
+    def generic_get_content(self, params, content_types, page, range, sort_by, search_query,
+                            fan_out = False, stream = False):
+        """ Returns a list of content objects from the given api parameters. With
+            fan_out, each content type is requested concurrently and the results
+            are merged newest first (see generic_iter_content_fan_out). With
+            stream, the response is decoded incrementally and never cached."""
+        if fan_out:
+            return list(self.generic_iter_content_fan_out(params, content_types, page, range,
+                                                          search_query, sort_by = sort_by,
+                                                          stream = stream))
+        if stream:
+            return list(self.generic_iter_content(params, content_types, page, range, sort_by,
+                                                  search_query))
         url = self.kBASE_URL + self.kCONTENT_PATH
-        if isinstance(content_types, str):
-            params[self.kCONTENT_TYPES_KEY] = content_types
+        params = self._content_params(params, content_types, page, range, sort_by, search_query)
+        return self._fetch_url(url, params, parse = self._parse_content_list)
+
+    def generic_iter_content(self, params, content_types, page, range, sort_by, search_query):
+        """ Like generic_get_content, but decodes the response incrementally and
+            yields each content object as soon as it has been received, in the
+            order the server sent them. Responses are never cached or coalesced,
+            but are rate limited, retried and guarded by the circuit breaker
+            like any other request."""
+        url = self.kBASE_URL + self.kCONTENT_PATH
+        params = self._content_params(params, content_types, page, range, sort_by, search_query)
+        call = self._begin_call(url, self.kGET_REQUEST)
+        start = time.time()
+        try:
+            response = self._open_streamed(url, params)
+        except Exception, e:
+            if call is not None:
+                call.error = e.__class__.__name__
+                call.total = time.time() - start
+                self._stats.record(call)
+            raise
+        finally:
+            self._calls.current = None
+        try:
+            if call is None:
+                for type_key, raw_content in iter_object_arrays(response, kCONTENT_TYPE_TO_OBJECT):
+                    yield self._parse_content(raw_content, type_key)
+                return
+            call.parse = 0.0
+            call.items = 0
+            for type_key, raw_content in iter_object_arrays(response, kCONTENT_TYPE_TO_OBJECT):
+                parse_start = time.time()
+                content = self._parse_content(raw_content, type_key)
+                call.parse += time.time() - parse_start
+                call.items += 1
+                yield content
+        finally:
+            response.close()
+            if call is not None:
+                call.bytes = response.bytes_read
+                call.decoded_bytes = response.bytes_decoded
+                call.total = time.time() - start
+                self._stats.record(call)
+
+    def generic_iter_content_fan_out(self,
+                                     params,
+                                     content_types,
+                                     page = None,
+                                     range = None,
+                                     search_query = None,
+                                     merge_by = None,
+                                     max_items = None,
+                                     stream = False,
+                                     sort_by = None):
+        """ Requests each content type concurrently and yields the results merged
+            newest first, or nearest first when merge_by is a (latitude,
+            longitude) pair. page, sort_by and search_query apply to every
+            type. Merging starts once every type has answered, so latency
+            follows the slowest type."""
+        if isinstance(content_types, basestring):
+            content_types = [content_type for content_type in content_types.split(',') if content_type]
+        if not content_types:
+            raise FwixApiError('No content types given')
+        if kCONTENT_TYPE_ALL in content_types:
+            content_types = kCONTENT_TYPE_TO_OBJECT.keys()
+        if merge_by is None:
+            sort_key = _published_sort_key
         else:
-            params[self.kCONTENT_TYPES_KEY] = ','.join(content_types)
-        params.update(self._content_filters(page,range,sort_by,search_query))
-        raw_content = self._fetch_url(url,params)
-        content = []
-        for type_key in kCONTENT_TYPE_TO_OBJECT.keys():
-            if type_key in raw_content:
-                for single_content in raw_content[type_key]:
-                    content.append(self._parse_content(single_content, type_key))                    
-        return content
+            latitude, longitude = merge_by
+            sort_key = lambda content: _distance_sort_key(latitude, longitude, content)
+
+        def fetch(content_type):
+            content = self.generic_get_content(dict(params), content_type, page, range, sort_by, search_query,
+                                               stream = stream)
+            # the sequence number breaks ties, so content objects are never compared
+            decorated = [(sort_key(item), sequence, item) for sequence, item in enumerate(content)]
+            decorated.sort()
+            return decorated
+
+        def decorated(type_index, result):
+            for key, sequence, content in result.get():
+                yield key, type_index, sequence, content
+
+        pool = self._fan_out_workers()
+        results = [pool.apply_async(fetch, (content_type,)) for content_type in content_types]
+        merged = heapq.merge(*[decorated(type_index, result) for type_index, result in enumerate(results)])
+        for count, (_, _, _, content) in enumerate(merged):
+            if count == max_items:
+                return
+            yield content
+
+    def _fan_out_workers(self):
+        """ Returns the client's fan out thread pool, starting it if need be"""
+        with self._fan_out_lock:
+            if self._fan_out_pool is None:
+                self._fan_out_pool = ThreadPool(self.kFAN_OUT_WORKERS)
+            return self._fan_out_pool
 
     def get_content_by_lat_lng(self,
                                latitude,
@@ -298,10 +744,13 @@ class FwixApi(object):
                                page = None,
                                range = None,
                                sort_by = None,
-                               search_query = None):
+                               search_query = None,
+                               fan_out = False,
+                               stream = False):
         """ Returns a list of content objects based on the given criteria"""
         params = { self.kLAT_KEY: latitude, self.kLNG_KEY: longitude }
-        return self.generic_get_content(params, content_types, page, range, sort_by, search_query)
+        return self.generic_get_content(params, content_types, page, range, sort_by, search_query,
+                                        fan_out, stream)
 
     def get_content_by_postal_code(self, 
                                    postal_code,
@@ -309,10 +758,13 @@ class FwixApi(object):
                                    page = None,
                                    range = None,
                                    sort_by = None,
-                                   search_query = None):
+                                   search_query = None,
+                                   fan_out = False,
+                                   stream = False):
         """ Returns a list of content objects near a given a postal code"""
         params = { self.kPOSTAL_CODE_KEY: postal_code }
-        return self.generic_get_content(params, content_types, page, range, sort_by, search_query)
+        return self.generic_get_content(params, content_types, page, range, sort_by, search_query,
+                                        fan_out, stream)
 
     def get_content_by_location(self,
                                 location,
@@ -320,10 +772,13 @@ class FwixApi(object):
                                 page = None,
                                 range = None,
                                 sort_by = None,
-                                search_query = None):
+                                search_query = None,
+                                fan_out = False,
+                                stream = False):
         """ Returns a list of content objects near a given location object"""
         params = location.url_friendly()
-        return self.generic_get_content(params, content_types, page, range, sort_by, search_query)
+        return self.generic_get_content(params, content_types, page, range, sort_by, search_query,
+                                        fan_out, stream)
 
     def get_content_by_place(self,
                              place_uuid, 
@@ -331,19 +786,608 @@ class FwixApi(object):
                              page = None,
                              range = None,
                              sort_by = None,
-                             search_query = None):
+                             search_query = None,
+                             fan_out = False,
+                             stream = False):
         """ Returns a list of content objects associated with a given place object"""
         params = {'place_id': place_uuid}
-        return self.generic_get_content(params, content_types, page, range, sort_by, search_query)
+        return self.generic_get_content(params, content_types, page, range, sort_by, search_query,
+                                        fan_out, stream)
 
-    def _fetch_url(self, base_url, query_map = {}, request_type = kGET_REQUEST):
-        """ Fetches json data and returns it as a dictionary"""
+    def iter_places_by_lat_lng(self,
+                               latitude,
+                               longitude,
+                               radius = None,
+                               categories = None,
+                               page_size = kDEFAULT_PAGE_SIZE,
+                               max_items = None):
+        """ Yields places near the given lat and lng across all pages"""
+        def fetch_page(page):
+            return self.get_places_by_lat_lng(latitude, longitude, page, radius, categories)
+        return self._iter_pages(fetch_page, page_size, max_items)
+
+    def iter_places_by_postal_code(self,
+                                   postal_code,
+                                   radius = None,
+                                   categories = None,
+                                   page_size = kDEFAULT_PAGE_SIZE,
+                                   max_items = None):
+        """ Yields places near the given postal code across all pages"""
+        def fetch_page(page):
+            return self.get_places_by_postal_code(postal_code, page, radius, categories)
+        return self._iter_pages(fetch_page, page_size, max_items)
+
+    def iter_places_by_location(self,
+                                location,
+                                radius = None,
+                                categories = None,
+                                page_size = kDEFAULT_PAGE_SIZE,
+                                max_items = None):
+        """ Yields places associated with the location object across all pages"""
+        def fetch_page(page):
+            return self.get_places_by_location(location, page, radius, categories)
+        return self._iter_pages(fetch_page, page_size, max_items)
+
+    def iter_content_by_lat_lng(self,
+                                latitude,
+                                longitude,
+                                content_types,
+                                range = None,
+                                sort_by = None,
+                                search_query = None,
+                                page_size = kDEFAULT_PAGE_SIZE,
+                                max_items = None,
+                                stream = False):
+        """ Yields content near the given lat and lng across all pages"""
+        def fetch_page(page):
+            return self.get_content_by_lat_lng(latitude, longitude, content_types,
+                                               page, range, sort_by, search_query, stream = stream)
+        return self._iter_pages(fetch_page, page_size, max_items)
+
+    def iter_content_by_postal_code(self,
+                                    postal_code,
+                                    content_types,
+                                    range = None,
+                                    sort_by = None,
+                                    search_query = None,
+                                    page_size = kDEFAULT_PAGE_SIZE,
+                                    max_items = None,
+                                    stream = False):
+        """ Yields content near the given postal code across all pages"""
+        def fetch_page(page):
+            return self.get_content_by_postal_code(postal_code, content_types,
+                                                   page, range, sort_by, search_query, stream = stream)
+        return self._iter_pages(fetch_page, page_size, max_items)
+
+    def iter_content_by_location(self,
+                                 location,
+                                 content_types,
+                                 range = None,
+                                 sort_by = None,
+                                 search_query = None,
+                                 page_size = kDEFAULT_PAGE_SIZE,
+                                 max_items = None,
+                                 stream = False):
+        """ Yields content near the given location object across all pages"""
+        def fetch_page(page):
+            return self.get_content_by_location(location, content_types,
+                                                page, range, sort_by, search_query, stream = stream)
+        return self._iter_pages(fetch_page, page_size, max_items)
+
+    def iter_content_by_place(self,
+                              place_uuid,
+                              content_types,
+                              range = None,
+                              sort_by = None,
+                              search_query = None,
+                              page_size = kDEFAULT_PAGE_SIZE,
+                              max_items = None,
+                              stream = False):
+        """ Yields content associated with the given place across all pages"""
+        def fetch_page(page):
+            return self.get_content_by_place(place_uuid, content_types,
+                                             page, range, sort_by, search_query, stream = stream)
+        return self._iter_pages(fetch_page, page_size, max_items)
+
+    def _iter_pages(self, fetch_page, page_size, max_items):
+        """ Yields the items of successive pages until an empty page or max_items.
+            The next page is requested as soon as the current one arrives."""
+        if max_items is not None and max_items <= 0:
+            return
+        prefetcher = ThreadPool(1)
+        try:
+            page_number = 1
+            next_page = prefetcher.apply_async(fetch_page, (Page(page_number, page_size),))
+            count = 0
+            while next_page is not None:
+                items = next_page.get()
+                if not items:
+                    return
+                page_number += 1
+                next_page = None
+                if max_items is None or count + len(items) < max_items:
+                    next_page = prefetcher.apply_async(fetch_page, (Page(page_number, page_size),))
+                for item in items:
+                    yield item
+                    count += 1
+                    if count == max_items:
+                        return
+        finally:
+            prefetcher.terminate()
+
+    def get_places_bulk(self,
+                        coordinates,
+                        page = None,
+                        radius = None,
+                        categories = None,
+                        max_workers = kDEFAULT_BULK_WORKERS,
+                        ordered = True):
+        """ Yields (coordinate, places) for each (latitude, longitude) pair in coordinates"""
+        def call(coordinate):
+            latitude, longitude = coordinate
+            return self.get_places_by_lat_lng(latitude, longitude, page, radius, categories)
+        return self._bulk(call, coordinates, max_workers, ordered)
+
+    def get_places_by_postal_code_bulk(self,
+                                       postal_codes,
+                                       page = None,
+                                       radius = None,
+                                       categories = None,
+                                       max_workers = kDEFAULT_BULK_WORKERS,
+                                       ordered = True):
+        """ Yields (postal_code, places) for each of the given postal codes"""
+        def call(postal_code):
+            return self.get_places_by_postal_code(postal_code, page, radius, categories)
+        return self._bulk(call, postal_codes, max_workers, ordered)
+
+    def get_locations_bulk(self, coordinates, max_workers = kDEFAULT_BULK_WORKERS, ordered = True):
+        """ Yields (coordinate, location) for each (latitude, longitude) pair in coordinates"""
+        def call(coordinate):
+            latitude, longitude = coordinate
+            return self.get_location(latitude, longitude)
+        return self._bulk(call, coordinates, max_workers, ordered)
+
+    def get_places_by_uuid_bulk(self, uuids, max_workers = kDEFAULT_BULK_WORKERS, ordered = True):
+        """ Yields (uuid, place) for each of the given place uuids"""
+        return self._bulk(self.get_place, uuids, max_workers, ordered)
+
+    def _bulk(self, call, inputs, max_workers, ordered):
+        """ Runs call over inputs on a thread pool, keeping at most 2 * max_workers
+            items in flight. Yields (input, result) in input order when ordered,
+            otherwise as each call completes."""
+        def run(item):
+            try:
+                return item, call(item)
+            except FwixApiError, e:
+                return item, e
+            except Exception, e:
+                return item, FwixApiError('%s: %s' % (e.__class__.__name__, e))
+
+        pool = ThreadPool(max_workers)
+        pending = collections.deque()
+        completed = Queue.Queue()
+        try:
+            for item in inputs:
+                if ordered:
+                    pending.append(pool.apply_async(run, (item,)))
+                else:
+                    pending.append(None)
+                    pool.apply_async(run, (item,), callback = completed.put)
+                if len(pending) >= 2 * max_workers:
+                    yield self._bulk_next(pending, completed)
+            while pending:
+                yield self._bulk_next(pending, completed)
+        finally:
+            pool.terminate()
+
+    def _bulk_next(self, pending, completed):
+        """ Returns the next in-order result if one is pending, else the next completed one"""
+        result = pending.popleft()
+        if result is None:
+            return completed.get()
+        return result.get()
+
+    def _fetch_url(self, base_url, query_map = None, request_type = kGET_REQUEST, parse = None,
+                   revalidate = False):
+        """ Fetches json data and returns it as a dictionary, or passed through
+            parse when given (so that parsing is timed with the call). With
+            revalidate, parsed objects are kept in the validator cache and
+            returned again when a conditional GET finds them unchanged."""
+        if revalidate and self._validator_cache is not None:
+            parse = self._revalidating_parse(base_url, query_map, parse)
+        call = self._begin_call(base_url, request_type)
+        if call is None:
+            response = self._fetch_response(base_url, query_map, request_type)
+            if parse is None:
+                return response
+            return parse(response)
+        start = time.time()
+        try:
+            response = self._fetch_response(base_url, query_map, request_type)
+            if parse is None:
+                return response
+            parse_start = time.time()
+            parsed = parse(response)
+            call.parse = time.time() - parse_start
+            call.items = 1
+            if isinstance(parsed, list):
+                call.items = len(parsed)
+            return parsed
+        except Exception, e:
+            call.error = e.__class__.__name__
+            raise
+        finally:
+            self._calls.current = None
+            call.total = time.time() - start
+            self._stats.record(call)
+
+    def _revalidating_parse(self, base_url, query_map, parse):
+        """ Makes the coming request conditional on the validators stored for it,
+            and returns a parse function that reuses the stored objects on 304
+            and stores the objects parsed from a new body"""
+        key = (base_url, tuple(sorted((query_map or {}).items())))
+        entry = self._validator_cache.get(key)
+        self._calls.validators = entry
+        def revalidating_parse(response):
+            if response is kNOT_MODIFIED:
+                return entry.value
+            parsed = parse(response)
+            validators = getattr(response, 'validators', None)
+            if validators is not None:
+                self._validator_cache.set(key, validators[0], validators[1], parsed, response)
+            return parsed
+        return revalidating_parse
+
+    def _fetch_response(self, base_url, query_map = None, request_type = kGET_REQUEST):
+        """ Returns the decoded response from the cache, a coalesced request, or the api"""
+        call = getattr(self._calls, 'current', None)
+        validators = getattr(self._calls, 'validators', None)
+        self._calls.validators = None
+        cache_key = None
+        if self._cache is not None and request_type == self.kGET_REQUEST:
+            cache_key = self._cache.key(base_url, query_map)
+            cached_response = self._cache.get(cache_key)
+            if cached_response is not None:
+                self.debug('CACHED: %s' % base_url)
+                if call is not None:
+                    call.cached = True
+                return cached_response
+        endpoint = allowed = None
+        if self._breaker is not None:
+            endpoint = endpoint_name(urlparse.urlsplit(base_url).path)
+            allowed = self._breaker.allow(endpoint)
+            if not allowed:
+                return self._refuse(endpoint, cache_key, call)
+        read = self._read_url
+        if self._hedge is not None and request_type == self.kGET_REQUEST:
+            read = self._hedged_read
+        success = False
+        try:
+            if self._in_flight is not None and request_type == self.kGET_REQUEST:
+                if call is not None:
+                    # cleared by _read_url_once if this call turns out to be the one sent
+                    call.coalesced = True
+                in_flight_key = (base_url, tuple(sorted((query_map or {}).items())),
+                                 validators and (validators.etag, validators.last_modified))
+                parsed_response = self._in_flight.do(in_flight_key,
+                                                     lambda: read(base_url, query_map, request_type, validators))
+            else:
+                parsed_response = read(base_url, query_map, request_type, validators)
+            success = True
+        except FwixApiError, e:
+            # the server answering a bad request is not the server failing
+            success = e.status is not None and e.status not in kRETRYABLE_STATUSES
+            raise
+        finally:
+            if self._breaker is not None:
+                self._breaker.record(endpoint, success, allowed)
+        if validators is not None:
+            # only requests actually sent conditionally count as revalidations
+            self._validator_cache.record(parsed_response is kNOT_MODIFIED)
+        if parsed_response is kNOT_MODIFIED:
+            if cache_key is not None and validators.response is not None:
+                # the stored response is current again, for another ttl
+                self._cache.set(cache_key, validators.response)
+            return parsed_response
+        if cache_key is not None:
+            self._cache.set(cache_key, parsed_response)
+        elif self._cache is not None:
+            self._cache.invalidate(base_url)
+        return parsed_response
+
+    def _refuse(self, endpoint, cache_key, call):
+        """ Answers a request the circuit breaker refused, from stale cached
+            data when there is some, else with CircuitOpenError"""
+        if self._breaker.serve_stale and cache_key is not None:
+            stale_response = self._cache.get_stale(cache_key)
+            if stale_response is not None:
+                self.debug('STALE: %s' % endpoint)
+                self._breaker.record_stale()
+                if call is not None:
+                    call.cached = True
+                return stale_response
+        raise CircuitOpenError('Circuit open for %s' % endpoint)
+
+    def _hedged_read(self, base_url, query_map = None, request_type = kGET_REQUEST, validators = None):
+        """ Sends a GET from the caller's thread, and a duplicate of it from the
+            hedge worker if the first has not answered within the hedge policy's
+            delay for the endpoint. The first to succeed cancels the other and
+            its response is returned; if both fail, the last error is raised."""
+        endpoint = endpoint_name(urlparse.urlsplit(base_url).path)
+        delay = self._hedge.delay(endpoint)
+        if delay is None:
+            start = time.time()
+            response = self._read_url(base_url, query_map, request_type, validators)
+            self._hedge.observe(endpoint, time.time() - start)
+            return response
+        call = getattr(self._calls, 'current', None)
+        lock = threading.Lock()
+        hedge_done = threading.Event()
+        primary = Cancellation()
+        state = {'launched': False, 'winner': None, 'cancellation': None, 'outcome': None, 'scratch': None}
+
+        def attempt(cancellation):
+            # each attempt times itself; the winner's timings go on the call
+            scratch = None
+            if call is not None:
+                scratch = CallStats(call.endpoint, call.method)
+            self._calls.current = scratch
+            self._calls.cancellation = cancellation
+            start = time.time()
+            try:
+                outcome = True, self._read_url(base_url, query_map, request_type, validators)
+                self._hedge.observe(endpoint, time.time() - start)
+            except Exception, e:
+                outcome = False, e
+            finally:
+                self._calls.current = None
+                self._calls.cancellation = None
+            return scratch, outcome
+
+        def hedge():
+            with lock:
+                if state['winner'] is not None or not self._hedge.allow():
+                    return
+                state['launched'] = True
+                state['cancellation'] = Cancellation()
+            self.debug('HEDGE after %.3fs: %s' % (delay, base_url))
+            scratch, outcome = attempt(state['cancellation'])
+            with lock:
+                state['scratch'], state['outcome'] = scratch, outcome
+                won = outcome[0] and state['winner'] is None
+                if won:
+                    state['winner'] = 'hedge'
+            if won:
+                primary.cancel()
+            hedge_done.set()
+
+        scheduled = self._hedge_worker.schedule(delay, hedge)
+        try:
+            scratch, (ok, value) = attempt(primary)
+        finally:
+            self._calls.current = call
+        with lock:
+            if ok and state['winner'] is None:
+                state['winner'] = 'primary'
+            elif state['winner'] is None and not state['launched']:
+                # too late for the hedge to be sent; this was the only attempt
+                state['winner'] = 'primary'
+            launched, cancellation = state['launched'], state['cancellation']
+        self._hedge_worker.cancel(scheduled)
+        if state['winner'] == 'primary':
+            if launched:
+                cancellation.cancel()
+        else:
+            # the hedge answered first, or is the last attempt left
+            hedge_done.wait()
+            scratch, (ok, value) = state['scratch'], state['outcome']
+            if ok:
+                self._hedge.record_win()
+        if call is not None:
+            for name in ('build', 'dns', 'connect', 'ttfb', 'network', 'decode', 'status',
+                         'reused', 'attempts', 'bytes', 'decoded_bytes'):
+                setattr(call, name, getattr(scratch, name))
+            call.coalesced = False
+            call.hedged = launched
+        if ok:
+            return value
+        raise value
+
+    def _begin_call(self, base_url, request_type):
+        """ Starts this thread's CallStats record, None when stats are disabled"""
+        if self._stats is None:
+            return None
+        call = CallStats(endpoint_name(urlparse.urlsplit(base_url).path), request_type)
+        self._calls.current = call
+        return call
+
+    def _record_response(self, call, response):
+        call.coalesced = False
+        call.attempts += 1
+        call.status = response.status
+        call.reused = response.reused
+        call.dns = response.dns_time
+        call.connect = response.connect_time
+        call.ttfb = response.ttfb
+
+    def _read_url(self, base_url, query_map = None, request_type = kGET_REQUEST, validators = None,
+                  read_once = None):
+        """ Sends an api request, subject to the rate limit and concurrency
+            limit, retrying failed GETs until the retry policy's deadline;
+            returns the checked, decoded response,
+            or whatever read_once returns when given in place of _read_url_once"""
+        if read_once is None:
+            read_once = self._read_url_once
+        deadline = None
+        if self._retry is not None and self._retry.deadline is not None:
+            deadline = time.time() + self._retry.deadline
+        attempt = 0
+        while True:
+            if self._rate_limiter is not None:
+                self._rate_limiter.acquire()
+            if self._concurrency is not None:
+                self._concurrency.acquire()
+            status = retry_after = None
+            overloaded = False
+            # caps the socket timeout of this attempt to what is left of the deadline
+            self._calls.deadline = deadline
+            try:
+                return read_once(base_url, query_map, request_type, validators)
+            except FwixApiError, e:
+                status, retry_after = e.status, e.retry_after
+                overloaded = status in kRETRYABLE_STATUSES
+                error = e
+            except (socket.error, httplib.HTTPException), e:
+                overloaded = True
+                error = e
+            finally:
+                self._calls.deadline = None
+                # a request cancelled by its hedge says nothing about the server
+                cancellation = getattr(self._calls, 'cancellation', None)
+                cancelled = cancellation is not None and cancellation.cancelled
+                if self._concurrency is not None:
+                    self._concurrency.release(overloaded and not cancelled)
+            if (cancelled or request_type != self.kGET_REQUEST or self._retry is None or
+                    (status is None and not overloaded) or
+                    not self._retry.should_retry(attempt, status)):
+                raise error
+            delay = self._retry.delay(attempt, retry_after)
+            if deadline is not None and time.time() + delay >= deadline:
+                raise error
+            self.debug('RETRY %d in %.2fs: %s (%s)' % (attempt + 1, delay, base_url, error))
+            self._retries += 1
+            attempt += 1
+            time.sleep(delay)
+
+    def _read_url_once(self, base_url, query_map = None, request_type = kGET_REQUEST, validators = None):
+        """ Sends an api request and returns the checked, decoded response. A
+            request made conditional by validators returns kNOT_MODIFIED on 304.
+            With a validator cache, the response carries its own validators."""
+        start = time.time()
+        headers = None
+        if validators is not None:
+            headers = validators.request_headers()
+        response = self._open_url(base_url, query_map, request_type, headers)
+        response_code = response.status
+        retry_after = response.getheader('Retry-After')
+        etag = response.getheader('ETag')
+        last_modified = response.getheader('Last-Modified')
+        body = ''
+        try:
+            body = response.read()
+            read = time.time()
+            if response_code == 304 and validators is not None:
+                parsed_response = kNOT_MODIFIED
+            else:
+                parsed_response = self._decode_body(response_code, body)
+        except ValueError:
+            raise
+        except Exception, e:
+            self.debug(body)
+            raise e
+        finally:
+            response.close()
+        call = getattr(self._calls, 'current', None)
+        if call is not None:
+            call.decode = time.time() - read
+            call.network = read - start - call.build
+            call.bytes += response.bytes_read
+            call.decoded_bytes += len(body)
+            self._record_response(call, response)
+        if parsed_response is kNOT_MODIFIED:
+            return parsed_response
+        parsed_response = self._check_response(response_code, parsed_response, retry_after)
+        if (etag or last_modified) and self._validator_cache is not None:
+            parsed_response = _ValidatedResponse(parsed_response)
+            parsed_response.validators = (etag, last_modified)
+        return parsed_response
+
+    def _open_streamed(self, base_url, query_map = None):
+        """ Sends a GET through the same rate limit, concurrency limit, retries
+            and circuit breaker as _fetch_response, and returns the unread
+            response once its status is known to be 200"""
+        call = getattr(self._calls, 'current', None)
+        endpoint = allowed = None
+        if self._breaker is not None:
+            endpoint = endpoint_name(urlparse.urlsplit(base_url).path)
+            allowed = self._breaker.allow(endpoint)
+            if not allowed:
+                return self._refuse(endpoint, None, call)
+        success = False
+        try:
+            # the concurrency slot is given back once the headers have arrived,
+            # as the body is read at the pace of whoever consumes the stream
+            response = self._read_url(base_url, query_map, read_once = self._open_checked)
+            success = True
+            return response
+        except FwixApiError, e:
+            success = e.status is not None and e.status not in kRETRYABLE_STATUSES
+            raise
+        finally:
+            if self._breaker is not None:
+                self._breaker.record(endpoint, success, allowed)
+
+    def _open_checked(self, base_url, query_map = None, request_type = kGET_REQUEST, validators = None):
+        """ Sends an api request and returns the unread response, or raises
+            FwixApiError for an unsuccessful one"""
+        response = self._open_url(base_url, query_map, request_type)
+        call = getattr(self._calls, 'current', None)
+        if call is not None:
+            self._record_response(call, response)
+        if int(response.status) == 200:
+            return response
+        retry_after = response.getheader('Retry-After')
+        try:
+            body = response.read()
+        finally:
+            response.close()
+        return self._check_response(response.status, self._decode_body(response.status, body),
+                                    retry_after)
+
+    def _decode_body(self, response_code, body):
+        """ Returns the decoded json of a response body"""
+        try:
+            return _json_load(body)
+        except ValueError:
+            self.debug(body)
+            if int(response_code) == 200:
+                raise
+            # error pages from proxies and load balancers are not json
+            return {'message': 'HTTP %s' % response_code}
+
+    def _open_url(self, base_url, query_map = None, request_type = kGET_REQUEST, extra_headers = None):
+        """ Sends an api request and returns the unread response"""
+        start = time.time()
+        url, post_args, headers = self._build_request(base_url, query_map, request_type)
+        if extra_headers:
+            headers.update(extra_headers)
+        call = getattr(self._calls, 'current', None)
+        if call is not None:
+            call.build = time.time() - start
+        timeout = None
+        if self._timeouts is not None:
+            timeout = self._timeouts.timeout(urlparse.urlsplit(base_url).path)
+        deadline = getattr(self._calls, 'deadline', None)
+        if deadline is not None:
+            if timeout is None:
+                timeout = self._pool.timeout
+            remaining = max(0.001, deadline - time.time())
+            if timeout is None or timeout > remaining:
+                timeout = remaining
+        return self._pool.request(request_type, url, post_args, headers, timeout,
+                                  getattr(self._calls, 'cancellation', None))
+
+    def _build_request(self, base_url, query_map = None, request_type = kGET_REQUEST):
+        """ Returns the url, POST body and headers for an api request"""
+        query_map = dict(query_map or {})
         query_map['api_key'] = self._api_key
         if self._user_id:
             query_map['user_id'] = self._user_id
+        headers = {}
         if request_type == self.kPOST_REQUEST:
             query_str = ''
             post_args = urllib.urlencode(query_map)
+            headers['Content-Type'] = 'application/x-www-form-urlencoded'
         elif request_type == self.kGET_REQUEST or request_type == self.kDELETE_REQUEST:
             query_str = '?' + urllib.urlencode(query_map)
             post_args = None
@@ -351,77 +1395,123 @@ class FwixApi(object):
             raise NotImplementedError, 'Only POST, GET, and DELETE are now supported'
         url = base_url + query_str
         self.debug('URL: %s \nPOST: %s' % (url,post_args))
-        if request_type == self.kDELETE_REQUEST: 
-            conn = httplib.HTTPConnection(self.kBASE_DOMAIN)
-            conn.request(self.kDELETE_REQUEST, url)
-            response = conn.getresponse()
-        else:
-            response = urllib.urlopen(url, post_args)
-        try:
-            parsed_response = _json_load(response.read())
-        except Exception, e:
-            self.debug(response.read())
-            raise e
-        finally:
-            if request_type == self.kDELETE_REQUEST:
-                response_code = response.status
-                conn.close()
-            else:
-                response_code = response.getcode()
-                response.close()
+        return url, post_args, headers
 
+    def _check_response(self, response_code, parsed_response, retry_after = None):
+        """ Raises FwixApiError for unsuccessful responses"""
         if int(response_code) != 200:
-            raise FwixApiError('Bad Request : ' + parsed_response['message'])
+            try:
+                retry_after = float(retry_after)
+            except (TypeError, ValueError):
+                retry_after = None
+            raise FwixApiError('Bad Request : ' + parsed_response.get('message', 'HTTP %s' % response_code),
+                               int(response_code), retry_after)
         
         return parsed_response
 
+    def _parse_categories(self, raw_categories):
+        """ Converts the categories JSON tree into a flat list of category objects"""
+        categories = []
+
+        ## recursively discovers all categories, nested categories default
+        ## to the enclosing category as their parent
+        def parse_categories(category, parent_id = None):
+            if self.kCATEGORY_ID_KEY in category:
+                current_category = Category.from_json(category, parent_id)
+                categories.append(current_category)
+                parent_id = current_category.category_id
+            if self.kCATEGORIES_KEY in category:
+                for sub_category in category[self.kCATEGORIES_KEY]:
+                    parse_categories(sub_category, parent_id)
+
+        parse_categories(raw_categories)
+        return categories
+
+    def _parse_location(self, raw_location):
+        """ Converts location JSON into a location object"""
+        return Location.from_json(raw_location)
+
+    def _parse_places(self, raw_places):
+        """ Converts places JSON into a list of place objects"""
+        places = []
+        for raw_place in raw_places['places']:
+            places.append(self._parse_place(raw_place))
+        return places
+
+    def _parse_delete(self, response):
+        """ Converts a delete response into a boolean"""
+        if response['success'] is 1:
+            return True
+        else:
+            return False
+
+    def _parse_content_list(self, raw_content):
+        """ Converts content JSON into a list of content objects, grouped by type"""
+        content = []
+        for type_key in kCONTENT_TYPE_TO_OBJECT.keys():
+            if type_key in raw_content:
+                for single_content in raw_content[type_key]:
+                    content.append(self._parse_content(single_content, type_key))                    
+        return content
+
     def _parse_content(self, raw_content, content_type):
         """ Converts content JSON into content object"""
-        new_content = {}
-        new_content['type'] = content_type
-        new_content[self.kLATITUDE_KEY] = raw_content.get(self.kLAT_KEY,None)
-        new_content[self.kLONGITUDE_KEY] = raw_content.get(self.kLNG_KEY, None)
-        for key in (self.kUUID_KEY,
-                    self.kLINK_KEY, 
-                    self.kPUBLISHED_KEY, 
-                    self.kSOURCE_KEY, 
-                    self.kTITLE_KEY, 
-                    self.kBODY_KEY, 
-                    self.kIMAGE_KEY,
-                    self.kAUTHOR_KEY):
-            new_content[key] = raw_content.get(key, None)
-        for extra_key in kCONTENT_TYPE_TO_OBJECT[content_type].extra_attributes():
-            new_content[extra_key] = raw_content.get(key, None)
-        content = kCONTENT_TYPE_TO_OBJECT[content_type](**new_content)
-        return content
+        return kCONTENT_TYPE_TO_OBJECT[content_type].from_json(raw_content, content_type)
 
     def _parse_place(self, raw_place):
         """Converts place JSON into place object"""
-        new_place = {}
-        new_location = {}
-        categories = []
-        for place_key in (self.kPHONE_NUMBER_KEY,
-                     self.kUUID_KEY,
-                     self.kNAME_KEY,
-                     self.kLINK_KEY):
-            new_place[place_key] = raw_place[place_key]
-        for loc_key in self.LOCATION_KEYS:
-            if loc_key in raw_place:
-                new_location[loc_key] = raw_place[loc_key]
-        location = Location(**new_location)
-        new_place['location'] = location
-        new_place[self.kLATITUDE_KEY] = raw_place[self.kLAT_KEY]
-        new_place[self.kLONGITUDE_KEY] = raw_place[self.kLNG_KEY]
-        for category in raw_place[self.kCATEGORIES_KEY]:
-            #python 2.6.(< 5) bug handling
-            parsed_category = {}
-            for unicode_key in category:
-                parsed_category[str(unicode_key)] = category[unicode_key]
-            categories.append(Category(**parsed_category))
-        new_place[self.kCATEGORIES_KEY] = categories
-        place = Place(**new_place)
+        place = Place.from_json(raw_place)
+        if self._spatial_index is not None:
+            self._spatial_index.add(place)
         return place
-        
+
+    def _place_update_params(self, place):
+        """ Returns the POST parameters for updating a place from a place object"""
+        params = {}
+        for key in (self.kPHONE_NUMBER_KEY,
+                 self.kNAME_KEY,
+                 self.kLATITUDE_KEY,
+                 self.kLONGITUDE_KEY):
+            params[key] = place[key]
+        for key in self.LOCATION_KEYS:
+            params[key] = place[self.kLOCATION][key]
+        return params
+
+    def _update_params(self, 
+                       latitude = None, 
+                       longitude = None, 
+                       name = None, 
+                       city = None, 
+                       address = None, 
+                       country = None, 
+                       province = None, 
+                       postal_code = None,  
+                       phone_number = None, 
+                       category = None):
+        """ Returns the POST parameters for updating the given place fields"""
+        params = {}
+        if latitude:
+            params[self.kLAT_KEY] = latitude 
+        if longitude:
+            params[self.kLNG_KEY] = longitude  
+        if name:
+            params[self.kNAME_KEY] = name
+        if city:
+            params[self.kCITY_KEY] = city 
+        if address:
+            params[self.kADDRESS_KEY] = address
+        if country:
+            params[self.kCOUNTRY_KEY] = country
+        if province:
+            params[self.kPROVINCE_KEY] = province
+        if postal_code:
+            params[self.kPOSTAL_CODE_KEY] = postal_code
+        if phone_number:
+            params[self.kPHONE_NUMBER_KEY] = phone_number
+        if category:
+            params[self.kCATEGORY] = category
+        return params
+
     def _place_filters(self, page, radius, categories):
         """ Returns a dictionary for use with fetching from the api based on common place inputs"""
         filters = {}
@@ -430,25 +1520,36 @@ class FwixApi(object):
         if radius:
             filters['radius'] = radius
         if categories:
-            for category in categories:
-                filters[kCATEGORIES_KEY] += (category['category_id'] + ',')
-            filters[kCATEGORIES_KEY] = filters[kCATEGORIES_KEY][:-1]
+            filters[self.kCATEGORIES_KEY] = ','.join(str(category[self.kCATEGORY_ID_KEY])
+                                                     for category in categories)
         return filters
 
+    def _content_params(self, params, content_types, page, range, sort_by, search_query):
+        """ Adds the content type and content filter parameters to params"""
+        if isinstance(content_types, basestring):
+            params[self.kCONTENT_TYPES_KEY] = content_types
+        else:
+            params[self.kCONTENT_TYPES_KEY] = ','.join(content_types)
+        params.update(self._content_filters(page,range,sort_by,search_query))
+        return params
+
     def _content_filters(self, page, range, sort_by, search_query):
         """ Returns a dictionary for use with fetching from the api based on common content inputs"""
         filters = {}
         if page:
             filters.update(page)
         if range:
-            filters.update(range)
+            # an open ended range leaves out its missing bound
+            filters.update((key, value) for key, value in range.items() if value is not None)
         if search_query:
             filters['query'] = search_query
         return filters
 
             
 class Location(FwixDict):
-    
+
+    __slots__ = ()
+
     def __init__(self,
                 country,
                 province = None,
@@ -456,14 +1557,26 @@ class Location(FwixDict):
                 locality = None,
                 postal_code = None,
                 address = None):
-        self.country = country
-        self.province = province
-        self.city = city
-        self.locality = locality
-        self.postal_code = postal_code
+        self.country = _intern(country)
+        self.province = _intern(province)
+        self.city = _intern(city)
+        self.locality = _intern(locality)
+        self.postal_code = _intern(postal_code)
         self.address = address
         super(Location, self).__init__()
 
+    @classmethod
+    def from_json(cls, raw):
+        """ Builds a location straight from decoded json, skipping __init__"""
+        location = dict.__new__(cls)
+        location['country'] = _intern(raw.get('country'))
+        location['province'] = _intern(raw.get('province'))
+        location['city'] = _intern(raw.get('city'))
+        location['locality'] = _intern(raw.get('locality'))
+        location['postal_code'] = _intern(raw.get('postal_code'))
+        location['address'] = raw.get('address')
+        return location
+
     def get_query_map(self):
         query_map = {}
         for key in self.keys():
@@ -474,18 +1587,150 @@ class Location(FwixDict):
 
 class Category(FwixDict):
 
+    __slots__ = ()
+
     def __init__(self,
                 category_id,
                 name,
                 parent_category_id = None):
         self.category_id = category_id
         self.parent_id = parent_category_id
-        self.name = name
+        self.name = _intern(name)
         super(Category, self).__init__()
 
+    @classmethod
+    def from_json(cls, raw, parent_id = None):
+        """ Builds a category straight from decoded json; parent_id is used
+            when the json does not name a parent"""
+        category = dict.__new__(cls)
+        category['category_id'] = raw['category_id']
+        category['parent_id'] = raw.get('parent_id', parent_id)
+        category['name'] = _intern(raw['name'])
+        return category
+
+
+class CategoryTree(object):
+    """ An index over the category hierarchy. Lookups by id or name and the
+        parent, children, ancestor and descendant relations are all
+        precomputed, so none of them scan the category list.
+
+        Methods taking a category accept either a category_id or any
+        dictionary with a 'category_id' key.
+    """
+
+    def __init__(self, categories):
+        self._by_id = {}
+        self._by_name = {}
+        self._children = {}
+        for category in categories:
+            self._by_id[category['category_id']] = category
+            self._by_name.setdefault(category['name'].lower(), []).append(category)
+            self._children.setdefault(category['parent_id'], []).append(category)
+        self._ancestors = {}
+        self._descendants = {}
+        for category_id in self._by_id:
+            self._index_ancestors(category_id)
+        for category_id in self._by_id:
+            descendants = []
+            seen = set([category_id])
+            pending = list(self._children.get(category_id, ()))
+            while pending:
+                child = pending.pop()
+                if child['category_id'] in seen:
+                    continue
+                seen.add(child['category_id'])
+                descendants.append(child)
+                pending.extend(self._children.get(child['category_id'], ()))
+            self._descendants[category_id] = descendants
+
+    def __len__(self):
+        return len(self._by_id)
+
+    def __iter__(self):
+        return iter(self._by_id.values())
+
+    def __contains__(self, category):
+        return self._id(category) in self._by_id
+
+    def get(self, category):
+        """ Returns the category with the given id, or None"""
+        return self._by_id.get(self._id(category))
+
+    def get_by_name(self, name):
+        """ Returns the list of categories with the given name, ignoring case"""
+        return list(self._by_name.get(name.lower(), ()))
+
+    def roots(self):
+        """ Returns the categories without a known parent"""
+        return [category for category in self._by_id.values()
+                if category['parent_id'] not in self._by_id]
+
+    def parent(self, category):
+        category = self.get(category)
+        if category is None:
+            return None
+        return self._by_id.get(category['parent_id'])
+
+    def children(self, category):
+        return list(self._children.get(self._id(category), ()))
+
+    def ancestors(self, category):
+        """ Returns the ancestors of a category, nearest first"""
+        return list(self._ancestors.get(self._id(category), ()))
+
+    def descendants(self, category):
+        return list(self._descendants.get(self._id(category), ()))
+
+    def expand(self, categories):
+        """ Returns the given categories plus all of their descendants, without
+            duplicates, for use as the categories filter of get_places_by_*"""
+        expanded = []
+        seen = set()
+        for category in categories:
+            category = self.get(category)
+            if category is None:
+                continue
+            for member in [category] + self._descendants[category['category_id']]:
+                if member['category_id'] not in seen:
+                    seen.add(member['category_id'])
+                    expanded.append(member)
+        return expanded
+
+    def save(self, path):
+        """ Writes the tree to a json snapshot file"""
+        snapshot = [[category['category_id'], category['name'], category['parent_id']]
+                    for category in self._by_id.values()]
+        _atomic_write(path, _json_dump({'categories': snapshot}))
+
+    @classmethod
+    def load(cls, path):
+        """ Returns a tree read from a snapshot written by save"""
+        with open(path) as snapshot_file:
+            snapshot = _json_load(snapshot_file.read())
+        return cls([Category(category_id, name, parent_id)
+                    for category_id, name, parent_id in snapshot['categories']])
+
+    def _id(self, category):
+        if isinstance(category, dict):
+            return category['category_id']
+        return category
+
+    def _index_ancestors(self, category_id):
+        if category_id in self._ancestors:
+            return self._ancestors[category_id]
+        self._ancestors[category_id] = []
+        ancestors = []
+        parent = self._by_id.get(self._by_id[category_id]['parent_id'])
+        if parent is not None:
+            ancestors = [parent] + self._index_ancestors(parent['category_id'])
+        self._ancestors[category_id] = ancestors
+        return ancestors
+
 
 class Place(FwixDict):
-    
+
+    __slots__ = ()
+
     def __init__(self,
                 uuid,
                 name,
@@ -509,10 +1754,29 @@ class Place(FwixDict):
         self.twitter_id = twitter_id
         super(Place, self).__init__()
 
+    @classmethod
+    def from_json(cls, raw):
+        """ Builds a place, its location and categories straight from decoded
+            json, skipping __init__"""
+        place = dict.__new__(cls)
+        place['uuid'] = raw['uuid']
+        place['name'] = raw['name']
+        place['latitude'] = raw['lat']
+        place['longitude'] = raw['lng']
+        place['phone_number'] = raw['phone_number']
+        place['location'] = Location.from_json(raw)
+        place['link'] = raw['link']
+        place['categories'] = [Category.from_json(category) for category in raw['categories']]
+        place['facebook_id'] = raw.get('facebook_id')
+        place['twitter_id'] = raw.get('twitter_id')
+        return place
+
 
 
 class Content(FwixDict):
 
+    __slots__ = ()
+
     def __init__(self,
                 type,
                 uuid,
@@ -538,18 +1802,43 @@ class Content(FwixDict):
         self.image = image
         super(Content, self).__init__()
 
+    @classmethod
+    def from_json(cls, raw, content_type):
+        """ Builds content of this class straight from decoded json, skipping
+            __init__"""
+        content = dict.__new__(cls)
+        get = raw.get
+        content['type'] = content_type
+        content['uuid'] = get('uuid')
+        content['latitude'] = get('lat')
+        content['longitude'] = get('lng')
+        content['title'] = get('title')
+        content['body'] = get('body')
+        content['author'] = get('author')
+        content['published_at'] = get('published_at')
+        content['link'] = get('link')
+        content['source'] = get('source')
+        content['image'] = get('image')
+        for extra_key in cls.extra_attributes():
+            content[extra_key] = get(extra_key)
+        return content
+
     @classmethod
     def extra_attributes(self):
         return ()
 
 class StatusUpdate(Content):
 
+    __slots__ = ()
+
     def __init__(self, *args, **kwargs):
         super(StatusUpdate, self).__init__(*args, **kwargs)
 
 
 class Photo(Content):
 
+    __slots__ = ()
+
     kTHUMBNAIL = 'thumbnail'
 
     def __init__(self, *args, **kwargs):
@@ -564,6 +1853,8 @@ class Photo(Content):
 
 class Review(Content):
 
+    __slots__ = ()
+
     kRATING = 'rating'
 
     def __init__(self, *args, **kwargs):
@@ -578,24 +1869,32 @@ class Review(Content):
 
 class UserReview(Content):
 
+    __slots__ = ()
+
     def __init__(self, *args, **kwargs):
         super(UserReview, self).__init__(*args, **kwargs)
 
 
 class CriticReview(Content):
 
+    __slots__ = ()
+
     def __init__(self, *args, **kwargs):
         super(CriticReview, self).__init__(*args, **kwargs)
 
 
 class News(Content):
 
+    __slots__ = ()
+
     def __init__(self, *args, **kwargs):
         super(News, self).__init__(*args, **kwargs)
 
 
 class Event(Content):
 
+    __slots__ = ()
+
     kLOCAL_START_TIME = 'local_start_time'
     kLOCAL_END_TIME = 'local_end_time'
 
@@ -612,6 +1911,8 @@ class Event(Content):
 
 class RealEstate(Content):
 
+    __slots__ = ()
+
     kLOCATION = 'location'
     kPRICE = 'price'
     kNUMBER_OF_BEDS = 'number_of_beds'
@@ -629,7 +1930,8 @@ class RealEstate(Content):
     def extra_attributes(self):
         return (self.kLOCATION,
                     self.kPRICE,
-                    self.kNUNBER_OF_BEDS,
+                    self.kNUMBER_OF_BEDS,
+                    self.kNUMBER_OF_BATHS,
                     self.kSQUARE_FEET,
                     self.kPROPERTY_TYPE)
 
@@ -647,6 +1949,8 @@ kCONTENT_TYPE_TO_OBJECT = {
 class Page(FwixDict):
     """ Page is an object that indicates which page number to fetch, given a page size"""
 
+    __slots__ = ()
+
     def __init__(self, page_number, page_size):
         self.page = page_number
         self.page_size = page_size
@@ -654,6 +1958,8 @@ class Page(FwixDict):
 
 class Range(FwixDict):
     """ Range indicates a range between datetime objects """
+
+    __slots__ = ()
     
     def __init__(self,start_date, end_date):
         """ start and end should both be datetime objects """
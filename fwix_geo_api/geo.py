@@ -0,0 +1,84 @@
+"""
+ Geographic helpers: geohash cells and great-circle distances.
+"""
+
+import math
+
+kBASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+kBASE32_INDEX = dict((character, index) for index, character in enumerate(kBASE32))
+kEARTH_RADIUS_MILES = 3958.8
+
+
+def geohash_encode(latitude, longitude, precision = 7):
+    """ Returns the geohash of the given precision containing the point"""
+    lat_range = [-90.0, 90.0]
+    lng_range = [-180.0, 180.0]
+    geohash = []
+    bits = 0
+    bit_count = 0
+    even = True
+    while len(geohash) < precision:
+        if even:
+            value, bounds = longitude, lng_range
+        else:
+            value, bounds = latitude, lat_range
+        middle = (bounds[0] + bounds[1]) / 2
+        bits <<= 1
+        if value >= middle:
+            bits |= 1
+            bounds[0] = middle
+        else:
+            bounds[1] = middle
+        even = not even
+        bit_count += 1
+        if bit_count == 5:
+            geohash.append(kBASE32[bits])
+            bits = 0
+            bit_count = 0
+    return ''.join(geohash)
+
+
+def geohash_decode(geohash):
+    """ Returns (latitude, longitude, latitude_error, longitude_error) for the
+        center of a geohash cell"""
+    lat_range = [-90.0, 90.0]
+    lng_range = [-180.0, 180.0]
+    even = True
+    for character in geohash:
+        index = kBASE32_INDEX[character]
+        for shift in (4, 3, 2, 1, 0):
+            bounds = lng_range if even else lat_range
+            middle = (bounds[0] + bounds[1]) / 2
+            if (index >> shift) & 1:
+                bounds[0] = middle
+            else:
+                bounds[1] = middle
+            even = not even
+    return ((lat_range[0] + lat_range[1]) / 2,
+            (lng_range[0] + lng_range[1]) / 2,
+            (lat_range[1] - lat_range[0]) / 2,
+            (lng_range[1] - lng_range[0]) / 2)
+
+
+def geohash_neighbors(geohash):
+    """ Returns the (up to) eight cells surrounding a geohash cell"""
+    latitude, longitude, lat_error, lng_error = geohash_decode(geohash)
+    neighbors = []
+    for lat_step in (-1, 0, 1):
+        for lng_step in (-1, 0, 1):
+            if lat_step == 0 and lng_step == 0:
+                continue
+            neighbor_lat = latitude + lat_step * 2 * lat_error
+            if not -90 < neighbor_lat < 90:
+                continue
+            neighbor_lng = (longitude + lng_step * 2 * lng_error + 180) % 360 - 180
+            neighbors.append(geohash_encode(neighbor_lat, neighbor_lng, len(geohash)))
+    return neighbors
+
+
+def haversine_miles(latitude1, longitude1, latitude2, longitude2):
+    """ Returns the great-circle distance between two points, in miles"""
+    lat1, lng1, lat2, lng2 = map(math.radians, (latitude1, longitude1, latitude2, longitude2))
+    a = (math.sin((lat2 - lat1) / 2) ** 2 +
+         math.cos(lat1) * math.cos(lat2) * math.sin((lng2 - lng1) / 2) ** 2)
+    return 2 * kEARTH_RADIUS_MILES * math.asin(min(1.0, math.sqrt(a)))
@@ -0,0 +1,107 @@
+"""
+ Incremental decoding of large json responses.
+
+ iter_object_arrays reads a response of the form {"news": [...], "photos": [...]}
+ chunk by chunk and yields each element of the selected top-level arrays as
+ soon as it has been received, so only one element is decoded at a time.
+"""
+
+try:
+    from json import JSONDecoder
+except ImportError:
+    from simplejson import JSONDecoder
+
+kCHUNK_SIZE = 16 * 1024
+kWHITESPACE = ' \t\n\r'
+
+
+class _Reader(object):
+    """ A sliding buffer over a file-like object"""
+
+    def __init__(self, fp, chunk_size):
+        self._fp = fp
+        self._chunk_size = chunk_size
+        self._decoder = JSONDecoder()
+        self.buffer = ''
+        self.pos = 0
+        self.eof = False
+
+    def fill(self, at_least = 0):
+        """ Reads another chunk, or chunks until at least at_least more bytes
+            have arrived, dropping the consumed part of the buffer"""
+        if self.eof:
+            raise ValueError('Unexpected end of json stream')
+        chunks = [self.buffer[self.pos:]]
+        received = 0
+        while True:
+            chunk = self._fp.read(self._chunk_size)
+            if not chunk:
+                self.eof = True
+                break
+            chunks.append(chunk)
+            received += len(chunk)
+            if received >= at_least:
+                break
+        self.buffer = ''.join(chunks)
+        self.pos = 0
+
+    def peek(self):
+        """ Returns the next non-whitespace character without consuming it"""
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos] in kWHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            self.fill()
+
+    def expect(self, character):
+        if self.peek() != character:
+            raise ValueError('Expected %r at %r' % (character, self.buffer[self.pos:self.pos + 20]))
+        self.pos += 1
+
+    def value(self):
+        """ Decodes the next complete json value"""
+        self.peek()
+        while True:
+            try:
+                value, end = self._decoder.raw_decode(self.buffer, self.pos)
+            except ValueError:
+                # doubling what is buffered of a large value keeps decoding
+                # it linear, rather than one retry per chunk
+                self.fill(len(self.buffer) - self.pos)
+                continue
+            # a number ending the buffer may continue in the next chunk
+            if end == len(self.buffer) and not self.eof:
+                self.fill()
+                continue
+            self.pos = end
+            return value
+
+
+def iter_object_arrays(fp, keys, chunk_size = kCHUNK_SIZE):
+    """ Yields (key, element) for every element of the arrays stored under
+        keys in the top-level json object read from fp. Other members are
+        decoded and skipped."""
+    reader = _Reader(fp, chunk_size)
+    reader.expect('{')
+    if reader.peek() == '}':
+        return
+    while True:
+        key = reader.value()
+        reader.expect(':')
+        if key in keys and reader.peek() == '[':
+            reader.expect('[')
+            if reader.peek() == ']':
+                reader.expect(']')
+            else:
+                while True:
+                    yield key, reader.value()
+                    if reader.peek() == ']':
+                        reader.expect(']')
+                        break
+                    reader.expect(',')
+        else:
+            reader.value()
+        if reader.peek() == '}':
+            return
+        reader.expect(',')
@@ -0,0 +1,282 @@
+"""
+ Tiled prefetching of an area through FwixApi.
+
+ An AreaPrefetcher covers a bounding box or polygon with rectangular tiles,
+ each queried with the circle circumscribing it, so neighbouring circles
+ overlap and leave no gaps. Every tile's places are paged through; a tile
+ that fills max_pages pages probably holds more places than the api will
+ page to, so it is split into four tiles of half the radius and those are
+ fetched in turn. Places land in the client's response cache and spatial
+ index as they are parsed, and tiles fetched in full are marked covered in
+ the spatial index so later queries inside them are answered locally.
+
+ Tiles are fetched concurrently, one level of subdivision at a time. With a
+ state_path, the tiles still to fetch are saved as the run goes, and a run
+ of the same area started with resume = True continues from them.
+"""
+
+import collections, math, os, threading, time
+
+from .fwix_geo_api import FwixApi, FwixApiError, _json_load, _json_dump, _atomic_write
+
+kMILES_PER_DEGREE = 69.0
+kDEFAULT_MAX_PAGES = 10
+kDEFAULT_MIN_RADIUS = 1.0
+kSTATE_INTERVAL = 10.0
+# circles are made slightly larger than their tiles to absorb the flat-earth
+# approximation of degrees to miles
+kCOVER_MARGIN = 0.99
+
+
+class Tile(object):
+    """ A latitude/longitude rectangle, given by its center and half extents
+        in degrees, and the radius in miles of the circle covering it"""
+
+    __slots__ = ('latitude', 'longitude', 'half_lat', 'half_lng', 'radius', 'level')
+
+    def __init__(self, latitude, longitude, half_lat, half_lng, radius, level = 0):
+        self.latitude = latitude
+        self.longitude = longitude
+        self.half_lat = half_lat
+        self.half_lng = half_lng
+        self.radius = radius
+        self.level = level
+
+    def corners(self):
+        return [(self.latitude + lat_sign * self.half_lat, self.longitude + lng_sign * self.half_lng)
+                for lat_sign, lng_sign in ((-1, -1), (-1, 1), (1, 1), (1, -1))]
+
+    def split(self):
+        """ Returns the four quadrants of this tile"""
+        half_lat, half_lng = self.half_lat / 2, self.half_lng / 2
+        return [Tile(self.latitude + lat_sign * half_lat, self.longitude + lng_sign * half_lng,
+                     half_lat, half_lng, self.radius / 2.0, self.level + 1)
+                for lat_sign in (-1, 1) for lng_sign in (-1, 1)]
+
+    def to_list(self):
+        return [getattr(self, name) for name in self.__slots__]
+
+    def __repr__(self):
+        return 'Tile(%r, %r, radius=%r, level=%r)' % (self.latitude, self.longitude,
+                                                      self.radius, self.level)
+
+
+def tile_bbox(south, west, north, east, radius):
+    """ Returns tiles covering the bounding box, each small enough for a
+        circle of radius miles to contain it"""
+    side = radius * math.sqrt(2) * kCOVER_MARGIN
+    rows = max(1, int(math.ceil((north - south) * kMILES_PER_DEGREE / side)))
+    lat_step = (north - south) / float(rows)
+    tiles = []
+    for row in xrange(rows):
+        row_south = south + row * lat_step
+        # degrees of longitude are shortest along the edge furthest from the equator
+        widest = max(abs(row_south), abs(row_south + lat_step))
+        cos_latitude = max(math.cos(math.radians(min(widest, 89.9))), 0.01)
+        columns = max(1, int(math.ceil((east - west) * kMILES_PER_DEGREE * cos_latitude / side)))
+        lng_step = (east - west) / float(columns)
+        for column in xrange(columns):
+            tiles.append(Tile(row_south + lat_step / 2, west + (column + 0.5) * lng_step,
+                              lat_step / 2, lng_step / 2, radius))
+    return tiles
+
+
+def point_in_polygon(latitude, longitude, polygon):
+    """ Returns whether the point lies inside the polygon, a list of
+        (latitude, longitude) vertices"""
+    inside = False
+    previous_lat, previous_lng = polygon[-1]
+    for vertex_lat, vertex_lng in polygon:
+        if (vertex_lat > latitude) != (previous_lat > latitude):
+            crossing = (previous_lng - vertex_lng) * (latitude - vertex_lat) / (previous_lat - vertex_lat) + vertex_lng
+            if longitude < crossing:
+                inside = not inside
+        previous_lat, previous_lng = vertex_lat, vertex_lng
+    return inside
+
+
+def _segments_cross(a, b, c, d):
+    def side(p, q, r):
+        return (q[0] - p[0]) * (r[1] - p[1]) - (q[1] - p[1]) * (r[0] - p[0])
+    return (side(a, b, c) * side(a, b, d) < 0) and (side(c, d, a) * side(c, d, b) < 0)
+
+
+def tile_intersects_polygon(tile, polygon):
+    """ Returns whether any part of the tile lies inside the polygon"""
+    corners = tile.corners()
+    if any(point_in_polygon(latitude, longitude, polygon) for latitude, longitude in corners):
+        return True
+    for latitude, longitude in polygon:
+        if (abs(latitude - tile.latitude) <= tile.half_lat and
+                abs(longitude - tile.longitude) <= tile.half_lng):
+            return True
+    edges = zip(corners, corners[1:] + corners[:1])
+    previous = polygon[-1]
+    for vertex in polygon:
+        for start, end in edges:
+            if _segments_cross(previous, vertex, start, end):
+                return True
+        previous = vertex
+    return False
+
+
+class AreaPrefetcher(object):
+    """ Warms a client's caches with every place (and optionally recent
+        content) in an area.
+
+        fx_api - the FwixApi to fetch through, usually with a cache and a
+                 spatial_index
+        radius - radius of the top level query circles, in miles
+        categories - only prefetch places in these categories
+        content_types - also prefetch content of these types; the content api
+                        takes no radius, so content is fetched once per top
+                        level tile
+        content_range - a Range limiting the content to recent items
+        max_pages - pages fetched per tile; a tile filling them all is split
+        min_radius - tiles are not split below this radius, in miles
+        state_path - a json file the tiles still to fetch are saved to
+        progress - called with the stats() dict after every tile
+        sink - called with (tile, places, content) for every tile fetched, to
+               keep the results somewhere other than the client's caches
+    """
+
+    def __init__(self,
+                 fx_api,
+                 radius = FwixApi.kDEFAULT_RADIUS,
+                 categories = None,
+                 content_types = None,
+                 content_range = None,
+                 page_size = FwixApi.kDEFAULT_PAGE_SIZE,
+                 max_pages = kDEFAULT_MAX_PAGES,
+                 min_radius = kDEFAULT_MIN_RADIUS,
+                 max_workers = FwixApi.kDEFAULT_BULK_WORKERS,
+                 state_path = None,
+                 state_interval = kSTATE_INTERVAL,
+                 progress = None,
+                 sink = None):
+        self.fx_api = fx_api
+        self.radius = radius
+        self.categories = categories
+        self.content_types = content_types
+        self.content_range = content_range
+        self.page_size = page_size
+        self.max_pages = max_pages
+        self.min_radius = min_radius
+        self.max_workers = max_workers
+        self.state_path = state_path
+        self.state_interval = state_interval
+        self.progress = progress
+        self.sink = sink
+        self._lock = threading.Lock()
+        self._place_uuids = set()
+        self._content_uuids = set()
+        self._started = None
+        self._area = None
+        self._stats = {'tiles': 0, 'pending': 0, 'subdivided': 0, 'truncated': 0, 'failed': 0}
+
+    def prefetch_bbox(self, south, west, north, east, resume = False):
+        """ Prefetches the places between the given latitudes and longitudes.
+            Returns stats()"""
+        return self._run(tile_bbox(south, west, north, east, self.radius), None,
+                         ['bbox', south, west, north, east], resume)
+
+    def prefetch_polygon(self, polygon, resume = False):
+        """ Prefetches the places inside a polygon given as a list of
+            (latitude, longitude) vertices. Returns stats()"""
+        polygon = [tuple(vertex) for vertex in polygon]
+        latitudes = [latitude for latitude, _ in polygon]
+        longitudes = [longitude for _, longitude in polygon]
+        tiles = tile_bbox(min(latitudes), min(longitudes), max(latitudes), max(longitudes), self.radius)
+        tiles = [tile for tile in tiles if tile_intersects_polygon(tile, polygon)]
+        return self._run(tiles, polygon, ['polygon', [list(vertex) for vertex in polygon]], resume)
+
+    def stats(self):
+        """ Returns tiles fetched, pending, subdivided, truncated (filled every
+            page at min_radius) and failed, the distinct places and content
+            items seen, and the seconds elapsed"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats['places'] = len(self._place_uuids)
+            stats['content'] = len(self._content_uuids)
+        stats['seconds'] = time.time() - self._started if self._started else 0.0
+        return stats
+
+    def _run(self, tiles, polygon, area, resume):
+        self._started = time.time()
+        self._area = area
+        if resume and self.state_path and os.path.exists(self.state_path):
+            with open(self.state_path) as state_file:
+                state = _json_load(state_file.read())
+            if state.get('area') != area:
+                raise ValueError('%s is the state of prefetching %r' % (self.state_path, state.get('area')))
+            tiles = [Tile(*values) for values in state['pending']]
+            self._stats.update(state['stats'])
+            # the failed tiles are among those pending, and are counted again if they fail
+            self._stats['failed'] = 0
+        failed = []
+        while tiles:
+            remaining = collections.OrderedDict(enumerate(tiles))
+            children = []
+            self._stats['pending'] = len(tiles)
+            last_saved = time.time()
+            for (index, tile), result in self.fx_api._bulk(self._fetch_tile, remaining.items(),
+                                                           self.max_workers, False):
+                with self._lock:
+                    del remaining[index]
+                    self._stats['pending'] -= 1
+                    if isinstance(result, FwixApiError):
+                        failed.append(tile)
+                        self._stats['failed'] += 1
+                    else:
+                        self._stats['tiles'] += 1
+                        split = self._finish_tile(tile, result, polygon)
+                        children.extend(split)
+                        self._stats['pending'] += len(split)
+                if self.progress:
+                    self.progress(self.stats())
+                if self.state_path and time.time() - last_saved >= self.state_interval:
+                    self._save_state(remaining.values() + children + failed)
+                    last_saved = time.time()
+            tiles = children
+        if self.state_path:
+            if failed:
+                # a resumed run retries the tiles that failed
+                self._save_state(failed)
+            elif os.path.exists(self.state_path):
+                os.remove(self.state_path)
+        return self.stats()
+
+    def _fetch_tile(self, item):
+        index, tile = item
+        limit = self.page_size * self.max_pages
+        places = list(self.fx_api.iter_places_by_lat_lng(tile.latitude, tile.longitude, tile.radius,
+                                                          self.categories, self.page_size, limit))
+        content = []
+        if self.content_types and tile.level == 0:
+            content = list(self.fx_api.iter_content_by_lat_lng(
+                tile.latitude, tile.longitude, self.content_types, self.content_range,
+                page_size = self.page_size, max_items = limit))
+        if self.sink:
+            self.sink(tile, places, content)
+        return places, content, len(places) >= limit
+
+    def _finish_tile(self, tile, result, polygon):
+        """ Records a fetched tile and returns the tiles it is split into"""
+        places, content, truncated = result
+        self._place_uuids.update(place['uuid'] for place in places)
+        self._content_uuids.update(item['uuid'] for item in content)
+        if not truncated:
+            index = self.fx_api._spatial_index
+            if index is not None:
+                index.mark_covered(tile.latitude, tile.longitude, tile.radius, self.categories)
+            return []
+        if tile.radius / 2.0 < self.min_radius:
+            self._stats['truncated'] += 1
+            return []
+        self._stats['subdivided'] += 1
+        return [child for child in tile.split()
+                if polygon is None or tile_intersects_polygon(child, polygon)]
+
+    def _save_state(self, tiles):
+        state = {'area': self._area, 'pending': [tile.to_list() for tile in tiles], 'stats': self._stats}
+        _atomic_write(self.state_path, _json_dump(state))
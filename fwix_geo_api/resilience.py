@@ -0,0 +1,254 @@
+"""
+ Tail-latency and failure isolation policies for FwixApi.
+
+ EndpointTimeouts gives each endpoint its own socket timeout. HedgePolicy
+ tracks each endpoint's recent latencies and, once a GET has been
+ outstanding for longer than the observed p95, lets the client send a
+ duplicate and take whichever answers first. CircuitBreaker watches each
+ endpoint's error rate and, when it spikes, stops sending requests for a
+ while so callers fail fast (or get stale cached data) instead of waiting
+ on a struggling server.
+"""
+
+import collections, threading, time
+
+
+def _longest_prefix(path, prefixes):
+    best = None
+    for prefix in prefixes:
+        if path.startswith(prefix) and (best is None or len(prefix) > len(best)):
+            best = prefix
+    return best
+
+
+class EndpointTimeouts(object):
+    """ Socket timeouts, in seconds, per url path prefix; the longest
+        matching prefix wins and default applies to other paths. None means
+        the connection pool's own timeout."""
+
+    def __init__(self, timeouts = None, default = None):
+        self.timeouts = dict(timeouts or {})
+        self.default = default
+
+    def timeout(self, path):
+        prefix = _longest_prefix(path, self.timeouts)
+        if prefix is None:
+            return self.default
+        return self.timeouts[prefix]
+
+
+class HedgePolicy(object):
+    """ Decides when a GET is hedged with a duplicate request.
+
+        quantile - the latency quantile after which a request is hedged
+        window - the recent latencies kept per endpoint
+        min_samples - latencies an endpoint needs before it is hedged
+        min_delay - the shortest wait before hedging, in seconds
+        max_ratio - hedges allowed per request sent, so that a slow server
+                    never sees more than 1 + max_ratio times the load
+    """
+
+    kDEFAULT_QUANTILE = 0.95
+    kDEFAULT_WINDOW = 200
+    kDEFAULT_MIN_SAMPLES = 20
+    kDEFAULT_MIN_DELAY = 0.005
+    kDEFAULT_MAX_RATIO = 0.1
+    # latencies observed between recomputations of an endpoint's delay
+    kREFRESH = 10
+
+    def __init__(self,
+                 quantile = kDEFAULT_QUANTILE,
+                 window = kDEFAULT_WINDOW,
+                 min_samples = kDEFAULT_MIN_SAMPLES,
+                 min_delay = kDEFAULT_MIN_DELAY,
+                 max_ratio = kDEFAULT_MAX_RATIO):
+        self.quantile = quantile
+        self.window = window
+        self.min_samples = min_samples
+        self.min_delay = min_delay
+        self.max_ratio = max_ratio
+        self._lock = threading.Lock()
+        self._latencies = {}
+        self._delays = {}
+        self._unsorted = {}
+        self._stats = {'requests': 0, 'hedged': 0, 'hedge_wins': 0, 'denied': 0}
+
+    def delay(self, endpoint):
+        """ Returns how long a GET to endpoint waits before it is hedged, or
+            None while too few latencies have been observed"""
+        with self._lock:
+            self._stats['requests'] += 1
+            return self._delays.get(endpoint)
+
+    def observe(self, endpoint, latency):
+        """ Records the latency of a completed request"""
+        with self._lock:
+            latencies = self._latencies.get(endpoint)
+            if latencies is None:
+                latencies = self._latencies[endpoint] = collections.deque(maxlen = self.window)
+            latencies.append(latency)
+            unsorted = self._unsorted.get(endpoint, 0) + 1
+            if len(latencies) >= self.min_samples and (unsorted >= self.kREFRESH or
+                                                       endpoint not in self._delays):
+                ordered = sorted(latencies)
+                index = min(len(ordered) - 1, int(self.quantile * len(ordered)))
+                self._delays[endpoint] = max(self.min_delay, ordered[index])
+                unsorted = 0
+            self._unsorted[endpoint] = unsorted
+
+    def allow(self):
+        """ Returns whether the hedging budget allows another hedge, counting
+            it if so"""
+        with self._lock:
+            if self._stats['hedged'] + 1 > self.max_ratio * self._stats['requests']:
+                self._stats['denied'] += 1
+                return False
+            self._stats['hedged'] += 1
+            return True
+
+    def record_win(self):
+        """ Counts a hedge that answered before the request it duplicated"""
+        with self._lock:
+            self._stats['hedge_wins'] += 1
+
+    def stats(self):
+        """ Returns request, hedge, hedge win and denied hedge counters, and
+            the current delay per endpoint"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats['delays'] = dict(self._delays)
+        return stats
+
+
+class _Circuit(object):
+
+    __slots__ = ('state', 'opened', 'probing', 'buckets')
+
+    def __init__(self):
+        self.state = CircuitBreaker.kCLOSED
+        self.opened = None
+        # when the probe of a half open circuit was let through
+        self.probing = None
+        self.buckets = collections.deque()
+
+
+class CircuitBreaker(object):
+    """ A circuit per endpoint that opens when the endpoint's error rate
+        spikes. An open circuit refuses requests for reset_timeout seconds,
+        then lets a single probe through; the probe's success closes it
+        again, its failure reopens it. A probe that has not answered within
+        probe_timeout seconds is given up on and another is let through.
+        Requests that were already in flight when the circuit opened finish
+        without changing its state.
+
+        failure_ratio - the share of failed calls that opens the circuit
+        min_calls - calls in the window before the ratio is trusted
+        window - seconds of calls the ratio is computed over
+        reset_timeout - seconds an open circuit refuses requests
+        probe_timeout - seconds a half open circuit waits on its probe
+        serve_stale - answer refused GETs with expired cached responses
+                      when the client's cache still holds them
+    """
+
+    kCLOSED = 'closed'
+    kOPEN = 'open'
+    kHALF_OPEN = 'half_open'
+    # what allow() returns to the one request probing a half open circuit
+    kPROBE = 'probe'
+    kDEFAULT_FAILURE_RATIO = 0.5
+    kDEFAULT_MIN_CALLS = 20
+    kDEFAULT_WINDOW = 30
+    kDEFAULT_RESET_TIMEOUT = 30.0
+    kDEFAULT_PROBE_TIMEOUT = 30.0
+
+    def __init__(self,
+                 failure_ratio = kDEFAULT_FAILURE_RATIO,
+                 min_calls = kDEFAULT_MIN_CALLS,
+                 window = kDEFAULT_WINDOW,
+                 reset_timeout = kDEFAULT_RESET_TIMEOUT,
+                 serve_stale = True,
+                 probe_timeout = kDEFAULT_PROBE_TIMEOUT):
+        self.failure_ratio = failure_ratio
+        self.min_calls = min_calls
+        self.window = window
+        self.reset_timeout = reset_timeout
+        self.probe_timeout = probe_timeout
+        self.serve_stale = serve_stale
+        self._lock = threading.Lock()
+        self._circuits = {}
+        self._stats = {'opened': 0, 'rejected': 0, 'stale': 0}
+
+    def allow(self, endpoint):
+        """ Returns whether a request to endpoint may be sent: True, kPROBE
+            for the probe of a half open circuit, or False"""
+        now = time.time()
+        with self._lock:
+            circuit = self._circuits.get(endpoint)
+            if circuit is None or circuit.state == self.kCLOSED:
+                return True
+            if circuit.state == self.kOPEN and now - circuit.opened >= self.reset_timeout:
+                circuit.state = self.kHALF_OPEN
+            if circuit.state == self.kHALF_OPEN and (circuit.probing is None or
+                                                     now - circuit.probing >= self.probe_timeout):
+                circuit.probing = now
+                return self.kPROBE
+            self._stats['rejected'] += 1
+            return False
+
+    def record(self, endpoint, success, allowed = True):
+        """ Records the outcome of a request that allow() let through, given
+            what allow() returned for it"""
+        now = time.time()
+        with self._lock:
+            circuit = self._circuits.get(endpoint)
+            if circuit is None:
+                circuit = self._circuits[endpoint] = _Circuit()
+            if circuit.state != self.kCLOSED:
+                # only the probe decides whether the circuit closes again
+                if allowed != self.kPROBE:
+                    return
+                circuit.probing = None
+                if success:
+                    circuit.state = self.kCLOSED
+                    circuit.buckets.clear()
+                elif circuit.state != self.kOPEN:
+                    circuit.state, circuit.opened = self.kOPEN, now
+                    self._stats['opened'] += 1
+                return
+            # calls are counted in one second buckets
+            second = int(now)
+            buckets = circuit.buckets
+            while buckets and buckets[0][0] <= second - self.window:
+                buckets.popleft()
+            if not buckets or buckets[-1][0] != second:
+                buckets.append([second, 0, 0])
+            buckets[-1][1] += 1
+            if not success:
+                buckets[-1][2] += 1
+                calls = sum(bucket[1] for bucket in buckets)
+                failures = sum(bucket[2] for bucket in buckets)
+                if calls >= self.min_calls and failures >= self.failure_ratio * calls:
+                    circuit.state, circuit.opened = self.kOPEN, now
+                    self._stats['opened'] += 1
+
+    def record_stale(self):
+        """ Counts a refused request answered from stale cached data"""
+        with self._lock:
+            self._stats['stale'] += 1
+
+    def state(self, endpoint):
+        with self._lock:
+            circuit = self._circuits.get(endpoint)
+            if circuit is None:
+                return self.kCLOSED
+            return circuit.state
+
+    def stats(self):
+        """ Returns opened, rejected and stale counters, and the state of every
+            circuit that is not closed"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats['circuits'] = dict((endpoint, circuit.state)
+                                     for endpoint, circuit in self._circuits.items()
+                                     if circuit.state != self.kCLOSED)
+        return stats
@@ -0,0 +1,197 @@
+"""
+ A local spatial index of places.
+
+ Places are bucketed into a uniform latitude/longitude grid. The index also
+ records which circular regions are known to be complete, that is, regions
+ for which the api returned every matching place. A radius query that lies
+ entirely inside such a region can then be answered without the api. When
+ a region expires, the places only it covered are evicted with it.
+"""
+
+import math, threading, time
+
+from .geo import haversine_miles
+
+kMILES_PER_DEGREE = 69.0
+
+
+class CoveredRegion(object):
+    """ A circle whose places have all been fetched; category_ids is None when
+        the fetch was not filtered by category"""
+
+    __slots__ = ('latitude', 'longitude', 'radius', 'category_ids', 'expires')
+
+    def __init__(self, latitude, longitude, radius, category_ids, expires):
+        self.latitude = latitude
+        self.longitude = longitude
+        self.radius = radius
+        self.category_ids = category_ids
+        self.expires = expires
+
+    def contains(self, latitude, longitude, radius, category_ids):
+        if self.category_ids is not None:
+            if category_ids is None or not category_ids.issubset(self.category_ids):
+                return False
+        distance = haversine_miles(self.latitude, self.longitude, latitude, longitude)
+        return distance + radius <= self.radius
+
+    def holds(self, place):
+        """ Returns whether the place is one of those fetched for the region"""
+        if self.category_ids is not None and not self.category_ids.intersection(
+                category['category_id'] for category in place['categories']):
+            return False
+        return self.reaches(place['latitude'], place['longitude'])
+
+    def reaches(self, latitude, longitude):
+        return haversine_miles(self.latitude, self.longitude, latitude, longitude) <= self.radius
+
+
+class SpatialIndex(object):
+    """ A thread-safe grid index of places with coverage tracking.
+
+        cell_size - grid cell edge, in degrees
+        coverage_ttl - seconds a covered region is trusted, None for ever
+    """
+
+    kDEFAULT_CELL_SIZE = 0.01
+    kDEFAULT_COVERAGE_TTL = 60 * 60
+
+    def __init__(self,
+                 cell_size = kDEFAULT_CELL_SIZE,
+                 coverage_ttl = kDEFAULT_COVERAGE_TTL):
+        self.cell_size = cell_size
+        self.coverage_ttl = coverage_ttl
+        self._lock = threading.Lock()
+        self._cells = {}
+        self._places = {}
+        self._regions = []
+        self._stats = {'local_queries': 0, 'remote_queries': 0, 'evicted': 0}
+
+    def __len__(self):
+        return len(self._places)
+
+    def add(self, place):
+        """ Adds or replaces a place, keyed on its uuid"""
+        cell = self._cell(place['latitude'], place['longitude'])
+        with self._lock:
+            previous = self._places.get(place['uuid'])
+            if previous is not None:
+                self._cells[previous[0]].pop(place['uuid'], None)
+            self._places[place['uuid']] = (cell, place)
+            self._cells.setdefault(cell, {})[place['uuid']] = place
+
+    def remove(self, uuid):
+        with self._lock:
+            previous = self._places.pop(uuid, None)
+            if previous is not None:
+                self._cells[previous[0]].pop(uuid, None)
+
+    def invalidate(self, uuid, latitude = None, longitude = None):
+        """ Forgets a place that has changed on the server, and the coverage
+            of its old and new (latitude, longitude) positions, since those
+            regions may no longer hold the current places"""
+        with self._lock:
+            points = []
+            previous = self._places.get(uuid)
+            if previous is not None:
+                points.append((previous[1]['latitude'], previous[1]['longitude']))
+            if latitude is not None and longitude is not None:
+                points.append((float(latitude), float(longitude)))
+            for region in self._regions:
+                if any(region.reaches(point_lat, point_lng) for point_lat, point_lng in points):
+                    region.expires = 0
+            self._prune(time.time())
+            previous = self._places.pop(uuid, None)
+            if previous is not None:
+                self._cells[previous[0]].pop(uuid, None)
+
+    def mark_covered(self, latitude, longitude, radius, categories = None):
+        """ Records that every place within radius miles (in the given
+            categories) has been added to the index"""
+        expires = None
+        if self.coverage_ttl is not None:
+            expires = time.time() + self.coverage_ttl
+        region = CoveredRegion(latitude, longitude, radius, _category_ids(categories), expires)
+        with self._lock:
+            self._prune(time.time())
+            self._regions.append(region)
+
+    def is_covered(self, latitude, longitude, radius, categories = None):
+        """ Returns whether the query circle lies inside a covered region"""
+        category_ids = _category_ids(categories)
+        now = time.time()
+        with self._lock:
+            self._prune(now)
+            for region in self._regions:
+                if region.contains(latitude, longitude, radius, category_ids):
+                    return True
+        return False
+
+    def query(self, latitude, longitude, radius, categories = None):
+        """ Returns the indexed places within radius miles, nearest first"""
+        category_ids = _category_ids(categories)
+        found = []
+        with self._lock:
+            for cell in self._cells_within(latitude, longitude, radius):
+                for place in self._cells.get(cell, {}).itervalues():
+                    if category_ids is not None and not category_ids.intersection(
+                            category['category_id'] for category in place['categories']):
+                        continue
+                    distance = haversine_miles(latitude, longitude,
+                                               place['latitude'], place['longitude'])
+                    if distance <= radius:
+                        found.append((distance, place))
+        found.sort(key = lambda item: item[0])
+        return [place for _, place in found]
+
+    def record_query(self, local):
+        """ Counts a radius query answered locally (local) or by the api"""
+        with self._lock:
+            self._stats[local and 'local_queries' or 'remote_queries'] += 1
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['places'] = len(self._places)
+            stats['covered_regions'] = len(self._regions)
+        return stats
+
+    def _prune(self, now):
+        """ Drops expired regions and the places no live region holds; called
+            with the lock held"""
+        expired = [region for region in self._regions
+                   if region.expires is not None and region.expires <= now]
+        if not expired:
+            return
+        self._regions = [region for region in self._regions
+                         if region.expires is None or region.expires > now]
+        for region in expired:
+            for cell in self._cells_within(region.latitude, region.longitude, region.radius):
+                places = self._cells.get(cell)
+                if not places:
+                    continue
+                for uuid, place in places.items():
+                    if region.holds(place) and not any(live.holds(place) for live in self._regions):
+                        del places[uuid]
+                        del self._places[uuid]
+                        self._stats['evicted'] += 1
+
+    def _cells_within(self, latitude, longitude, radius):
+        """ Yields the grid cells a circle of radius miles overlaps"""
+        lat_cells = int(math.ceil(radius / kMILES_PER_DEGREE / self.cell_size))
+        cos_latitude = max(math.cos(math.radians(latitude)), 0.01)
+        lng_cells = int(math.ceil(radius / (kMILES_PER_DEGREE * cos_latitude) / self.cell_size))
+        center_row, center_column = self._cell(latitude, longitude)
+        for row in xrange(center_row - lat_cells, center_row + lat_cells + 1):
+            for column in xrange(center_column - lng_cells, center_column + lng_cells + 1):
+                yield row, column
+
+    def _cell(self, latitude, longitude):
+        return (int(math.floor(float(latitude) / self.cell_size)),
+                int(math.floor(float(longitude) / self.cell_size)))
+
+
+def _category_ids(categories):
+    if not categories:
+        return None
+    return frozenset(category['category_id'] for category in categories)
@@ -0,0 +1,194 @@
+"""
+ Per-call instrumentation for FwixApi.
+
+ When a client is given a StatsRegistry, every api call produces a CallStats
+ record breaking its latency down into phases (request build, DNS, connect,
+ time to first byte, network total, JSON decode, model construction). The
+ registry passes each record to its hooks and aggregates them into
+ per-endpoint histograms that can be exported as OpenMetrics text.
+"""
+
+import re, threading
+
+kPHASES = ('build', 'dns', 'connect', 'ttfb', 'network', 'decode', 'parse', 'total')
+kDEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+                    0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+kUUID_PATH = re.compile(r'^/places/[^/]+\.json$')
+
+
+def endpoint_name(path):
+    """ Returns path with place uuids replaced, so calls group per endpoint"""
+    if kUUID_PATH.match(path):
+        return '/places/{uuid}.json'
+    return path
+
+
+class CallStats(object):
+    """ The timings, in seconds, and sizes of one api call; bytes is what came
+        over the wire, decoded_bytes the body after decompression. Phases that
+        did not happen (a reused connection's dns and connect, the network
+        phases of a cached or coalesced call) are left at None."""
+
+    __slots__ = ('endpoint', 'method', 'status', 'cached', 'coalesced', 'hedged', 'reused',
+                 'attempts', 'bytes', 'decoded_bytes', 'items', 'error') + kPHASES
+
+    def __init__(self, endpoint, method):
+        self.endpoint = endpoint
+        self.method = method
+        self.status = None
+        self.cached = False
+        self.coalesced = False
+        self.hedged = False
+        self.reused = None
+        self.attempts = 0
+        self.bytes = 0
+        self.decoded_bytes = 0
+        self.items = None
+        self.error = None
+        for phase in kPHASES:
+            setattr(self, phase, None)
+
+    def to_dict(self):
+        return dict((name, getattr(self, name)) for name in self.__slots__)
+
+    def __repr__(self):
+        return 'CallStats(%r)' % self.to_dict()
+
+
+class Histogram(object):
+    """ Cumulative bucket counts plus sum and count of observed values"""
+
+    __slots__ = ('bounds', 'counts', 'sum', 'count')
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * len(bounds)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        for i in xrange(len(self.bounds) - 1, -1, -1):
+            if value > self.bounds[i]:
+                break
+            self.counts[i] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q):
+        """ Returns the upper bound of the bucket holding the q-th quantile, or
+            None when it falls beyond the last bucket"""
+        if not self.count:
+            return None
+        rank = q * self.count
+        for bound, count in zip(self.bounds, self.counts):
+            if count >= rank:
+                return bound
+        return None
+
+
+class StatsRegistry(object):
+    """ Aggregates CallStats records and fans them out to hooks.
+
+        buckets - histogram upper bounds, in seconds
+    """
+
+    def __init__(self, buckets = kDEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self._hooks = []
+        self._histograms = {}
+        self._counters = {}
+
+    def add_hook(self, hook):
+        """ Calls hook(call_stats) after every api call"""
+        with self._lock:
+            self._hooks = self._hooks + [hook]
+
+    def remove_hook(self, hook):
+        with self._lock:
+            self._hooks = [h for h in self._hooks if h is not hook]
+
+    def record(self, call):
+        with self._lock:
+            for phase in kPHASES:
+                value = getattr(call, phase)
+                if value is not None:
+                    key = (call.endpoint, phase)
+                    histogram = self._histograms.get(key)
+                    if histogram is None:
+                        histogram = self._histograms[key] = Histogram(self.buckets)
+                    histogram.observe(value)
+            if call.cached:
+                outcome = 'cached'
+            elif call.coalesced:
+                outcome = 'coalesced'
+            else:
+                outcome = str(call.status or 'error')
+            self._count(('requests', call.endpoint, call.method, outcome), 1)
+            self._count(('response_bytes', call.endpoint), call.bytes)
+            self._count(('response_decoded_bytes', call.endpoint), call.decoded_bytes)
+            self._count(('items', call.endpoint), call.items or 0)
+            if call.attempts > 1:
+                self._count(('retries', call.endpoint), call.attempts - 1)
+            if call.hedged:
+                self._count(('hedges', call.endpoint), 1)
+            hooks = self._hooks
+        for hook in hooks:
+            hook(call)
+
+    def histogram(self, endpoint, phase):
+        """ Returns the Histogram for an endpoint's phase, or None"""
+        return self._histograms.get((endpoint, phase))
+
+    def snapshot(self):
+        """ Returns {endpoint: {phase: {'count', 'sum', 'p50', 'p95', 'p99'}}}"""
+        snapshot = {}
+        with self._lock:
+            for (endpoint, phase), histogram in self._histograms.items():
+                snapshot.setdefault(endpoint, {})[phase] = {
+                    'count': histogram.count,
+                    'sum': histogram.sum,
+                    'p50': histogram.quantile(0.5),
+                    'p95': histogram.quantile(0.95),
+                    'p99': histogram.quantile(0.99)}
+        return snapshot
+
+    def clear(self):
+        with self._lock:
+            self._histograms.clear()
+            self._counters.clear()
+
+    def to_openmetrics(self):
+        """ Returns the registry in the OpenMetrics text exposition format"""
+        lines = []
+        with self._lock:
+            lines.append('# TYPE fwix_request_phase_seconds histogram')
+            lines.append('# UNIT fwix_request_phase_seconds seconds')
+            for (endpoint, phase), histogram in sorted(self._histograms.items()):
+                labels = 'endpoint="%s",phase="%s"' % (_escape(endpoint), phase)
+                for bound, count in zip(histogram.bounds, histogram.counts):
+                    lines.append('fwix_request_phase_seconds_bucket{%s,le="%s"} %d' % (labels, bound, count))
+                lines.append('fwix_request_phase_seconds_bucket{%s,le="+Inf"} %d' % (labels, histogram.count))
+                lines.append('fwix_request_phase_seconds_sum{%s} %r' % (labels, histogram.sum))
+                lines.append('fwix_request_phase_seconds_count{%s} %d' % (labels, histogram.count))
+            for name, label_names in (('requests', ('endpoint', 'method', 'outcome')),
+                                      ('retries', ('endpoint',)),
+                                      ('hedges', ('endpoint',)),
+                                      ('response_bytes', ('endpoint',)),
+                                      ('response_decoded_bytes', ('endpoint',)),
+                                      ('items', ('endpoint',))):
+                lines.append('# TYPE fwix_%s counter' % name)
+                for key, value in sorted(self._counters.items()):
+                    if key[0] == name:
+                        labels = ','.join('%s="%s"' % (label, _escape(label_value))
+                                          for label, label_value in zip(label_names, key[1:]))
+                        lines.append('fwix_%s_total{%s} %d' % (name, labels, value))
+        lines.append('# EOF')
+        return '\n'.join(lines) + '\n'
+
+    def _count(self, key, amount):
+        self._counters[key] = self._counters.get(key, 0) + amount
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
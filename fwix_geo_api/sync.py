@@ -0,0 +1,151 @@
+"""
+ Incremental content polling for FwixApi.
+
+ A ContentSync remembers, for every content query it has run, the newest
+ published_at it has seen (the watermark) and asks the api only for content
+ published since then. Results are merged into one uuid-keyed store and each
+ sync returns just the content that store did not hold yet. The first sync
+ of a query has no watermark, and is bounded by since and max_items instead.
+"""
+
+import collections, threading
+
+from .fwix_geo_api import FwixApi, Range, _json_load, _json_dump, _atomic_write
+
+
+def _types_key(content_types):
+    if isinstance(content_types, basestring):
+        return content_types
+    return ','.join(content_types)
+
+
+class ContentSync(object):
+    """ Polls content queries incrementally using published_at watermarks.
+
+        fx_api - the FwixApi to poll through
+        page_size - items requested per page
+        max_stored - content kept in the store before the least recently
+                     synced is evicted, None for no limit
+        since - the start_date of the first sync of every query, None to
+                fetch all of its content
+        max_items - content fetched by the first sync of every query, None
+                    for no limit
+    """
+
+    def __init__(self,
+                 fx_api,
+                 page_size = FwixApi.kDEFAULT_PAGE_SIZE,
+                 max_stored = None,
+                 since = None,
+                 max_items = None):
+        self.fx_api = fx_api
+        self.page_size = page_size
+        self.max_stored = max_stored
+        self.since = since
+        self.max_items = max_items
+        self.content = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self._watermarks = {}
+        self._stats = {'polls': 0, 'fetched': 0, 'added': 0, 'updated': 0, 'evicted': 0}
+
+    def sync_by_lat_lng(self, latitude, longitude, content_types, search_query = None):
+        """ Returns the content near the point that is new to the store"""
+        key = ('lat_lng', latitude, longitude, _types_key(content_types), search_query)
+        return self._sync(key, lambda range, max_items: self.fx_api.iter_content_by_lat_lng(
+            latitude, longitude, content_types, range, None, search_query, self.page_size, max_items))
+
+    def sync_by_postal_code(self, postal_code, content_types, search_query = None):
+        """ Returns the content near the postal code that is new to the store"""
+        key = ('postal_code', postal_code, _types_key(content_types), search_query)
+        return self._sync(key, lambda range, max_items: self.fx_api.iter_content_by_postal_code(
+            postal_code, content_types, range, None, search_query, self.page_size, max_items))
+
+    def sync_by_location(self, location, content_types, search_query = None):
+        """ Returns the content near the location object that is new to the store"""
+        key = ('location', tuple(sorted(location.url_friendly().items())),
+               _types_key(content_types), search_query)
+        return self._sync(key, lambda range, max_items: self.fx_api.iter_content_by_location(
+            location, content_types, range, None, search_query, self.page_size, max_items))
+
+    def sync_by_place(self, place_uuid, content_types, search_query = None):
+        """ Returns the content of the place that is new to the store"""
+        key = ('place', place_uuid, _types_key(content_types), search_query)
+        return self._sync(key, lambda range, max_items: self.fx_api.iter_content_by_place(
+            place_uuid, content_types, range, None, search_query, self.page_size, max_items))
+
+    def watermarks(self):
+        """ Returns {query key: newest published_at seen}"""
+        with self._lock:
+            return dict((key, watermark) for key, (watermark, _) in self._watermarks.items())
+
+    def save_state(self, path):
+        """ Writes the watermarks to a json file, so a restarted poller resumes
+            where this one stopped"""
+        with self._lock:
+            state = [[list(key), watermark, sorted(uuids)]
+                     for key, (watermark, uuids) in self._watermarks.items()]
+        _atomic_write(path, _json_dump({'watermarks': state}))
+
+    def load_state(self, path):
+        """ Restores watermarks written by save_state"""
+        with open(path) as state_file:
+            state = _json_load(state_file.read())
+        with self._lock:
+            for key, watermark, uuids in state['watermarks']:
+                self._watermarks[_freeze(key)] = (watermark, frozenset(uuids))
+
+    def stats(self):
+        """ Returns poll, fetched, added, updated and evicted counters"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats['stored'] = len(self.content)
+            stats['queries'] = len(self._watermarks)
+        return stats
+
+    def _sync(self, key, fetch):
+        with self._lock:
+            watermark, boundary = self._watermarks.get(key, (None, frozenset()))
+        if watermark is not None:
+            fetched = list(fetch(Range(watermark, None), None))
+        else:
+            range = None
+            if self.since is not None:
+                range = Range(self.since, None)
+            fetched = list(fetch(range, self.max_items))
+        added = []
+        newest, at_newest = watermark, set(boundary)
+        with self._lock:
+            self._stats['polls'] += 1
+            self._stats['fetched'] += len(fetched)
+            for content in fetched:
+                uuid = content['uuid']
+                published_at = content['published_at']
+                if watermark is not None and published_at is not None:
+                    # the range start is inclusive; skip what the last sync already saw
+                    if published_at < watermark or (published_at == watermark and uuid in boundary):
+                        continue
+                if uuid in self.content:
+                    del self.content[uuid]
+                    self._stats['updated'] += 1
+                else:
+                    added.append(content)
+                self.content[uuid] = content
+                if published_at is None:
+                    continue
+                if newest is None or published_at > newest:
+                    newest, at_newest = published_at, set([uuid])
+                elif published_at == newest:
+                    at_newest.add(uuid)
+            self._stats['added'] += len(added)
+            while self.max_stored is not None and len(self.content) > self.max_stored:
+                self.content.popitem(last = False)
+                self._stats['evicted'] += 1
+            self._watermarks[key] = (newest, frozenset(at_newest))
+        return added
+
+
+def _freeze(value):
+    """ Turns the lists of a json-decoded query key back into tuples"""
+    if isinstance(value, list):
+        return tuple(_freeze(item) for item in value)
+    return value
@@ -0,0 +1,142 @@
+"""
+ Client-side flow control for FwixApi.
+
+ TokenBucket caps the request rate for an api key, AdaptiveConcurrency
+ bounds the number of requests in flight and adjusts that bound to the
+ server's health (additive increase, multiplicative decrease on 429/5xx),
+ and RetryPolicy retries idempotent requests with jittered exponential
+ backoff.
+"""
+
+import random, threading, time
+
+kRETRYABLE_STATUSES = (429, 500, 502, 503, 504)
+
+_buckets = {}
+_buckets_lock = threading.Lock()
+
+
+class TokenBucket(object):
+    """ A thread-safe token bucket allowing rate requests per second on
+        average, with bursts of up to burst requests"""
+
+    def __init__(self, rate, burst = None):
+        self.rate = float(rate)
+        self.burst = float(burst or max(1, rate))
+        self._tokens = self.burst
+        self._updated = time.time()
+        self._lock = threading.Lock()
+        self.waited = 0.0
+
+    def acquire(self):
+        """ Takes a token, sleeping until one is available"""
+        while True:
+            with self._lock:
+                now = time.time()
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                delay = (1 - self._tokens) / self.rate
+                self.waited += delay
+            time.sleep(delay)
+
+    @classmethod
+    def for_key(cls, api_key, rate, burst = None):
+        """ Returns the bucket shared by every client in this process using
+            api_key; raises ValueError if it was made with another rate or burst"""
+        with _buckets_lock:
+            bucket = _buckets.get(api_key)
+            if bucket is None:
+                bucket = _buckets[api_key] = cls(rate, burst)
+            elif bucket.rate != float(rate) or bucket.burst != float(burst or max(1, rate)):
+                raise ValueError('api key already limited to %s requests per second (burst %s)' %
+                                 (bucket.rate, bucket.burst))
+            return bucket
+
+
+class AdaptiveConcurrency(object):
+    """ A semaphore whose limit follows AIMD: it grows by one after a full
+        window of successful requests, and halves (down to minimum) when a
+        request reports that the server is overloaded. Requests already in
+        flight when the limit halves were sent under the old limit, so their
+        overloaded reports do not halve it again."""
+
+    kDEFAULT_INITIAL = 8
+    kDEFAULT_MINIMUM = 1
+    kDEFAULT_MAXIMUM = 64
+
+    def __init__(self,
+                 initial = kDEFAULT_INITIAL,
+                 minimum = kDEFAULT_MINIMUM,
+                 maximum = kDEFAULT_MAXIMUM):
+        self.limit = initial
+        self.minimum = minimum
+        self.maximum = maximum
+        self._in_flight = 0
+        self._successes = 0
+        # releases still to come from requests sent before the last decrease
+        self._cooldown = 0
+        self._condition = threading.Condition()
+
+    def acquire(self):
+        with self._condition:
+            while self._in_flight >= self.limit:
+                self._condition.wait()
+            self._in_flight += 1
+
+    def release(self, overloaded = False):
+        with self._condition:
+            self._in_flight -= 1
+            cooling = self._cooldown > 0
+            if cooling:
+                self._cooldown -= 1
+            if overloaded:
+                if not cooling:
+                    self.limit = max(self.minimum, self.limit // 2)
+                    self._cooldown = self._in_flight
+                self._successes = 0
+            else:
+                self._successes += 1
+                if self._successes >= self.limit and self.limit < self.maximum:
+                    self.limit += 1
+                    self._successes = 0
+            self._condition.notify_all()
+
+    def stats(self):
+        with self._condition:
+            return {'limit': self.limit, 'in_flight': self._in_flight}
+
+
+class RetryPolicy(object):
+    """ Retries with "full jitter" exponential backoff: the nth retry waits a
+        random time up to min(max_delay, base_delay * 2 ** n), or the
+        server's Retry-After when it sends one. deadline bounds, in seconds,
+        the time a request may take across all its attempts and waits; None
+        for no bound."""
+
+    kDEFAULT_MAX_RETRIES = 3
+    kDEFAULT_BASE_DELAY = 0.1
+    kDEFAULT_MAX_DELAY = 10.0
+
+    def __init__(self,
+                 max_retries = kDEFAULT_MAX_RETRIES,
+                 base_delay = kDEFAULT_BASE_DELAY,
+                 max_delay = kDEFAULT_MAX_DELAY,
+                 statuses = kRETRYABLE_STATUSES,
+                 deadline = None):
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.statuses = statuses
+        self.deadline = deadline
+
+    def should_retry(self, attempt, status):
+        """ status is the HTTP status of the failure, None for a network error"""
+        return attempt < self.max_retries and (status is None or status in self.statuses)
+
+    def delay(self, attempt, retry_after = None):
+        if retry_after is not None:
+            return min(self.max_delay, retry_after)
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
@@ -0,0 +1,416 @@
+"""
+ Keep-alive HTTP transport used by FwixApi.
+
+ Every request made by the client goes through a ConnectionPool, which keeps
+ a small number of persistent HTTP/1.1 connections open per host so that
+ consecutive calls skip the TCP handshake. Responses are requested with
+ gzip/deflate compression and decompressed as they are read. SingleFlight
+ collapses identical requests that are in flight at the same time into one.
+"""
+
+import httplib, socket, select, threading, time, urlparse, zlib
+
+
+class PooledResponse(object):
+    """ Wraps an httplib response and hands its connection back to the pool
+        once the body has been fully read (or discards it when closed early).
+        gzip and deflate bodies are decompressed as they are read."""
+
+    kCHUNK_SIZE = 16 * 1024
+
+    def __init__(self, pool, key, conn, response):
+        self._pool = pool
+        self._key = key
+        self._conn = conn
+        self._response = response
+        self.status = response.status
+        self.reason = response.reason
+        self.reused = False
+        self.dns_time = None
+        self.connect_time = None
+        self.ttfb = None
+        self.bytes_read = 0
+        self.bytes_decoded = 0
+        self._encoding = (response.getheader('content-encoding') or '').strip().lower()
+        self._decoder = None
+        if self._encoding in ('gzip', 'x-gzip'):
+            self._decoder = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        elif self._encoding == 'deflate':
+            self._decoder = zlib.decompressobj()
+
+    def getheader(self, name, default = None):
+        return self._response.getheader(name, default)
+
+    def getheaders(self):
+        return self._response.getheaders()
+
+    def read(self, amt = None):
+        """ Returns up to amt bytes of the decoded body, all of it when amt is None"""
+        if self._decoder is None:
+            data = self._read_raw(amt)
+        elif amt is not None:
+            data = self._read_decoded(amt)
+        else:
+            chunks = []
+            while True:
+                chunk = self._read_decoded(self.kCHUNK_SIZE * 4)
+                if not chunk:
+                    break
+                chunks.append(chunk)
+            data = ''.join(chunks)
+        self.bytes_decoded += len(data)
+        self._pool._count('bytes_decoded', len(data))
+        return data
+
+    def close(self):
+        """ Returns the connection if the body was consumed, otherwise drops it"""
+        if self._response is None:
+            return
+        reusable = self._response.isclosed() and not self._response.will_close
+        self._response.close()
+        self._release(reusable)
+
+    def _read_raw(self, amt = None):
+        if self._response is None:
+            return ''
+        if amt is None:
+            data = self._response.read()
+        else:
+            data = self._response.read(amt)
+        self.bytes_read += len(data)
+        self._pool._count('bytes_received', len(data))
+        if self._response.isclosed():
+            self._release()
+        return data
+
+    def _read_decoded(self, amt):
+        """ Decompresses one chunk at a time, so the compressed and decompressed
+            bodies are never held in full side by side"""
+        decoder = self._decoder
+        while True:
+            if decoder.unconsumed_tail:
+                data = decoder.decompress(decoder.unconsumed_tail, amt)
+            else:
+                raw = self._read_raw(self.kCHUNK_SIZE)
+                if not raw:
+                    return decoder.flush()
+                try:
+                    data = decoder.decompress(raw, amt)
+                except zlib.error:
+                    # some servers send raw deflate streams without the zlib header
+                    if self._encoding != 'deflate' or self.bytes_read != len(raw):
+                        raise
+                    self._decoder = decoder = zlib.decompressobj(-zlib.MAX_WBITS)
+                    data = decoder.decompress(raw, amt)
+            if data:
+                return data
+
+    def _release(self, reusable = None):
+        if self._conn is None:
+            return
+        if reusable is None:
+            reusable = not self._response.will_close
+        self._pool._put(self._key, self._conn, reusable)
+        self._conn = None
+        self._response = None
+
+
+def _resolve_and_connect(conn, address, timeout, source_address):
+    """ socket.create_connection with the DNS lookup timed separately"""
+    start = time.time()
+    host, port = address
+    addresses = socket.getaddrinfo(host, port, 0, socket.SOCK_STREAM)
+    conn.dns_time = time.time() - start
+    error = socket.error('getaddrinfo returned an empty list')
+    for _, _, _, _, sockaddr in addresses:
+        try:
+            return socket.create_connection(sockaddr[:2], timeout, source_address)
+        except socket.error, e:
+            error = e
+    raise error
+
+
+class _TimedHTTPConnection(httplib.HTTPConnection):
+    """ Records how long the last connect() spent resolving and connecting"""
+
+    dns_time = 0.0
+    connect_time = 0.0
+
+    def __init__(self, *args, **kwargs):
+        httplib.HTTPConnection.__init__(self, *args, **kwargs)
+        self._create_connection = lambda *args: _resolve_and_connect(self, *args)
+
+    def connect(self):
+        start = time.time()
+        httplib.HTTPConnection.connect(self)
+        self.connect_time = time.time() - start - self.dns_time
+
+
+class _TimedHTTPSConnection(httplib.HTTPSConnection):
+    """ Like _TimedHTTPConnection; connect_time includes the TLS handshake"""
+
+    dns_time = 0.0
+    connect_time = 0.0
+
+    def __init__(self, *args, **kwargs):
+        httplib.HTTPSConnection.__init__(self, *args, **kwargs)
+        self._create_connection = lambda *args: _resolve_and_connect(self, *args)
+
+    def connect(self):
+        start = time.time()
+        httplib.HTTPSConnection.connect(self)
+        self.connect_time = time.time() - start - self.dns_time
+
+
+def _set_timeout(conn, timeout):
+    conn.timeout = timeout
+    if conn.sock is not None:
+        conn.sock.settimeout(timeout)
+
+
+class Cancellation(object):
+    """ Lets another thread abandon a request that is waiting on the network:
+        cancel() shuts down the connection the request is using, so that it
+        fails at once, and keeps the pool from sending it again"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._conn = None
+        self.cancelled = False
+
+    def attach(self, conn):
+        """ Records the connection a request is about to be sent on"""
+        with self._lock:
+            if self.cancelled:
+                raise socket.error('request cancelled')
+            self._conn = conn
+
+    def cancel(self):
+        with self._lock:
+            self.cancelled = True
+            conn, self._conn = self._conn, None
+        sock = conn and conn.sock
+        if sock is not None:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except socket.error:
+                pass
+
+
+class ConnectionPool(object):
+    """ A thread-safe pool of persistent HTTP connections.
+
+        max_size - the number of idle connections kept open per host. Extra
+                   connections are opened under load and closed when returned.
+        idle_timeout - seconds after which an idle connection is considered
+                       stale and discarded instead of reused
+        timeout - socket timeout, in seconds, for new connections
+        compress - whether to ask for gzip/deflate compressed responses
+    """
+
+    kDEFAULT_MAX_SIZE = 4
+    kDEFAULT_IDLE_TIMEOUT = 30
+    kSTALE_ERRORS = (httplib.BadStatusLine,
+                     httplib.CannotSendRequest,
+                     httplib.ResponseNotReady,
+                     socket.error)
+    # requests that may be sent twice if the server might have received them
+    kIDEMPOTENT_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+    def __init__(self,
+                 max_size = kDEFAULT_MAX_SIZE,
+                 idle_timeout = kDEFAULT_IDLE_TIMEOUT,
+                 timeout = None,
+                 compress = True):
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.timeout = timeout
+        self.compress = compress
+        self._lock = threading.Lock()
+        self._idle = {}
+        self._stats = {'requests': 0,
+                       'created': 0,
+                       'reused': 0,
+                       'stale': 0,
+                       'reconnects': 0,
+                       'discarded': 0,
+                       'bytes_received': 0,
+                       'bytes_decoded': 0}
+
+    def request(self, method, url, body = None, headers = None, timeout = None, cancellation = None):
+        """ Issues a request on a pooled connection, returns a PooledResponse.
+            timeout overrides the pool's socket timeout for this request, and
+            a Cancellation lets another thread abandon it."""
+        scheme, netloc, path, query, _ = urlparse.urlsplit(url)
+        if query:
+            path += '?' + query
+        key = (scheme or 'http', netloc)
+        headers = dict(headers or {})
+        if self.compress:
+            headers.setdefault('Accept-Encoding', 'gzip, deflate')
+        self._count('requests')
+        if timeout is None:
+            timeout = self.timeout
+        conn, reused = self._get(key)
+        _set_timeout(conn, timeout)
+        start = time.time()
+        sent = False
+        try:
+            if cancellation is not None:
+                cancellation.attach(conn)
+            conn.request(method, path, body, headers)
+            sent = True
+            response = conn.getresponse()
+        except socket.timeout:
+            # a slow server, not a stale connection; don't wait on it twice
+            conn.close()
+            raise
+        except self.kSTALE_ERRORS:
+            conn.close()
+            # once the request is written the server may have acted on it
+            if (not reused or (sent and method not in self.kIDEMPOTENT_METHODS) or
+                    (cancellation is not None and cancellation.cancelled)):
+                raise
+            # the server closed a kept-alive socket under us, retry once on a fresh one
+            self._count('reconnects')
+            reused = False
+            conn = self._connect(key)
+            _set_timeout(conn, timeout)
+            start = time.time()
+            if cancellation is not None:
+                cancellation.attach(conn)
+            response = self._send(conn, method, path, body, headers)
+        pooled = PooledResponse(self, key, conn, response)
+        pooled.reused = reused
+        pooled.ttfb = time.time() - start
+        if not reused:
+            pooled.dns_time = conn.dns_time
+            pooled.connect_time = conn.connect_time
+            pooled.ttfb -= conn.dns_time + conn.connect_time
+        return pooled
+
+    def stats(self):
+        """ Returns a dictionary of pool counters and per-host idle connection
+            counts; bytes_received against bytes_decoded shows the compression
+            savings"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats['idle'] = dict(('%s://%s' % key, len(conns))
+                                 for key, conns in self._idle.items())
+        return stats
+
+    def close(self):
+        """ Closes every idle connection"""
+        with self._lock:
+            idle, self._idle = self._idle, {}
+        for conns in idle.values():
+            for conn, _ in conns:
+                conn.close()
+
+    def _send(self, conn, method, path, body, headers):
+        conn.request(method, path, body, headers)
+        return conn.getresponse()
+
+    def _get(self, key):
+        """ Returns a healthy idle connection for the host, or a new one"""
+        while True:
+            with self._lock:
+                conns = self._idle.get(key)
+                if not conns:
+                    break
+                conn, last_used = conns.pop()
+            if self._is_healthy(conn, last_used):
+                self._count('reused')
+                return conn, True
+            self._count('stale')
+            conn.close()
+        return self._connect(key), False
+
+    def _put(self, key, conn, reusable):
+        if reusable and conn.sock is not None:
+            with self._lock:
+                conns = self._idle.setdefault(key, [])
+                if len(conns) < self.max_size:
+                    conns.append((conn, time.time()))
+                    return
+        self._count('discarded')
+        conn.close()
+
+    def _connect(self, key):
+        scheme, netloc = key
+        if scheme == 'https':
+            conn = _TimedHTTPSConnection(netloc, timeout = self.timeout)
+        else:
+            conn = _TimedHTTPConnection(netloc, timeout = self.timeout)
+        self._count('created')
+        return conn
+
+    def _is_healthy(self, conn, last_used):
+        """ An idle connection is healthy if it is recent and the server has not
+            closed it (a closed socket polls as readable)"""
+        if conn.sock is None or time.time() - last_used > self.idle_timeout:
+            return False
+        try:
+            # select cannot watch descriptors past FD_SETSIZE, poll can
+            if hasattr(select, 'poll'):
+                poller = select.poll()
+                poller.register(conn.sock, select.POLLIN | select.POLLPRI | select.POLLERR | select.POLLHUP)
+                readable = poller.poll(0)
+            else:
+                readable, _, _ = select.select([conn.sock], [], [], 0)
+        except (select.error, socket.error, ValueError):
+            return False
+        return not readable
+
+    def _count(self, name, amount = 1):
+        with self._lock:
+            self._stats[name] += amount
+
+
+class _Call(object):
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight(object):
+    """ Coalesces concurrent calls with the same key: the first caller runs the
+        function, and callers arriving while it is in flight wait for and
+        share its result (or its exception)."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self._stats = {'calls': 0, 'coalesced': 0}
+
+    def do(self, key, function):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                self._stats['calls'] += 1
+            else:
+                self._stats['coalesced'] += 1
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+        try:
+            call.result = function()
+            return call.result
+        except Exception, e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+    def stats(self):
+        """ Returns the number of calls made and of calls that shared one"""
+        with self._lock:
+            return dict(self._stats)
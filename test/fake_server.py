@@ -0,0 +1,152 @@
+"""
+ A local stand-in for geoapi.fwix.com used by the offline tests.
+"""
+
+import BaseHTTPServer, SocketServer, threading, time, urlparse, json, gzip, cStringIO, hashlib
+
+kLOCATION = {'country': 'US', 'province': 'CA', 'city': 'San Francisco', 'postal_code': '94103'}
+kCATEGORY = {'category_id': 1, 'name': 'Restaurants'}
+
+
+def make_place(index, lat = 37.7874, lng = -122.3992):
+    place = {'uuid': 'place-%d' % index,
+             'name': 'Place %d' % index,
+             'phone_number': '555-%04d' % index,
+             'link': 'http://fwix.com/place/%d' % index,
+             'lat': lat,
+             'lng': lng,
+             'categories': [kCATEGORY]}
+    place.update(kLOCATION)
+    return place
+
+
+def make_content(index, published_at = None):
+    return {'uuid': 'content-%d' % index,
+            'title': 'Story %d' % index,
+            'body': 'Body of story %d' % index,
+            'link': 'http://fwix.com/story/%d' % index,
+            'published_at': published_at or '2011-01-01 00:00:%02d' % (index % 60),
+            'source': 'fwix',
+            'author': 'fwix',
+            'image': None,
+            'lat': 37.7874,
+            'lng': -122.3992}
+
+
+def gzip_bytes(data):
+    buf = cStringIO.StringIO()
+    with gzip.GzipFile(fileobj = buf, mode = 'wb') as f:
+        f.write(data)
+    return buf.getvalue()
+
+
+class FakeFwixHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # send headers and body in one segment, otherwise Nagle and delayed acks
+    # add ~40ms to every keep-alive response
+    wbufsize = -1
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        self._respond()
+
+    def do_POST(self):
+        length = int(self.headers.getheader('Content-Length') or 0)
+        self.rfile.read(length)
+        self._respond()
+
+    def do_DELETE(self):
+        self._respond()
+
+    def _respond(self):
+        path, _, query = self.path.partition('?')
+        params = dict(urlparse.parse_qsl(query))
+        self.server.requests.append((self.command, path, params))
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        if self.server.failures:
+            status, payload = self.server.failures.pop(0), {'message': 'overloaded'}
+        else:
+            status, payload = self.server.route(self.command, path, params)
+        body = json.dumps(payload)
+        etag = None
+        if self.command == 'GET' and status == 200:
+            etag = '"%s"' % hashlib.md5(body).hexdigest()
+            if self.headers.getheader('If-None-Match') == etag:
+                status, body = 304, ''
+        encoding = None
+        if body and self.server.compress and 'gzip' in (self.headers.getheader('Accept-Encoding') or ''):
+            encoding, body = 'gzip', gzip_bytes(body)
+        self.send_response(status)
+        if status == 429:
+            self.send_header('Retry-After', '0')
+        self.send_header('Content-Type', 'application/json')
+        if encoding:
+            self.send_header('Content-Encoding', encoding)
+        if etag:
+            self.send_header('ETag', etag)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class FakeFwixServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    """ Serves canned places, content, location and category payloads.
+        Override route(command, path, params) for custom responses, or queue
+        error statuses in failures to answer the next requests with. Bodies
+        are gzipped for clients that accept it unless compress is False, and
+        GETs carry an ETag that If-None-Match is checked against."""
+
+    daemon_threads = True
+    request_queue_size = 128
+
+    def __init__(self, places = 3, content = 3):
+        BaseHTTPServer.HTTPServer.__init__(self, ('127.0.0.1', 0), FakeFwixHandler)
+        self.places = [make_place(i) for i in range(places)]
+        self.content = [make_content(i) for i in range(content)]
+        self.requests = []
+        self.latency = 0
+        self.failures = []
+        self.compress = True
+        self.base_url = 'http://127.0.0.1:%d' % self.server_port
+
+    def handle_error(self, request, client_address):
+        pass
+
+    def route(self, command, path, params):
+        if command == 'DELETE' or command == 'POST':
+            return 200, {'success': 1}
+        if path == '/categories.json':
+            return 200, {'categories': [dict(kCATEGORY, categories = [
+                {'category_id': 2, 'name': 'Pizza', 'parent_id': 1}])]}
+        if path == '/location.json':
+            return 200, kLOCATION
+        if path == '/places.json':
+            return 200, {'places': self.paginate(self.places, params)}
+        if path.startswith('/places/'):
+            return 200, {'place': make_place(0)}
+        if path == '/content.json':
+            content = [item for item in self.content
+                       if item['published_at'] >= params.get('start_date', '')]
+            return 200, {'news': self.paginate(content, params)}
+        return 404, {'message': 'not found'}
+
+    def paginate(self, items, params):
+        if 'page' not in params:
+            return items
+        page_size = int(params['page_size'])
+        start = (int(params['page']) - 1) * page_size
+        return items[start:start + page_size]
+
+    def start(self):
+        thread = threading.Thread(target = self.serve_forever)
+        thread.daemon = True
+        thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
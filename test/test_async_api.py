@@ -0,0 +1,93 @@
+import unittest
+import threading
+import BaseHTTPServer
+
+import sys
+sys.path.append('..')
+from fwix_geo_api.fwix_geo_api import *
+from fwix_geo_api.async_api import *
+from fake_server import FakeFwixServer
+
+
+class ProxyErrorHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        body = '<html><body>502 Bad Gateway</body></html>'
+        self.send_response(502)
+        self.send_header('Content-Type', 'text/html')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class TestAsyncFwixApi(unittest.TestCase):
+
+    def setUp(self):
+        self.server = FakeFwixServer().start()
+        self.fx_api = AsyncFwixApi('key', max_concurrency = 2)
+        self.fx_api._api.kBASE_URL = self.server.base_url
+
+    def tearDown(self):
+        self.fx_api.close()
+        self.server.stop()
+
+    def test_get_location(self):
+        location = self.fx_api.get_location(37.78, -122.39).result(5)
+        self.assertTrue(isinstance(location, Location))
+        self.assertEqual(location['city'], 'San Francisco')
+
+    def test_concurrent_places(self):
+        futures = [self.fx_api.get_places_by_lat_lng(37.78, -122.39) for i in range(6)]
+        for future in futures:
+            places = future.result(5)
+            self.assertEqual(len(places), 3)
+            self.assertTrue(isinstance(places[0], Place))
+
+    def test_identical_gets_are_coalesced(self):
+        self.server.latency = 0.1
+        futures = [self.fx_api.get_place('place-0') for i in range(4)]
+        places = [future.result(5) for future in futures]
+        self.assertEqual(len(self.server.requests), 1)
+        self.assertFalse(places[0] is places[1])
+
+    def test_content_and_delete(self):
+        content = self.fx_api.get_content_by_place('place-0', kCONTENT_TYPE_NEWS).result(5)
+        self.assertTrue(isinstance(content[0], News))
+        self.assertTrue(self.fx_api.delete_place('place-0').result(5))
+
+    def test_host_names_are_resolved(self):
+        self.fx_api._api.kBASE_URL = self.server.base_url.replace('127.0.0.1', 'localhost')
+        self.assertEqual(self.fx_api.get_location(37.78, -122.39).result(5)['city'], 'San Francisco')
+        self.assertEqual(self.fx_api._transport._addresses.keys(), [('localhost', self.server.server_port)])
+
+    def test_slow_requests_time_out_and_free_their_slot(self):
+        fx_api = AsyncFwixApi('key', max_concurrency = 1, timeout = 0.2)
+        fx_api._api.kBASE_URL = self.server.base_url
+        self.server.latency = 1
+        error = fx_api.get_location(37.78, -122.39).exception(5)
+        self.assertTrue(isinstance(error, FwixApiError))
+        self.server.latency = 0
+        self.assertEqual(fx_api.get_categories().result(5)[0]['name'], 'Restaurants')
+        fx_api.close()
+
+    def test_errors_are_delivered_through_the_future(self):
+        self.fx_api._api.kBASE_URL = self.server.base_url + '/missing'
+        self.assertTrue(isinstance(self.fx_api.get_categories().exception(5), FwixApiError))
+
+    def test_non_json_error_pages_raise_fwix_api_errors(self):
+        server = BaseHTTPServer.HTTPServer(('127.0.0.1', 0), ProxyErrorHandler)
+        thread = threading.Thread(target = server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.fx_api._api.kBASE_URL = 'http://127.0.0.1:%d' % server.server_port
+        error = self.fx_api.get_categories().exception(5)
+        server.shutdown()
+        server.server_close()
+        self.assertTrue(isinstance(error, FwixApiError))
+        self.assertEqual(error.status, 502)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,67 @@
+import unittest
+
+import sys
+sys.path.append('..')
+from fwix_geo_api.fwix_geo_api import *
+from fwix_geo_api.batch import *
+from fake_server import FakeFwixServer
+
+
+class TestPlaceWriteBatcher(unittest.TestCase):
+
+    def setUp(self):
+        self.server = FakeFwixServer().start()
+        self.fx_api = FwixApi('key')
+        self.fx_api.kBASE_URL = self.server.base_url
+        self.batcher = PlaceWriteBatcher(self.fx_api, max_workers = 1)
+
+    def tearDown(self):
+        self.fx_api.close()
+        self.server.stop()
+
+    def test_updates_are_merged_and_superseded_by_deletes(self):
+        self.batcher.update_place('a', name = 'First', city = 'Oakland')
+        self.batcher.update_place('a', name = 'Second')
+        self.batcher.update_place('b', phone_number = '555-0100')
+        self.batcher.delete_place('b')
+        self.assertRaises(FwixApiError, self.batcher.update_place, 'b', name = 'Gone')
+        self.assertEqual(len(self.batcher), 2)
+        results = self.batcher.flush()
+        self.assertEqual(list(results), ['a', 'b'])
+        self.assertEqual([(r.action, r.mutations, r.ok) for r in results.values()],
+                         [('update', 2, True), ('delete', 2, True)])
+        requests = sorted(self.server.requests)
+        self.assertEqual(requests[0][:2], ('DELETE', '/places/b.json'))
+        self.assertEqual(requests[1][:2], ('POST', '/places/a.json'))
+        self.assertEqual(self.batcher.stats()['merged'], 1)
+        self.assertEqual(self.batcher.stats()['superseded'], 1)
+        self.assertEqual(self.batcher.stats()['queued'], 4)
+
+    def test_coordinate_spellings_are_merged(self):
+        place = self.fx_api.get_place('a')
+        self.batcher.update_place(place['uuid'], latitude = 1.5, longitude = 2.5)
+        self.batcher.update_place_given_place(place)
+        params = self.batcher._pending[place['uuid']].params
+        self.assertEqual((params['lat'], params['lng']), (place['latitude'], place['longitude']))
+        self.assertFalse('latitude' in params or 'longitude' in params)
+
+    def test_failures_are_reported_per_uuid(self):
+        self.server.failures = [500]
+        with self.batcher:
+            self.batcher.delete_place('a')
+            self.batcher.delete_place('b')
+        self.assertEqual(len(self.server.requests), 2)
+        results = self.batcher.flush()
+        self.assertEqual([(r.ok, r.error and r.error.status) for r in results.values()], [(False, 500), (True, None)])
+        self.assertEqual(self.batcher.stats()['failed'], 1)
+
+    def test_auto_flush(self):
+        batcher = PlaceWriteBatcher(self.fx_api, auto_flush = 2)
+        batcher.update_place('a', name = 'A')
+        batcher.update_place('b', name = 'B')
+        self.assertEqual(len(batcher), 0)
+        self.assertEqual(len(self.server.requests), 2)
+        self.assertEqual(sorted(batcher.flush()), ['a', 'b'])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,156 @@
+import unittest
+import os, shutil, tempfile, time
+
+import sys
+sys.path.append('..')
+from fwix_geo_api.fwix_geo_api import *
+from fwix_geo_api.cache import *
+from fwix_geo_api.geo import geohash_encode, geohash_decode
+from fake_server import FakeFwixServer
+
+kBASE_URL = 'http://geoapi.fwix.com'
+
+
+class TestResponseCache(unittest.TestCase):
+
+    def test_key_ignores_api_key_and_param_order(self):
+        cache = ResponseCache()
+        self.assertEqual(cache.key(kBASE_URL + '/places.json', {'lat': 1, 'lng': 2, 'api_key': 'a'}),
+                         cache.key(kBASE_URL + '/places.json', {'lng': 2, 'lat': 1, 'api_key': 'b'}))
+
+    def test_least_recently_used_is_evicted(self):
+        cache = ResponseCache(max_entries = 2)
+        keys = [cache.key(kBASE_URL + '/places/%d.json' % i) for i in range(3)]
+        cache.set(keys[0], 0)
+        cache.set(keys[1], 1)
+        cache.get(keys[0])
+        cache.set(keys[2], 2)
+        self.assertEqual(cache.get(keys[1]), None)
+        self.assertEqual(cache.get(keys[0]), 0)
+        self.assertEqual(cache.stats()['evictions'], 1)
+
+    def test_per_endpoint_ttl(self):
+        cache = ResponseCache(ttls = {'/content.json': 0, '/places/': -1})
+        content_key = cache.key(kBASE_URL + '/content.json')
+        cache.set(content_key, 'content')
+        self.assertEqual(cache.get(content_key), None)
+        self.assertEqual(cache.ttl(cache.key(kBASE_URL + '/categories.json')), 24 * 60 * 60)
+
+    def test_expired_responses_are_kept_for_stale_reads(self):
+        cache = ResponseCache(ttls = {'/location.json': 0.01}, max_stale = 60)
+        key = cache.key(kBASE_URL + '/location.json')
+        cache.set(key, 'location')
+        time.sleep(0.02)
+        self.assertEqual(cache.get(key), None)
+        self.assertEqual(cache.get_stale(key), 'location')
+        self.assertEqual(ResponseCache().get_stale(key), None)
+
+
+class TestSQLiteCache(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'cache.db')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_entries_are_shared_between_instances(self):
+        writer = SQLiteCache(self.path)
+        reader = SQLiteCache(self.path, compress = False)
+        key = writer.key(kBASE_URL + '/places/a.json')
+        writer.set(key, {'place': {'name': u'caf\xe9'}})
+        self.assertEqual(reader.get(key), {'place': {'name': u'caf\xe9'}})
+        reader.invalidate(kBASE_URL + '/places/a.json')
+        self.assertEqual(writer.get(key), None)
+        self.assertEqual(reader.stats()['invalidations'], 1)
+
+    def test_least_recently_used_is_evicted(self):
+        cache = SQLiteCache(self.path, max_entries = 2)
+        keys = [cache.key(kBASE_URL + '/places/%d.json' % i) for i in range(3)]
+        for index, key in enumerate(keys):
+            cache.set(key, index)
+        cache.evict()
+        self.assertEqual(cache.get(keys[0]), None)
+        self.assertEqual(cache.get(keys[2]), 2)
+        self.assertEqual(cache.stats()['size'], 2)
+
+    def test_expired_responses_are_kept_for_stale_reads(self):
+        cache = SQLiteCache(self.path, ttls = {'/location.json': 0.01}, max_stale = 60)
+        key = cache.key(kBASE_URL + '/location.json')
+        cache.set(key, 'location')
+        time.sleep(0.02)
+        self.assertEqual(cache.get(key), None)
+        cache.evict()
+        self.assertEqual(cache.get_stale(key), 'location')
+        self.assertEqual(cache.stats()['stale_hits'], 1)
+        self.assertEqual(SQLiteCache(self.path).get_stale(key), None)
+
+
+class TestLocationCache(unittest.TestCase):
+
+    def test_nearby_points_share_a_cell(self):
+        cache = LocationCache(precision = 7)
+        cache.set(37.787462, -122.399223, {'city': 'San Francisco'})
+        self.assertEqual(cache.get(37.787470, -122.399230), {'city': 'San Francisco'})
+        self.assertEqual(cache.get(37.9, -122.399223), None)
+
+    def test_agreeing_neighbors_answer_for_a_cell(self):
+        cache = LocationCache(precision = 7, neighbor_agreement = 2)
+        latitude, longitude, lat_error, lng_error = geohash_decode(geohash_encode(37.787462, -122.399223, 7))
+        cache.set(latitude + 2 * lat_error, longitude, {'city': 'San Francisco'})
+        cache.set(latitude - 2 * lat_error, longitude, {'city': 'San Francisco'})
+        self.assertEqual(cache.get(latitude, longitude), {'city': 'San Francisco'})
+        self.assertEqual(cache.get_entry(latitude, longitude).confidence, 0.25)
+        self.assertEqual(cache.stats()['neighbor_hits'], 1)
+
+
+class TestValidatorCache(unittest.TestCase):
+
+    def test_entries_need_validators_and_are_bounded(self):
+        cache = ValidatorCache(max_entries = 1)
+        cache.set('a', None, None, 'value')
+        self.assertEqual(cache.get('a'), None)
+        cache.set('a', '"etag"', 'Sat, 01 Jan 2011 00:00:00 GMT', 'value')
+        self.assertEqual(cache.get('a').request_headers(),
+                         {'If-None-Match': '"etag"', 'If-Modified-Since': 'Sat, 01 Jan 2011 00:00:00 GMT'})
+        cache.set('b', '"etag"', None, 'value')
+        self.assertEqual(cache.get('a'), None)
+        self.assertEqual(cache.stats()['evictions'], 1)
+
+
+class TestFwixApiCaching(unittest.TestCase):
+
+    def setUp(self):
+        self.server = FakeFwixServer().start()
+        self.fx_api = FwixApi('key', cache = ResponseCache())
+        self.fx_api.kBASE_URL = self.server.base_url
+
+    def tearDown(self):
+        self.fx_api.close()
+        self.server.stop()
+
+    def test_repeated_get_is_served_from_cache(self):
+        self.fx_api.get_categories()
+        categories = self.fx_api.get_categories()
+        self.assertEqual(len(categories), 2)
+        self.assertEqual(len(self.server.requests), 1)
+        self.assertEqual(self.fx_api.cache_stats()['hits'], 1)
+
+    def test_location_cache(self):
+        self.fx_api = FwixApi('key', location_cache = LocationCache())
+        self.fx_api.kBASE_URL = self.server.base_url
+        first = self.fx_api.get_location(37.787462, -122.399223)
+        second = self.fx_api.get_location(37.787470, -122.399230)
+        self.assertEqual(first, second)
+        self.assertFalse(first is second)
+        self.assertEqual(len(self.server.requests), 1)
+
+    def test_delete_invalidates_place(self):
+        self.fx_api.get_place('place-0')
+        self.fx_api.delete_place('place-0')
+        self.fx_api.get_place('place-0')
+        self.assertEqual([command for command, _, _ in self.server.requests], ['GET', 'DELETE', 'GET'])
+
+if __name__ == '__main__':
+    unittest.main()
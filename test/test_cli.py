@@ -0,0 +1,114 @@
+import csv, json, multiprocessing, os, shutil, signal, tempfile, threading, unittest
+
+import sys
+sys.path.append('..')
+from fwix_geo_api.cli import *
+from fake_server import FakeFwixServer
+
+
+class BufferRecordingEnricher(Enricher):
+
+    most_waiting = 0
+
+    def _write_ready(self, waiting, writer):
+        self.most_waiting = max(self.most_waiting, len(waiting))
+        return Enricher._write_ready(self, waiting, writer)
+
+
+class TestEnricher(unittest.TestCase):
+
+    def setUp(self):
+        self.server = FakeFwixServer().start()
+        self.directory = tempfile.mkdtemp()
+        self.input_path = os.path.join(self.directory, 'points.csv')
+        self.output_path = os.path.join(self.directory, 'enriched.csv')
+        with open(self.input_path, 'wb') as f:
+            f.write('id,lat,lng\n')
+            for index in range(10):
+                # pairs of rows round to the same point
+                f.write('%d,%.5f,-122.4\n' % (index, 37.7 + (index // 2) * 0.01 + (index % 2) * 0.00001))
+            f.write('10,,\n')
+
+    def tearDown(self):
+        self.server.stop()
+        shutil.rmtree(self.directory)
+
+    def enricher(self, **kwargs):
+        return Enricher('key', self.input_path, self.output_path, base_url = self.server.base_url,
+                        chunk_size = 2, **kwargs)
+
+    def read_output(self):
+        with open(self.output_path, 'rb') as f:
+            return list(csv.DictReader(f))
+
+    def test_rows_are_enriched_in_order_and_deduplicated(self):
+        stats = self.enricher(processes = 0, places = True).run()
+        rows = self.read_output()
+        self.assertEqual([row['id'] for row in rows], [str(i) for i in range(11)])
+        self.assertEqual(rows[0]['fwix_city'], 'San Francisco')
+        self.assertEqual(rows[0]['fwix_place_count'], '3')
+        self.assertEqual(rows[10]['fwix_error'], 'missing or invalid coordinates')
+        self.assertEqual((stats['rows'], stats['lookups'], stats['deduplicated'], stats['invalid']),
+                         (11, 5, 5, 1))
+        self.assertEqual(len([r for r in self.server.requests if r[1] == '/location.json']), 5)
+        self.assertFalse(os.path.exists(self.output_path + '.checkpoint'))
+
+    def test_interrupted_run_resumes(self):
+        self.enricher(processes = 0).run(limit = 4)
+        self.assertEqual(len(self.read_output()), 4)
+        self.assertTrue(os.path.exists(self.output_path + '.checkpoint'))
+        stats = self.enricher(processes = 2).run(resume = True)
+        self.assertEqual([row['id'] for row in self.read_output()], [str(i) for i in range(11)])
+        self.assertEqual(stats['rows'], 11)
+
+    def test_interrupted_pooled_run_resumes(self):
+        with open(self.input_path, 'wb') as f:
+            f.write('id,lat,lng\n')
+            f.write(''.join('%d,%.2f,-122.4\n' % (index, 37.0 + index * 0.01) for index in range(100)))
+        self.server.latency = 0.05
+        def interrupt():
+            # as Ctrl-C does, signal the pool processes along with this one
+            for child in multiprocessing.active_children():
+                os.kill(child.pid, signal.SIGINT)
+            os.kill(os.getpid(), signal.SIGINT)
+        timer = threading.Timer(0.5, interrupt)
+        timer.start()
+        self.assertRaises(KeyboardInterrupt, self.enricher(processes = 2).run)
+        timer.join()
+        self.assertTrue(os.path.exists(self.output_path + '.checkpoint'))
+        self.server.latency = 0
+        stats = self.enricher(processes = 2).run(resume = True)
+        self.assertEqual([row['id'] for row in self.read_output()], [str(i) for i in range(100)])
+        self.assertEqual(stats['rows'], 100)
+
+    def test_ndjson(self):
+        self.input_path = os.path.join(self.directory, 'points.ndjson')
+        self.output_path = os.path.join(self.directory, 'enriched.ndjson')
+        with open(self.input_path, 'wb') as f:
+            f.write('{"id": 1, "lat": 37.7, "lng": -122.4}\n{"id": 2}\n')
+        self.enricher(processes = 0).run()
+        with open(self.output_path) as f:
+            rows = [json.loads(line) for line in f]
+        self.assertEqual(rows[0]['fwix']['location']['country'], 'US')
+        self.assertTrue(rows[1]['fwix']['error'])
+
+    def test_duplicated_points_are_not_buffered(self):
+        with open(self.input_path, 'wb') as f:
+            f.write('id,lat,lng\n')
+            f.write(''.join('%d,37.7,-122.4\n' % index for index in range(200)))
+        enricher = BufferRecordingEnricher('key', self.input_path, self.output_path, processes = 0,
+                                           base_url = self.server.base_url, max_waiting = 10)
+        self.assertEqual(enricher.run()['rows'], 200)
+        self.assertEqual(enricher.most_waiting, 10)
+
+    def test_empty_input(self):
+        for name, content in (('empty.csv', 'id,lat,lng\n'), ('empty.ndjson', '')):
+            self.input_path = os.path.join(self.directory, name)
+            with open(self.input_path, 'wb') as f:
+                f.write(content)
+            self.assertEqual(self.enricher(processes = 0).run()['rows'], 0)
+            self.assertFalse(os.path.exists(self.output_path + '.checkpoint'))
+        self.assertEqual(self.server.requests, [])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,67 @@
+import unittest
+
+import sys
+sys.path.append('..')
+from fwix_geo_api.fwix_geo_api import *
+from fwix_geo_api.frames import *
+
+
+def make_place(uuid, latitude, longitude, *category_ids):
+    return Place(uuid, uuid, latitude, longitude, None, Location('US'), None,
+                 [Category(category_id, 'Category %d' % category_id) for category_id in category_ids])
+
+
+def make_news(uuid, published_at):
+    return News(type = kCONTENT_TYPE_NEWS, uuid = uuid, latitude = 37.78, longitude = -122.39,
+                title = None, body = None, author = None, published_at = published_at,
+                link = None, source = None, image = None)
+
+
+@unittest.skipIf(numpy is None, 'NumPy is not installed')
+class TestPlaceFrame(unittest.TestCase):
+
+    def setUp(self):
+        self.places = [make_place('sf', 37.7749, -122.4194, 1),
+                       make_place('la', 34.0522, -118.2437, 2, 3),
+                       make_place('oakland', 37.8044, -122.2712, 3, 1),
+                       make_place('reno', 39.5296, -119.8138)]
+        self.frame = PlaceFrame(self.places)
+
+    def test_distances(self):
+        distances = self.frame.distances(37.7749, -122.4194)
+        self.assertAlmostEqual(distances[0], 0.0)
+        self.assertAlmostEqual(distances[1], 347.4, 0)
+
+    def test_filters_return_the_original_objects(self):
+        nearby = self.frame.within_radius(37.7749, -122.4194, 20)
+        self.assertEqual(nearby.to_list(), [self.places[0], self.places[2]])
+        self.assertTrue(nearby[1] is self.places[2])
+        self.assertEqual(len(self.frame.within_bbox(33, -119, 35, -118)), 1)
+
+    def test_every_category_is_matched(self):
+        self.assertEqual(list(self.frame.with_category([1]).uuids), ['sf', 'oakland'])
+        self.assertEqual(list(self.frame.with_category([3, 4]).uuids), ['la', 'oakland'])
+        self.assertEqual(len(self.frame.with_category([4])), 0)
+        # the packed categories follow the rows of derived frames
+        ordered = self.frame.sort_by_distance(34.0, -118.0)
+        self.assertEqual(list(ordered.with_category([1]).uuids), ['oakland', 'sf'])
+        self.assertEqual(list(ordered[1:].with_category([2, 3]).uuids), ['oakland'])
+
+    def test_sort_by_distance(self):
+        ordered = self.frame.sort_by_distance(34.0, -118.0)
+        self.assertEqual(list(ordered.uuids), ['la', 'oakland', 'sf', 'reno'])
+
+
+@unittest.skipIf(numpy is None, 'NumPy is not installed')
+class TestContentFrame(unittest.TestCase):
+
+    def test_sort_by_published(self):
+        frame = ContentFrame([make_news('a', '2011-01-02 10:00:00'),
+                              make_news('b', None),
+                              make_news('c', '2011-01-03 09:00:00')])
+        self.assertEqual(list(frame.sort_by_published().uuids), ['c', 'a', 'b'])
+        self.assertEqual(list(frame.sort_by_published(False).uuids), ['a', 'c', 'b'])
+        self.assertEqual(list(frame.published_between('2011-01-02', '2011-01-03').uuids), ['a'])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,8 +1,14 @@
 import unittest
+import os, tempfile, copy, pickle, random, socket, threading, time
 
 import sys
 sys.path.append('..')
 from fwix_geo_api.fwix_geo_api import *
+from fwix_geo_api.fwix_geo_api import _json_load
+from fwix_geo_api.throttle import RetryPolicy, AdaptiveConcurrency
+from fwix_geo_api.stats import StatsRegistry
+from fwix_geo_api.cache import ResponseCache, ValidatorCache
+from fake_server import FakeFwixServer, make_content
 
 kFWIX_API_KEY = '' # your api key
 kFWIX_LAT = 37.787462
@@ -60,5 +66,370 @@ class TestFwixSDK(unittest.TestCase):
             if content_type == kCONTENT_TYPE_REAL_ESTATE: continue
             content = self.fx_api.get_content_by_place(kRANDOM_PLACE_UUID,content_type)
 
+
+class TestFwixSDKOffline(unittest.TestCase):
+    """ Exercises the client against a local stand-in server"""
+
+    def setUp(self):
+        self.server = FakeFwixServer().start()
+        self.fx_api = FwixApi(kFWIX_API_KEY)
+        self.fx_api.kBASE_URL = self.server.base_url
+
+    def tearDown(self):
+        self.fx_api.close()
+        self.server.stop()
+
+    def test_concurrent_identical_gets_are_coalesced(self):
+        self.server.latency = 0.2
+        places = []
+        def get_place():
+            places.append(self.fx_api.get_place(kRANDOM_PLACE_UUID))
+        threads = [threading.Thread(target = get_place) for i in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(self.server.requests), 1)
+        self.assertEqual(len(places), 5)
+        self.assertEqual(len(set(id(place) for place in places)), 5)
+        self.assertEqual(self.fx_api.coalesce_stats(), {'calls': 1, 'coalesced': 4})
+
+    def test_overloaded_gets_are_retried(self):
+        self.fx_api = FwixApi(kFWIX_API_KEY, retry = RetryPolicy(base_delay = 0.01),
+                              adaptive_concurrency = True)
+        self.fx_api.kBASE_URL = self.server.base_url
+        self.server.failures = [503, 429]
+        self.assertEqual(self.fx_api.get_location(kFWIX_LAT, kFWIX_LON)['city'], 'San Francisco')
+        self.assertEqual(len(self.server.requests), 3)
+        stats = self.fx_api.throttle_stats()
+        self.assertEqual(stats['retries'], 2)
+        self.assertEqual(stats['limit'], AdaptiveConcurrency.kDEFAULT_INITIAL // 4)
+
+    def test_retries_stop_at_the_deadline(self):
+        self.fx_api = FwixApi(kFWIX_API_KEY, retry = RetryPolicy(max_retries = 10, base_delay = 0.01,
+                                                                 deadline = 0.3))
+        self.fx_api.kBASE_URL = self.server.base_url
+        self.server.latency = 0.1
+        self.server.failures = [503] * 10
+        start = time.time()
+        # the last attempt may time out rather than see its 503
+        self.assertRaises((FwixApiError, socket.timeout), self.fx_api.get_location, kFWIX_LAT, kFWIX_LON)
+        self.assertTrue(time.time() - start < 0.4)
+        self.assertTrue(len(self.server.requests) <= 3)
+        self.server.latency = 0.5
+        self.server.failures = []
+        start = time.time()
+        self.assertRaises(socket.timeout, self.fx_api.get_location, kFWIX_LAT, kFWIX_LON)
+        self.assertTrue(time.time() - start < 0.4)
+
+    def test_retries_are_opt_in(self):
+        self.server.failures = [503]
+        self.assertRaises(FwixApiError, self.fx_api.get_location, kFWIX_LAT, kFWIX_LON)
+        self.assertEqual(len(self.server.requests), 1)
+        self.assertEqual(self.fx_api.throttle_stats(), {'retries': 0})
+
+    def test_posts_are_not_retried(self):
+        self.fx_api = FwixApi(kFWIX_API_KEY, retry = True)
+        self.fx_api.kBASE_URL = self.server.base_url
+        self.server.failures = [503]
+        try:
+            self.fx_api.delete_place(kRANDOM_PLACE_UUID)
+            self.fail('expected FwixApiError')
+        except FwixApiError, e:
+            self.assertEqual(e.status, 503)
+        self.assertEqual(len(self.server.requests), 1)
+
+    def test_calls_are_instrumented(self):
+        calls = []
+        registry = StatsRegistry()
+        registry.add_hook(calls.append)
+        self.fx_api = FwixApi(kFWIX_API_KEY, stats = registry)
+        self.fx_api.kBASE_URL = self.server.base_url
+        self.fx_api.get_places_by_lat_lng(kFWIX_LAT, kFWIX_LON)
+        self.fx_api.get_place(kRANDOM_PLACE_UUID)
+        self.assertEqual([call.endpoint for call in calls], ['/places.json', '/places/{uuid}.json'])
+        call = calls[0]
+        self.assertEqual((call.status, call.items, call.reused), (200, 3, False))
+        self.assertTrue(call.bytes > 0)
+        for phase in ('build', 'dns', 'connect', 'ttfb', 'network', 'decode', 'parse'):
+            self.assertTrue(0 <= getattr(call, phase) <= call.total, phase)
+        self.assertTrue(calls[1].reused)
+        self.assertEqual(calls[1].connect, None)
+        self.assertEqual(self.fx_api.call_stats()['/places.json']['total']['count'], 1)
+
+    def test_slow_gets_are_hedged(self):
+        self.fx_api = FwixApi(kFWIX_API_KEY, hedge = HedgePolicy(min_samples = 1, min_delay = 0.02,
+                                                                 max_ratio = 1.0))
+        self.fx_api.kBASE_URL = self.server.base_url
+        self.fx_api.get_location(kFWIX_LAT, kFWIX_LON)
+        route = self.server.route
+        def slow_first_route(command, path, params):
+            if len(self.server.requests) == 2:
+                time.sleep(0.5)
+            return route(command, path, params)
+        self.server.route = slow_first_route
+        start = time.time()
+        self.assertEqual(self.fx_api.get_location(kFWIX_LAT, kFWIX_LON)['city'], 'San Francisco')
+        self.assertTrue(time.time() - start < 0.4)
+        self.assertEqual(len(self.server.requests), 3)
+        self.assertEqual(self.fx_api.hedge_stats()['hedge_wins'], 1)
+
+    def test_hedges_share_one_worker_thread(self):
+        self.fx_api = FwixApi(kFWIX_API_KEY, hedge = HedgePolicy(min_samples = 1, min_delay = 0.02,
+                                                                 max_ratio = 1.0))
+        self.fx_api.kBASE_URL = self.server.base_url
+        self.fx_api.get_location(kFWIX_LAT, kFWIX_LON)
+        route = self.server.route
+        def slow_primary_route(command, path, params):
+            if len(self.server.requests) % 2 == 0:
+                time.sleep(0.3)
+            return route(command, path, params)
+        self.server.route = slow_primary_route
+        module = sys.modules[FwixApi.__module__]
+        start_thread, started = module._start_thread, []
+        def counting_start_thread(target, *args):
+            started.append(target)
+            return start_thread(target, *args)
+        module._start_thread = counting_start_thread
+        try:
+            start = time.time()
+            for i in range(3):
+                self.assertEqual(self.fx_api.get_location(kFWIX_LAT, kFWIX_LON)['city'], 'San Francisco')
+            self.assertTrue(time.time() - start < 0.6)
+        finally:
+            module._start_thread = start_thread
+        self.assertEqual(len(started), 1)
+        self.assertEqual(self.fx_api.hedge_stats()['hedge_wins'], 3)
+
+    def test_slow_endpoints_time_out(self):
+        self.fx_api = FwixApi(kFWIX_API_KEY, retry = False, timeouts = {'/location.json': 0.1})
+        self.fx_api.kBASE_URL = self.server.base_url
+        self.server.latency = 0.5
+        start = time.time()
+        self.assertRaises(socket.timeout, self.fx_api.get_location, kFWIX_LAT, kFWIX_LON)
+        self.assertTrue(time.time() - start < 0.4)
+
+    def test_open_circuit_fails_fast_or_serves_stale(self):
+        cache = ResponseCache(ttls = {'/location.json': 0.01}, max_stale = 60)
+        breaker = CircuitBreaker(failure_ratio = 0.6, min_calls = 2, reset_timeout = 60)
+        self.fx_api = FwixApi(kFWIX_API_KEY, retry = False, cache = cache, circuit_breaker = breaker)
+        self.fx_api.kBASE_URL = self.server.base_url
+        self.fx_api.get_location(kFWIX_LAT, kFWIX_LON)
+        time.sleep(0.02)
+        self.server.failures = [500, 500]
+        for i in range(2):
+            self.assertRaises(FwixApiError, self.fx_api.get_location, 0, 0)
+        self.assertRaises(CircuitOpenError, self.fx_api.get_location, 0, 0)
+        self.assertEqual(self.fx_api.get_location(kFWIX_LAT, kFWIX_LON)['city'], 'San Francisco')
+        self.assertEqual(len(self.server.requests), 3)
+        stats = self.fx_api.circuit_breaker_stats()
+        self.assertEqual((stats['opened'], stats['rejected'], stats['stale']), (1, 2, 1))
+        self.assertEqual(stats['circuits'], {'/location.json': CircuitBreaker.kOPEN})
+
+    def test_unchanged_resources_are_revalidated(self):
+        self.fx_api = FwixApi(kFWIX_API_KEY, validator_cache = ValidatorCache())
+        self.fx_api.kBASE_URL = self.server.base_url
+        place = self.fx_api.get_place(kRANDOM_PLACE_UUID)
+        categories = self.fx_api.get_categories()
+        self.assertTrue(self.fx_api.get_place(kRANDOM_PLACE_UUID) is place)
+        self.assertTrue(self.fx_api.get_categories() is categories)
+        self.assertEqual([params for _, _, params in self.server.requests], [{}] * 4)
+        self.assertEqual(self.fx_api.validator_cache_stats()['not_modified'], 2)
+        self.server.places[0] = dict(self.server.places[0], name = 'Renamed')
+        self.server.route = lambda command, path, params: (200, {'place': self.server.places[0]})
+        self.assertEqual(self.fx_api.get_place(kRANDOM_PLACE_UUID)['name'], 'Renamed')
+        self.assertEqual(self.fx_api.validator_cache_stats()['modified'], 1)
+
+    def test_revalidation_refreshes_the_response_cache(self):
+        self.fx_api = FwixApi(kFWIX_API_KEY, cache = ResponseCache(ttls = {'/places/': 0.05}),
+                              validator_cache = ValidatorCache())
+        self.fx_api.kBASE_URL = self.server.base_url
+        self.fx_api.get_place(kRANDOM_PLACE_UUID)
+        place = self.fx_api.get_place(kRANDOM_PLACE_UUID)
+        stats = self.fx_api.validator_cache_stats()
+        self.assertEqual((stats['not_modified'], stats['modified']), (0, 0))
+        time.sleep(0.1)
+        self.assertTrue(self.fx_api.get_place(kRANDOM_PLACE_UUID) is place)
+        self.assertEqual(self.fx_api.validator_cache_stats()['not_modified'], 1)
+        self.fx_api.get_place(kRANDOM_PLACE_UUID)
+        self.assertEqual(len(self.server.requests), 2)
+
+    def test_get_places_bulk(self):
+        coordinates = [(kFWIX_LAT + i, kFWIX_LON) for i in range(20)]
+        results = list(self.fx_api.get_places_bulk(coordinates, max_workers = 3))
+        self.assertEqual([coordinate for coordinate, _ in results], coordinates)
+        for _, places in results:
+            self.assertEqual(len(places), 3)
+
+    def test_bulk_failures_are_returned(self):
+        self.fx_api.kBASE_URL = self.server.base_url + '/missing'
+        results = list(self.fx_api.get_places_by_uuid_bulk(['a', 'b'], ordered = False))
+        self.assertEqual(sorted(uuid for uuid, _ in results), ['a', 'b'])
+        for _, error in results:
+            self.assertTrue(isinstance(error, FwixApiError))
+
+    def test_iter_places_by_lat_lng(self):
+        self.server.places = self.server.places * 4
+        places = list(self.fx_api.iter_places_by_lat_lng(kFWIX_LAT, kFWIX_LON, page_size = 5))
+        self.assertEqual(len(places), 12)
+        self.assertEqual([params['page'] for _, _, params in self.server.requests], ['1', '2', '3', '4'])
+
+    def test_iter_content_max_items(self):
+        self.server.content = self.server.content * 4
+        content = list(self.fx_api.iter_content_by_place(kRANDOM_PLACE_UUID, kCONTENT_TYPE_NEWS,
+                                                         page_size = 5, max_items = 7))
+        self.assertEqual(len(content), 7)
+        self.assertEqual(len(self.server.requests), 2)
+
+    def test_generic_iter_content(self):
+        content = list(self.fx_api.generic_iter_content({'place_id': kRANDOM_PLACE_UUID},
+                                                        kCONTENT_TYPE_ALL, None, None, None, None))
+        self.assertEqual([c['uuid'] for c in content], ['content-0', 'content-1', 'content-2'])
+        self.assertTrue(isinstance(content[0], News))
+        self.assertEqual(self.fx_api.pool_stats()['discarded'], 0)
+
+    def test_streamed_content_is_retried_and_checked(self):
+        self.fx_api = FwixApi(kFWIX_API_KEY, retry = RetryPolicy(base_delay = 0.01))
+        self.fx_api.kBASE_URL = self.server.base_url
+        self.server.failures = [503]
+        content = self.fx_api.get_content_by_place(kRANDOM_PLACE_UUID, kCONTENT_TYPE_NEWS, stream = True)
+        self.assertEqual([c['uuid'] for c in content], ['content-0', 'content-1', 'content-2'])
+        self.assertEqual(self.fx_api.throttle_stats()['retries'], 1)
+        self.server.route = lambda command, path, params: (404, {'message': 'not found'})
+        try:
+            list(self.fx_api.iter_content_by_place(kRANDOM_PLACE_UUID, kCONTENT_TYPE_NEWS, stream = True))
+            self.fail('expected FwixApiError')
+        except FwixApiError, e:
+            self.assertEqual(e.status, 404)
+
+    def test_content_types_are_fanned_out_and_merged(self):
+        stories = {kCONTENT_TYPE_NEWS: [make_content(i, '2011-01-01 00:00:0%d' % i) for i in (1, 4, 2)],
+                   kCONTENT_TYPE_PHOTOS: [make_content(i, '2011-01-01 00:00:0%d' % i) for i in (3, 5)]}
+        def route(command, path, params):
+            content_type = params['content_types']
+            return 200, {content_type: stories[content_type]}
+        self.server.route = route
+        content = self.fx_api.get_content_by_place(kRANDOM_PLACE_UUID,
+                                                   [kCONTENT_TYPE_NEWS, kCONTENT_TYPE_PHOTOS],
+                                                   fan_out = True)
+        self.assertEqual([c['uuid'] for c in content],
+                         ['content-5', 'content-4', 'content-3', 'content-2', 'content-1'])
+        self.assertTrue(isinstance(content[0], Photo))
+        self.assertEqual(sorted(params['content_types'] for _, _, params in self.server.requests),
+                         [kCONTENT_TYPE_NEWS, kCONTENT_TYPE_PHOTOS])
+        nearest = self.fx_api.generic_iter_content_fan_out({'place_id': kRANDOM_PLACE_UUID},
+                                                           'news,photos', merge_by = (0, 0),
+                                                           max_items = 2)
+        self.assertEqual(len(list(nearest)), 2)
+        # every fan out runs on the client's one pool of threads
+        pool = self.fx_api._fan_out_pool
+        self.fx_api.get_content_by_place(kRANDOM_PLACE_UUID, 'news,photos', fan_out = True)
+        self.assertTrue(self.fx_api._fan_out_pool is pool)
+        streamed = []
+        iter_content = self.fx_api.generic_iter_content
+        def counting_iter_content(*args):
+            streamed.append(args)
+            return iter_content(*args)
+        self.fx_api.generic_iter_content = counting_iter_content
+        self.fx_api.get_content_by_place(kRANDOM_PLACE_UUID, 'news,photos', fan_out = True)
+        self.assertEqual(streamed, [])
+        self.fx_api.get_content_by_place(kRANDOM_PLACE_UUID, 'news,photos', fan_out = True, stream = True)
+        self.assertEqual(len(streamed), 2)
+        for content_types in ([], ''):
+            self.assertRaises(FwixApiError, list,
+                              self.fx_api.generic_iter_content_fan_out({}, content_types))
+        self.fx_api.get_content_by_place(kRANDOM_PLACE_UUID, u'news')
+        self.assertEqual(self.server.requests[-1][2]['content_types'], 'news')
+
+    def test_category_tree_snapshot(self):
+        path = os.path.join(tempfile.mkdtemp(), 'categories.json')
+        self.fx_api.get_category_tree(path)
+        self.assertEqual(self.fx_api.get_category_tree(path).get(2)['name'], 'Pizza')
+        self.assertEqual(len(self.server.requests), 1)
+        os.remove(path)
+
+
+class TestModels(unittest.TestCase):
+
+    def test_fields_are_stored_once(self):
+        location = Location(u'US', city = u'San Francisco')
+        self.assertFalse(hasattr(location, '__dict__'))
+        self.assertEqual(location.city, location['city'])
+        location.city = u'Oakland'
+        self.assertEqual(location['city'], u'Oakland')
+        self.assertRaises(AttributeError, getattr, location, 'missing')
+
+    def test_repeated_strings_are_shared(self):
+        first = Location(u''.join([u'U', u'S']))
+        second = Location(u''.join([u'U', u'S']))
+        self.assertTrue(first.country is second.country)
+
+    def test_copy_and_pickle(self):
+        place = Place('uuid', 'name', 1.0, 2.0, None, Location('US'), None, [Category(1, 'Food')])
+        for clone in (copy.deepcopy(place), pickle.loads(pickle.dumps(place, 2))):
+            self.assertEqual(clone, place)
+            self.assertTrue(isinstance(clone, Place))
+            self.assertEqual(clone.location.country, 'US')
+
+    def test_parsed_models_match_constructed_ones(self):
+        raw_place = {'uuid': 'p', 'name': 'Pizza', 'lat': 1.0, 'lng': 2.0, 'phone_number': None,
+                     'link': None, 'country': 'US', 'city': 'Oakland',
+                     'categories': [{'category_id': 3, 'name': 'Pizza', 'parent_id': 2}]}
+        expected = Place('p', 'Pizza', 1.0, 2.0, None, Location('US', city = 'Oakland'), None,
+                         [Category(3, 'Pizza', 2)])
+        self.assertEqual(Place.from_json(raw_place), expected)
+        raw_content = {'uuid': 'c', 'title': 'Open house', 'lat': 1.0, 'lng': 2.0,
+                       'price': 500000, 'number_of_beds': 2, 'number_of_baths': 1}
+        content = FwixApi('key')._parse_content(raw_content, kCONTENT_TYPE_REAL_ESTATE)
+        self.assertTrue(isinstance(content, RealEstate))
+        self.assertEqual((content.latitude, content.price, content.number_of_baths), (1.0, 500000, 1))
+        self.assertEqual(content.square_feet, None)
+
+    def test_json_backend(self):
+        previous = get_json_backend()
+        try:
+            self.assertEqual(set_json_backend('json'), 'json')
+            self.assertEqual(get_json_backend(), 'json')
+            self.assertRaises(ImportError, set_json_backend, 'no_such_json')
+            self.assertEqual(get_json_backend(), 'json')
+        finally:
+            set_json_backend(previous)
+
+    def test_fast_json_backend_keeps_coordinates_exact(self):
+        previous = get_json_backend()
+        try:
+            set_json_backend('ujson')
+        except ImportError:
+            self.skipTest('ujson is not installed')
+        try:
+            generator = random.Random(0)
+            for i in range(1000):
+                coordinate = repr(generator.uniform(-180, 180))
+                self.assertEqual(repr(_json_load(coordinate)), coordinate)
+        finally:
+            set_json_backend(previous)
+
+
+class TestCategoryTree(unittest.TestCase):
+
+    def setUp(self):
+        self.tree = CategoryTree([Category(1, 'Food'),
+                                  Category(2, 'Restaurants', 1),
+                                  Category(3, 'Pizza', 2),
+                                  Category(4, 'Nightlife')])
+
+    def test_lookups(self):
+        self.assertEqual(self.tree.get(3)['name'], 'Pizza')
+        self.assertEqual(self.tree.get_by_name('pizza'), [self.tree.get(3)])
+        self.assertEqual(self.tree.parent(3), self.tree.get(2))
+        self.assertEqual([c['category_id'] for c in self.tree.ancestors(3)], [2, 1])
+        self.assertEqual(sorted(c['category_id'] for c in self.tree.descendants(1)), [2, 3])
+
+    def test_expand(self):
+        expanded = self.tree.expand([2, {'category_id': 4}, 3])
+        self.assertEqual([c['category_id'] for c in expanded], [2, 3, 4])
+        filters = FwixApi(kFWIX_API_KEY)._place_filters(None, None, expanded)
+        self.assertEqual(filters['categories'], '2,3,4')
+
 if __name__ == '__main__':
     unittest.main()
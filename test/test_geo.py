@@ -0,0 +1,28 @@
+import unittest
+
+import sys
+sys.path.append('..')
+from fwix_geo_api.geo import *
+
+
+class TestGeo(unittest.TestCase):
+
+    def test_geohash_encode(self):
+        self.assertEqual(geohash_encode(57.64911, 10.40744, 11), 'u4pruydqqvj')
+
+    def test_geohash_decode_round_trip(self):
+        latitude, longitude, lat_error, lng_error = geohash_decode(geohash_encode(37.787462, -122.399223))
+        self.assertTrue(abs(latitude - 37.787462) <= lat_error)
+        self.assertTrue(abs(longitude - -122.399223) <= lng_error)
+
+    def test_geohash_neighbors(self):
+        neighbors = geohash_neighbors('9q8yyk')
+        self.assertEqual(len(set(neighbors)), 8)
+        self.assertTrue('9q8yys' in neighbors)
+        self.assertTrue('9q8yyk' not in neighbors)
+
+    def test_haversine_miles(self):
+        self.assertAlmostEqual(haversine_miles(37.7749, -122.4194, 34.0522, -118.2437), 347.4, 0)
+
+if __name__ == '__main__':
+    unittest.main()
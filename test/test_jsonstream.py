@@ -0,0 +1,54 @@
+import unittest
+import json
+from StringIO import StringIO
+
+import sys
+sys.path.append('..')
+from fwix_geo_api.jsonstream import *
+from fwix_geo_api import jsonstream
+
+
+class CountingDecoder(json.JSONDecoder):
+
+    attempts = 0
+
+    def raw_decode(self, s, idx = 0):
+        CountingDecoder.attempts += 1
+        return json.JSONDecoder.raw_decode(self, s, idx)
+
+
+class TestJsonStream(unittest.TestCase):
+
+    def decode(self, document, keys, chunk_size = 3):
+        return list(iter_object_arrays(StringIO(json.dumps(document)), keys, chunk_size))
+
+    def test_elements_are_yielded_in_order(self):
+        document = {'news': [{'uuid': 'a', 'lat': 37.12345}, {'uuid': 'b'}],
+                    'total': 12345,
+                    'photos': [{'uuid': 'c', 'title': u'caf\xe9 [1], {2}'}]}
+        elements = self.decode(document, ('news', 'photos'))
+        self.assertEqual(sorted(elements), sorted([('news', {'uuid': 'a', 'lat': 37.12345}),
+                                                   ('news', {'uuid': 'b'}),
+                                                   ('photos', {'uuid': 'c', 'title': u'caf\xe9 [1], {2}'})]))
+
+    def test_other_members_are_skipped(self):
+        self.assertEqual(self.decode({'news': [], 'events': [{'uuid': 'a'}]}, ('news',)), [])
+        self.assertEqual(self.decode({}, ('news',)), [])
+
+    def test_large_elements_are_not_decoded_once_per_chunk(self):
+        CountingDecoder.attempts = 0
+        decoder, jsonstream.JSONDecoder = jsonstream.JSONDecoder, CountingDecoder
+        try:
+            elements = self.decode({'news': [{'body': 'x' * 100000}]}, ('news',), 16)
+        finally:
+            jsonstream.JSONDecoder = decoder
+        self.assertEqual(len(elements[0][1]['body']), 100000)
+        self.assertTrue(CountingDecoder.attempts < 50, CountingDecoder.attempts)
+
+    def test_truncated_stream_raises(self):
+        stream = iter_object_arrays(StringIO('{"news": [{"uuid": "a"}, {"uu'), ('news',), 4)
+        self.assertEqual(stream.next(), ('news', {'uuid': 'a'}))
+        self.assertRaises(ValueError, stream.next)
+
+if __name__ == '__main__':
+    unittest.main()
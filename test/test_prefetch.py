@@ -0,0 +1,74 @@
+import os, shutil, tempfile, unittest
+
+import sys
+sys.path.append('..')
+from fwix_geo_api.fwix_geo_api import *
+from fwix_geo_api.prefetch import *
+from fwix_geo_api.spatial import SpatialIndex
+from fake_server import FakeFwixServer
+
+
+class TestTiling(unittest.TestCase):
+
+    def test_tiles_are_covered_by_their_circles(self):
+        tiles = tile_bbox(37.7, -122.5, 37.8, -122.4, 1)
+        self.assertTrue(len(tiles) > 1)
+        for tile in tiles:
+            for latitude, longitude in tile.corners():
+                self.assertTrue(haversine_miles(tile.latitude, tile.longitude, latitude, longitude) <= 1)
+
+    def test_polygon(self):
+        triangle = [(37.7, -122.5), (37.7, -122.4), (37.8, -122.5)]
+        self.assertTrue(point_in_polygon(37.71, -122.49, triangle))
+        self.assertFalse(point_in_polygon(37.79, -122.41, triangle))
+        tiles = tile_bbox(37.7, -122.5, 37.8, -122.4, 1)
+        kept = [tile for tile in tiles if tile_intersects_polygon(tile, triangle)]
+        self.assertTrue(0 < len(kept) < len(tiles))
+
+
+class TestAreaPrefetcher(unittest.TestCase):
+
+    def setUp(self):
+        self.server = FakeFwixServer(places = 30).start()
+        self.index = SpatialIndex()
+        self.fx_api = FwixApi('key', spatial_index = self.index)
+        self.fx_api.kBASE_URL = self.server.base_url
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        self.fx_api.close()
+        self.server.stop()
+        shutil.rmtree(self.directory)
+
+    def test_full_tiles_are_subdivided(self):
+        prefetcher = AreaPrefetcher(self.fx_api, radius = 4, page_size = 10, max_pages = 2,
+                                    content_types = [kCONTENT_TYPE_NEWS])
+        stats = prefetcher.prefetch_bbox(37.78, -122.41, 37.79, -122.40)
+        self.assertEqual((stats['tiles'], stats['subdivided'], stats['truncated']), (21, 5, 16))
+        self.assertEqual((stats['places'], stats['content'], stats['pending']), (20, 3, 0))
+
+    def test_complete_tiles_are_marked_covered(self):
+        prefetcher = AreaPrefetcher(self.fx_api, radius = 4, page_size = 50)
+        prefetcher.prefetch_bbox(37.78, -122.41, 37.79, -122.40)
+        self.assertTrue(self.index.is_covered(37.785, -122.405, 1))
+
+    def test_failed_tiles_are_resumed(self):
+        state_path = os.path.join(self.directory, 'prefetch.json')
+        def sink(tile, places, content):
+            if tile.latitude > 37.77:
+                raise IOError('store unavailable')
+        prefetcher = AreaPrefetcher(self.fx_api, radius = 1, page_size = 50, state_path = state_path,
+                                    sink = sink)
+        stats = prefetcher.prefetch_bbox(37.70, -122.41, 37.79, -122.40)
+        self.assertTrue(stats['failed'] > 0)
+        self.assertTrue(os.path.exists(state_path))
+        resumed = AreaPrefetcher(self.fx_api, radius = 1, page_size = 50, state_path = state_path)
+        self.assertRaises(ValueError, resumed.prefetch_bbox, 37.70, -122.41, 37.80, -122.40, resume = True)
+        stats = resumed.prefetch_bbox(37.70, -122.41, 37.79, -122.40, resume = True)
+        self.assertEqual(stats['failed'], 0)
+        self.assertEqual(stats['tiles'], len(tile_bbox(37.70, -122.41, 37.79, -122.40, 1)))
+        self.assertFalse(os.path.exists(state_path))
+
+
+if __name__ == '__main__':
+    unittest.main()
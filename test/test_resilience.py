@@ -0,0 +1,77 @@
+import unittest
+import time
+
+import sys
+sys.path.append('..')
+from fwix_geo_api.resilience import *
+
+
+class TestEndpointTimeouts(unittest.TestCase):
+
+    def test_longest_prefix_wins(self):
+        timeouts = EndpointTimeouts({'/places': 2.0, '/places/': 0.5}, default = 5.0)
+        self.assertEqual(timeouts.timeout('/places.json'), 2.0)
+        self.assertEqual(timeouts.timeout('/places/abc.json'), 0.5)
+        self.assertEqual(timeouts.timeout('/content.json'), 5.0)
+
+
+class TestHedgePolicy(unittest.TestCase):
+
+    def test_delay_follows_the_observed_quantile(self):
+        policy = HedgePolicy(min_samples = 10, min_delay = 0.001)
+        for i in range(9):
+            policy.observe('/places.json', 0.01)
+        self.assertEqual(policy.delay('/places.json'), None)
+        for i in range(91):
+            policy.observe('/places.json', 0.01 if i < 85 else 1.0)
+        self.assertEqual(policy.delay('/places.json'), 1.0)
+        self.assertEqual(policy.delay('/content.json'), None)
+
+    def test_hedges_are_budgeted(self):
+        policy = HedgePolicy(max_ratio = 0.1)
+        for i in range(10):
+            policy.delay('/places.json')
+        self.assertTrue(policy.allow())
+        self.assertFalse(policy.allow())
+        self.assertEqual(policy.stats()['denied'], 1)
+
+
+class TestCircuitBreaker(unittest.TestCase):
+
+    def test_opens_probes_and_closes(self):
+        breaker = CircuitBreaker(failure_ratio = 0.5, min_calls = 4, reset_timeout = 0)
+        for success in (True, False, True):
+            breaker.record('/places.json', success)
+        self.assertEqual(breaker.state('/places.json'), CircuitBreaker.kCLOSED)
+        breaker.record('/places.json', False)
+        self.assertEqual(breaker.state('/places.json'), CircuitBreaker.kOPEN)
+        self.assertEqual(breaker.allow('/places.json'), CircuitBreaker.kPROBE)
+        self.assertFalse(breaker.allow('/places.json'))
+        self.assertTrue(breaker.allow('/content.json'))
+        breaker.record('/places.json', False, CircuitBreaker.kPROBE)
+        self.assertEqual(breaker.state('/places.json'), CircuitBreaker.kOPEN)
+        probe = breaker.allow('/places.json')
+        # a request sent before the circuit opened does not close it
+        breaker.record('/places.json', True)
+        self.assertEqual(breaker.state('/places.json'), CircuitBreaker.kHALF_OPEN)
+        breaker.record('/places.json', True, probe)
+        self.assertEqual(breaker.state('/places.json'), CircuitBreaker.kCLOSED)
+        stats = breaker.stats()
+        self.assertEqual((stats['opened'], stats['rejected']), (2, 1))
+
+    def test_lost_probes_are_replaced(self):
+        breaker = CircuitBreaker(min_calls = 1, reset_timeout = 0, probe_timeout = 0.05)
+        breaker.record('/places.json', False)
+        self.assertEqual(breaker.allow('/places.json'), CircuitBreaker.kPROBE)
+        self.assertFalse(breaker.allow('/places.json'))
+        time.sleep(0.06)
+        self.assertEqual(breaker.allow('/places.json'), CircuitBreaker.kPROBE)
+
+    def test_stays_open_until_reset_timeout(self):
+        breaker = CircuitBreaker(min_calls = 1, reset_timeout = 60)
+        breaker.record('/places.json', False)
+        self.assertFalse(breaker.allow('/places.json'))
+
+
+if __name__ == '__main__':
+    unittest.main()
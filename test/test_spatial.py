@@ -0,0 +1,92 @@
+import unittest
+import time
+
+import sys
+sys.path.append('..')
+from fwix_geo_api.fwix_geo_api import *
+from fwix_geo_api.spatial import *
+from fake_server import FakeFwixServer, make_place
+
+kFWIX_LAT = 37.787462
+kFWIX_LON = -122.399223
+
+
+def make_place_object(uuid, latitude, longitude, category_id = 1):
+    return Place(uuid, uuid, latitude, longitude, None, Location('US'), None,
+                 [Category(category_id, 'Category')])
+
+
+class TestSpatialIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.index = SpatialIndex()
+        self.index.add(make_place_object('near', kFWIX_LAT + 0.01, kFWIX_LON))
+        self.index.add(make_place_object('pizza', kFWIX_LAT, kFWIX_LON + 0.02, 2))
+        self.index.add(make_place_object('far', kFWIX_LAT + 1, kFWIX_LON))
+
+    def test_query(self):
+        self.assertEqual([p['uuid'] for p in self.index.query(kFWIX_LAT, kFWIX_LON, 5)], ['near', 'pizza'])
+        self.assertEqual([p['uuid'] for p in self.index.query(kFWIX_LAT, kFWIX_LON, 5, [{'category_id': 2}])],
+                         ['pizza'])
+
+    def test_coverage(self):
+        self.index.mark_covered(kFWIX_LAT, kFWIX_LON, 5, [{'category_id': 2}])
+        self.assertTrue(self.index.is_covered(kFWIX_LAT + 0.01, kFWIX_LON, 2, [{'category_id': 2}]))
+        self.assertFalse(self.index.is_covered(kFWIX_LAT + 0.01, kFWIX_LON, 2))
+        self.assertFalse(self.index.is_covered(kFWIX_LAT, kFWIX_LON, 6, [{'category_id': 2}]))
+
+    def test_expired_regions_evict_their_places(self):
+        self.index.coverage_ttl = 0.01
+        self.index.mark_covered(kFWIX_LAT, kFWIX_LON, 5)
+        time.sleep(0.02)
+        self.assertFalse(self.index.is_covered(kFWIX_LAT, kFWIX_LON, 1))
+        self.assertEqual(len(self.index), 1)
+        self.assertEqual(self.index.stats()['evicted'], 2)
+
+    def test_invalidated_places_drop_their_coverage(self):
+        self.index.mark_covered(kFWIX_LAT, kFWIX_LON, 5)
+        self.index.mark_covered(kFWIX_LAT + 1, kFWIX_LON, 5)
+        self.index.invalidate('near', kFWIX_LAT + 1, kFWIX_LON)
+        self.assertFalse(self.index.is_covered(kFWIX_LAT, kFWIX_LON, 1))
+        self.assertFalse(self.index.is_covered(kFWIX_LAT + 1, kFWIX_LON, 1))
+        self.assertEqual(len(self.index), 0)
+
+
+class TestFwixApiSpatialIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.server = FakeFwixServer().start()
+        self.server.places = [make_place(0, kFWIX_LAT, kFWIX_LON), make_place(1, kFWIX_LAT + 0.5, kFWIX_LON)]
+        self.fx_api = FwixApi('key', spatial_index = SpatialIndex())
+        self.fx_api.kBASE_URL = self.server.base_url
+
+    def tearDown(self):
+        self.fx_api.close()
+        self.server.stop()
+
+    def test_covered_queries_are_answered_locally(self):
+        self.fx_api.get_places_by_lat_lng(kFWIX_LAT, kFWIX_LON, radius = 50)
+        places = self.fx_api.get_places_by_lat_lng(kFWIX_LAT, kFWIX_LON, radius = 10)
+        self.assertEqual([place['uuid'] for place in places], ['place-0'])
+        self.assertEqual(len(self.server.requests), 1)
+        self.fx_api.get_places_by_lat_lng(kFWIX_LAT + 1, kFWIX_LON, radius = 10)
+        self.assertEqual(self.fx_api.spatial_index_stats()['remote_queries'], 2)
+
+    def test_updated_places_are_fetched_again(self):
+        self.fx_api.get_places_by_lat_lng(kFWIX_LAT, kFWIX_LON, radius = 50)
+        self.fx_api.update_place('place-0', name = 'Renamed')
+        self.fx_api.get_places_by_lat_lng(kFWIX_LAT, kFWIX_LON, radius = 10)
+        self.assertEqual([request[0] for request in self.server.requests], ['GET', 'POST', 'GET'])
+
+    def test_local_answers_are_capped_at_a_page(self):
+        index = self.fx_api._spatial_index
+        for i in range(FwixApi.kDEFAULT_PAGE_SIZE + 5):
+            index.add(make_place_object('local-%d' % i, kFWIX_LAT + i * 0.0001, kFWIX_LON))
+        index.mark_covered(kFWIX_LAT, kFWIX_LON, 10)
+        places = self.fx_api.get_places_by_lat_lng(kFWIX_LAT, kFWIX_LON, radius = 10)
+        self.assertEqual(len(places), FwixApi.kDEFAULT_PAGE_SIZE)
+        self.assertEqual(places[0]['uuid'], 'local-0')
+        self.assertEqual(len(self.server.requests), 0)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,45 @@
+import unittest
+
+import sys
+sys.path.append('..')
+from fwix_geo_api.stats import *
+
+
+class TestStatsRegistry(unittest.TestCase):
+
+    def setUp(self):
+        self.registry = StatsRegistry(buckets = (0.1, 1.0))
+        for total in (0.05, 0.5, 5.0):
+            call = CallStats('/places.json', 'GET')
+            call.status = 200
+            call.total = total
+            call.bytes = 100
+            call.items = 3
+            self.registry.record(call)
+
+    def test_histogram_buckets_are_cumulative(self):
+        histogram = self.registry.histogram('/places.json', 'total')
+        self.assertEqual(histogram.counts, [1, 2])
+        self.assertEqual(histogram.count, 3)
+        self.assertEqual(histogram.quantile(0.5), 1.0)
+        self.assertEqual(histogram.quantile(0.99), None)
+
+    def test_hooks_receive_every_call(self):
+        calls = []
+        self.registry.add_hook(calls.append)
+        self.registry.record(CallStats('/content.json', 'GET'))
+        self.assertEqual([call.endpoint for call in calls], ['/content.json'])
+
+    def test_openmetrics(self):
+        text = self.registry.to_openmetrics()
+        self.assertTrue('fwix_request_phase_seconds_bucket{endpoint="/places.json",phase="total",le="+Inf"} 3\n' in text)
+        self.assertTrue('fwix_requests_total{endpoint="/places.json",method="GET",outcome="200"} 3\n' in text)
+        self.assertTrue('fwix_items_total{endpoint="/places.json"} 9\n' in text)
+        self.assertTrue(text.endswith('# EOF\n'))
+
+    def test_endpoint_name(self):
+        self.assertEqual(endpoint_name('/places/abc-123.json'), '/places/{uuid}.json')
+        self.assertEqual(endpoint_name('/places.json'), '/places.json')
+
+if __name__ == '__main__':
+    unittest.main()
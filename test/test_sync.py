@@ -0,0 +1,55 @@
+import unittest
+import os, tempfile
+
+import sys
+sys.path.append('..')
+from fwix_geo_api.fwix_geo_api import *
+from fwix_geo_api.sync import *
+from fake_server import FakeFwixServer, make_content
+
+
+class TestContentSync(unittest.TestCase):
+
+    def setUp(self):
+        self.server = FakeFwixServer(content = 0).start()
+        self.server.content = [make_content(i, '2011-01-01 00:00:0%d' % i) for i in range(3)]
+        self.fx_api = FwixApi('key')
+        self.fx_api.kBASE_URL = self.server.base_url
+        self.sync = ContentSync(self.fx_api, page_size = 2)
+
+    def tearDown(self):
+        self.fx_api.close()
+        self.server.stop()
+
+    def sync_place(self, sync = None):
+        return [content['uuid'] for content in
+                (sync or self.sync).sync_by_place('place-0', kCONTENT_TYPE_NEWS)]
+
+    def test_only_additions_are_returned(self):
+        self.assertEqual(self.sync_place(), ['content-0', 'content-1', 'content-2'])
+        self.assertEqual(self.sync_place(), [])
+        self.server.content.append(make_content(3, '2011-01-01 00:00:02'))
+        self.server.content.append(make_content(4, '2011-01-01 00:00:05'))
+        del self.server.requests[:]
+        self.assertEqual(self.sync_place(), ['content-3', 'content-4'])
+        self.assertEqual(self.server.requests[0][2]['start_date'], '2011-01-01 00:00:02')
+        self.assertEqual(self.sync.stats()['stored'], 5)
+
+    def test_first_sync_is_windowed(self):
+        sync = ContentSync(self.fx_api, page_size = 2, since = '2011-01-01 00:00:01', max_items = 1)
+        self.assertEqual(self.sync_place(sync), ['content-1'])
+        self.assertEqual(self.server.requests[0][2]['start_date'], '2011-01-01 00:00:01')
+        self.assertEqual(self.sync_place(sync), ['content-2'])
+
+    def test_state_is_restored(self):
+        self.sync_place()
+        path = os.path.join(tempfile.mkdtemp(), 'sync.json')
+        self.sync.save_state(path)
+        sync = ContentSync(self.fx_api)
+        sync.load_state(path)
+        self.assertEqual(sync.watermarks(), self.sync.watermarks())
+        self.assertEqual(self.sync_place(sync), [])
+        os.remove(path)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,71 @@
+import unittest
+import time
+
+import sys
+sys.path.append('..')
+from fwix_geo_api.throttle import *
+
+
+class TestTokenBucket(unittest.TestCase):
+
+    def test_burst_then_rate(self):
+        bucket = TokenBucket(50, burst = 5)
+        start = time.time()
+        for i in range(10):
+            bucket.acquire()
+        elapsed = time.time() - start
+        self.assertTrue(0.08 <= elapsed < 0.5, elapsed)
+
+    def test_buckets_are_shared_per_key(self):
+        self.assertTrue(TokenBucket.for_key('a', 10) is TokenBucket.for_key('a', 10))
+        self.assertFalse(TokenBucket.for_key('a', 10) is TokenBucket.for_key('b', 10))
+        self.assertRaises(ValueError, TokenBucket.for_key, 'a', 20)
+        self.assertRaises(ValueError, TokenBucket.for_key, 'a', 10, 50)
+
+
+class TestAdaptiveConcurrency(unittest.TestCase):
+
+    def test_additive_increase_multiplicative_decrease(self):
+        concurrency = AdaptiveConcurrency(initial = 4, minimum = 1, maximum = 5)
+        for i in range(4):
+            concurrency.acquire()
+            concurrency.release()
+        self.assertEqual(concurrency.limit, 5)
+        for i in range(10):
+            concurrency.acquire()
+            concurrency.release()
+        self.assertEqual(concurrency.limit, 5)
+        for limit in (2, 1, 1):
+            concurrency.acquire()
+            concurrency.release(overloaded = True)
+            self.assertEqual(concurrency.limit, limit)
+
+    def test_a_burst_of_overloads_halves_once(self):
+        concurrency = AdaptiveConcurrency(initial = 8)
+        for i in range(8):
+            concurrency.acquire()
+        for i in range(8):
+            concurrency.release(overloaded = True)
+        self.assertEqual(concurrency.limit, 4)
+        concurrency.acquire()
+        concurrency.release(overloaded = True)
+        self.assertEqual(concurrency.limit, 2)
+
+
+class TestRetryPolicy(unittest.TestCase):
+
+    def test_retryable_failures(self):
+        policy = RetryPolicy(max_retries = 2)
+        self.assertTrue(policy.should_retry(0, 503))
+        self.assertTrue(policy.should_retry(1, None))
+        self.assertFalse(policy.should_retry(2, 503))
+        self.assertFalse(policy.should_retry(0, 404))
+
+    def test_jittered_delays_are_bounded(self):
+        policy = RetryPolicy(base_delay = 0.1, max_delay = 1.0)
+        for attempt in range(8):
+            self.assertTrue(0 <= policy.delay(attempt) <= min(1.0, 0.1 * 2 ** attempt))
+        self.assertEqual(policy.delay(0, retry_after = 5), 1.0)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,177 @@
+import unittest
+import httplib
+import socket
+import threading
+import time
+import zlib
+import BaseHTTPServer
+
+import sys
+sys.path.append('..')
+from fwix_geo_api.transport import *
+
+
+class KeepAliveHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        body = '{"path": "%s"}' % self.path
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class DroppedConnection(object):
+    """ A kept-alive connection the server closed after reading the request"""
+
+    sock = None
+
+    def request(self, method, path, body, headers):
+        pass
+
+    def getresponse(self):
+        raise httplib.BadStatusLine('')
+
+    def close(self):
+        pass
+
+
+kBODY = '{"items": [%s]}' % ', '.join(['"item"'] * 5000)
+
+
+class CompressingHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        encoders = {'/gzip': ('gzip', zlib.compressobj(9, zlib.DEFLATED, 16 + zlib.MAX_WBITS)),
+                    '/deflate': ('deflate', zlib.compressobj(9)),
+                    '/raw-deflate': ('deflate', zlib.compressobj(9, zlib.DEFLATED, -zlib.MAX_WBITS))}
+        self.send_response(200)
+        body = kBODY
+        if self.path in encoders and 'gzip' in self.headers.getheader('Accept-Encoding', ''):
+            encoding, encoder = encoders[self.path]
+            body = encoder.compress(body) + encoder.flush()
+            self.send_header('Content-Encoding', encoding)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class TestConnectionPool(unittest.TestCase):
+
+    def setUp(self):
+        self.server = BaseHTTPServer.HTTPServer(('127.0.0.1', 0), KeepAliveHandler)
+        thread = threading.Thread(target = self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.base_url = 'http://127.0.0.1:%d' % self.server.server_port
+        self.pool = ConnectionPool(max_size = 2)
+
+    def tearDown(self):
+        self.pool.close()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_connection_is_reused(self):
+        for path in ('/a', '/b', '/c'):
+            response = self.pool.request('GET', self.base_url + path)
+            self.assertEqual(response.read(), '{"path": "%s"}' % path)
+            response.close()
+        stats = self.pool.stats()
+        self.assertEqual(stats['created'], 1)
+        self.assertEqual(stats['reused'], 2)
+
+    def test_unread_response_is_discarded(self):
+        response = self.pool.request('GET', self.base_url + '/a')
+        response.close()
+        self.assertEqual(self.pool.stats()['discarded'], 1)
+
+    def test_stale_connection_is_replaced(self):
+        response = self.pool.request('GET', self.base_url + '/a')
+        response.read()
+        self.pool.idle_timeout = -1
+        response = self.pool.request('GET', self.base_url + '/b')
+        self.assertEqual(response.read(), '{"path": "/b"}')
+        stats = self.pool.stats()
+        self.assertEqual(stats['stale'], 1)
+        self.assertEqual(stats['created'], 2)
+
+    def test_only_idempotent_requests_are_resent(self):
+        key = ('http', self.base_url[len('http://'):])
+        self.pool._is_healthy = lambda conn, last_used: True
+        for method in ('POST', 'GET'):
+            self.pool._idle[key] = [(DroppedConnection(), time.time())]
+            if method == 'POST':
+                self.assertRaises(httplib.BadStatusLine, self.pool.request, method, self.base_url + '/a')
+            else:
+                self.assertEqual(self.pool.request(method, self.base_url + '/a').read(), '{"path": "/a"}')
+        self.assertEqual(self.pool.stats()['reconnects'], 1)
+
+    def test_cancelled_requests_are_not_resent(self):
+        self.pool.request('GET', self.base_url + '/a').read()
+        cancellation = Cancellation()
+        cancellation.cancel()
+        self.assertRaises(socket.error, self.pool.request, 'GET', self.base_url + '/b',
+                          cancellation = cancellation)
+        self.assertEqual(self.pool.stats()['reconnects'], 0)
+
+
+class TestCompression(unittest.TestCase):
+
+    def setUp(self):
+        self.server = BaseHTTPServer.HTTPServer(('127.0.0.1', 0), CompressingHandler)
+        thread = threading.Thread(target = self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.base_url = 'http://127.0.0.1:%d' % self.server.server_port
+        self.pool = ConnectionPool()
+
+    def tearDown(self):
+        self.pool.close()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_encodings_are_decoded(self):
+        for path in ('/gzip', '/deflate', '/raw-deflate', '/identity'):
+            response = self.pool.request('GET', self.base_url + path)
+            self.assertEqual(response.read(), kBODY, path)
+            response.close()
+        stats = self.pool.stats()
+        self.assertEqual(stats['created'], 1)
+        self.assertEqual(stats['bytes_decoded'], 4 * len(kBODY))
+        self.assertTrue(stats['bytes_received'] < 2 * len(kBODY))
+
+    def test_incremental_reads(self):
+        response = self.pool.request('GET', self.base_url + '/gzip')
+        chunks = []
+        while True:
+            chunk = response.read(1000)
+            if not chunk:
+                break
+            self.assertTrue(len(chunk) <= 1000)
+            chunks.append(chunk)
+        self.assertEqual(''.join(chunks), kBODY)
+        self.assertEqual(response.bytes_decoded, len(kBODY))
+        self.assertTrue(response.bytes_read < len(kBODY) / 10)
+
+
+class TestSingleFlight(unittest.TestCase):
+
+    def test_errors_are_shared_and_calls_forgotten(self):
+        single_flight = SingleFlight()
+        def fail():
+            raise ValueError('boom')
+        self.assertRaises(ValueError, single_flight.do, 'key', fail)
+        self.assertEqual(single_flight.do('key', lambda: 1), 1)
+        self.assertEqual(single_flight.stats(), {'calls': 2, 'coalesced': 0})
+
+if __name__ == '__main__':
+    unittest.main()